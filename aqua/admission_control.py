@@ -0,0 +1,101 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+from token_bucket import TokenBucket
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class AdmissionControl(object):
+    """
+    Admitting or shedding the commands before parsing them, so one user or channel (ex: a spammer, or a looping
+    integration) can not saturate the Bot and starve the others.
+
+    - Each user and each channel has a token bucket, the command is shed if either has no token, and the tokens
+      are only consumed when both have.
+    - The command is shed if the queue depth (ex: the pending commands and outgoing messages) is over the limit.
+    The buckets are kept in LRU order, at most max_buckets of users and of channels.
+    """
+    SHED_USER = 'user'
+    SHED_CHANNEL = 'channel'
+    SHED_QUEUE = 'queue'
+    DEFAULT_MAX_BUCKETS = 10000
+
+    def __init__(self, user_rate=None, user_burst=None, channel_rate=None, channel_burst=None, max_queue_depth=None,
+                 queue_depth_func=None, max_buckets=None):
+        """
+        :param user_rate: the commands per second of each user, None or 0 is no limit.
+        :param user_burst: the commands can be run at once of each user, default is max(1, user_rate).
+        :param channel_rate: the commands per second of each channel, None or 0 is no limit.
+        :param channel_burst: the commands can be run at once of each channel, default is max(1, channel_rate).
+        :param max_queue_depth: None or 0 is no limit.
+        :param queue_depth_func: the callable which returns current queue depth.
+        :param max_buckets: the max buckets of users, and of channels.
+        """
+        self.user_rate = user_rate
+        self.user_burst = user_burst or max(1, user_rate or 0)
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst or max(1, channel_rate or 0)
+        self.max_queue_depth = max_queue_depth
+        self.queue_depth_func = queue_depth_func
+        self.max_buckets = max_buckets or self.DEFAULT_MAX_BUCKETS
+        self.user_buckets = OrderedDict()
+        self.channel_buckets = OrderedDict()
+        self.lock = threading.Lock()
+        # {shed reason: count}
+        self.shed_counts = {}
+
+    @property
+    def enabled(self):
+        return bool(self.user_rate or self.channel_rate or self.max_queue_depth)
+
+    def get_bucket(self, buckets, key, rate, burst):
+        with self.lock:
+            bucket = buckets.pop(key, None)
+            if bucket is None:
+                bucket = TokenBucket(rate, burst)
+                if len(buckets) >= self.max_buckets:
+                    buckets.popitem(last=False)
+            buckets[key] = bucket
+        return bucket
+
+    def admit(self, user_id, channel_id):
+        """
+        :param user_id:
+        :param channel_id:
+        :return: None if the command is admitted, else the shed reason, ex: AdmissionControl.SHED_USER.
+        """
+        reason = None
+        if self.max_queue_depth and self.queue_depth_func and self.queue_depth_func() >= self.max_queue_depth:
+            reason = self.SHED_QUEUE
+        else:
+            user_bucket = None
+            channel_bucket = None
+            if self.user_rate and user_id:
+                user_bucket = self.get_bucket(self.user_buckets, user_id, self.user_rate, self.user_burst)
+            if self.channel_rate and channel_id:
+                channel_bucket = self.get_bucket(self.channel_buckets, channel_id, self.channel_rate,
+                                                 self.channel_burst)
+            # checking both buckets before consuming, so the user does not pay for the shed of a busy channel
+            with self.lock:
+                if user_bucket is not None and user_bucket.wait_time():
+                    reason = self.SHED_USER
+                elif channel_bucket is not None and channel_bucket.wait_time():
+                    reason = self.SHED_CHANNEL
+                else:
+                    for bucket in (user_bucket, channel_bucket):
+                        if bucket is not None:
+                            bucket.consume()
+        if reason is not None:
+            with self.lock:
+                self.shed_counts[reason] = self.shed_counts.get(reason, 0) + 1
+        return reason
+
+    def format_stats(self):
+        return 'shed: {counts}, buckets: {u} users, {c} channels'.format(counts=self.shed_counts,
+                                                                         u=len(self.user_buckets),
+                                                                         c=len(self.channel_buckets))
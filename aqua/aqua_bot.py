@@ -1,13 +1,34 @@
 # -*- encoding: utf-8 -*-
 
 import os
-import re
 import json
 import time
 import logging
+import tempfile
+import threading
+from collections import OrderedDict
 from slackclient import SlackClient
 
-from util import Util
+from util import Util, SlackApiError
+from directory import Directory
+from slack_user import SlackUser
+from slack_channel import SlackChannel
+from command_dispatcher import CommandDispatcher
+from command_registry import CommandRegistry
+from command_executor import CommandExecutor
+from outbound_queue import OutboundQueue
+from web_api_transport import WebApiTransport
+from bot_cmd.cmd_context import CmdContext
+from rtm_receiver import RtmReceiver, RtmConnectionError
+from backoff import Backoff
+from process_shards import ProcessShards
+from message_dedup import MessageDedup, EditDebouncer
+from admission_control import AdmissionControl
+from command_profiler import CommandProfiler
+from latency_stats import LatencyStats
+from metrics import Metrics
+from log_util import LogUtil, LogSampler
+from workspace_snapshot import WorkspaceSnapshot
 
 logging.basicConfig(level=logging.INFO)
 
@@ -15,41 +36,177 @@ logging.basicConfig(level=logging.INFO)
 class AquaBot(object):
     CONFIG_FILE = 'config.json'
     DEFAULT_DELAY_SEC = 1
+    DEFAULT_IDLE_TIMEOUT_SEC = 30
+    DEFAULT_SNAPSHOT_INTERVAL_SEC = 300
+    DEFAULT_PING_INTERVAL_SEC = 30
+    DEFAULT_PING_TIMEOUT_SEC = 10
+    DEFAULT_RECONNECT_BASE_SEC = 1
+    DEFAULT_RECONNECT_MAX_SEC = 60
+    DEFAULT_EDIT_DEBOUNCE_SEC = 1
 
     KEY_BOT_NAME = 'bot-name'
     KEY_API_TOKEN = 'api-token'
+    KEY_RECEIVE_MODE = 'receive-mode'
+    KEY_RECEIVE_MAX_FRAMES = 'receive-max-frames'
+    KEY_IDLE_TIMEOUT_SEC = 'idle-timeout-sec'
+    KEY_PAGE_SIZE = 'page-size'
+    KEY_COMMAND_EXECUTOR = 'command-executor'
+    KEY_COMMAND_WORKERS = 'command-workers'
+    KEY_COMMAND_TIMEOUT_SEC = 'command-timeout-sec'
+    KEY_WEB_API_TRANSPORT = 'web-api-transport'
+    KEY_WEB_API_BASE_URL = 'web-api-base-url'
+    KEY_WEB_API_POOL_SIZE = 'web-api-pool-size'
+    KEY_WEB_API_TIMEOUT_SEC = 'web-api-timeout-sec'
+    KEY_LOG_FORMAT = 'log-format'
+    KEY_LOG_QUEUE = 'log-queue'
+    KEY_LOG_SAMPLE_RATE = 'log-sample-rate'
+    KEY_METRICS = 'metrics'
+    KEY_METRICS_PORT = 'metrics-port'
+    KEY_OUTBOUND_QUEUE = 'outbound-queue'
+    KEY_OUTBOUND_RATE_PER_SEC = 'outbound-rate-per-sec'
+    KEY_OUTBOUND_MAX_RETRIES = 'outbound-max-retries'
+    KEY_SNAPSHOT_PATH = 'snapshot-path'
+    KEY_SNAPSHOT_MAX_AGE_SEC = 'snapshot-max-age-sec'
+    KEY_SNAPSHOT_INTERVAL_SEC = 'snapshot-interval-sec'
+    KEY_PING_INTERVAL_SEC = 'ping-interval-sec'
+    KEY_PING_TIMEOUT_SEC = 'ping-timeout-sec'
+    KEY_RECONNECT_BASE_SEC = 'reconnect-base-sec'
+    KEY_RECONNECT_MAX_SEC = 'reconnect-max-sec'
+    KEY_RECONNECT_MAX_ATTEMPTS = 'reconnect-max-attempts'
+    KEY_PROCESS_SHARDS = 'process-shards'
+    KEY_PROCESS_SHARD_QUEUE_SIZE = 'process-shard-queue-size'
+    KEY_MESSAGE_DEDUP_SIZE = 'message-dedup-size'
+    KEY_MESSAGE_DEDUP_TTL_SEC = 'message-dedup-ttl-sec'
+    KEY_EDIT_DEBOUNCE_SEC = 'edit-debounce-sec'
+    KEY_ADMISSION_USER_RATE_PER_SEC = 'admission-user-rate-per-sec'
+    KEY_ADMISSION_USER_BURST = 'admission-user-burst'
+    KEY_ADMISSION_CHANNEL_RATE_PER_SEC = 'admission-channel-rate-per-sec'
+    KEY_ADMISSION_CHANNEL_BURST = 'admission-channel-burst'
+    KEY_ADMISSION_MAX_QUEUE_DEPTH = 'admission-max-queue-depth'
+    KEY_INGRESS_FILTER = 'ingress-filter'
+    KEY_COMMAND_PROFILER = 'command-profiler'
+    KEY_COMMAND_PROFILER_MODE = 'command-profiler-mode'
+    KEY_COMMAND_PROFILER_SAMPLE_RATE = 'command-profiler-sample-rate'
+    KEY_COMMAND_PROFILER_SLOW_SEC = 'command-profiler-slow-sec'
+    KEY_COMMAND_PROFILER_REPORT = 'command-profiler-report'
+    KEY_COMMAND_PROFILER_FLAG_FILE = 'command-profiler-flag-file'
+
+    # 'event' blocks on the websocket and wakes up once a frame arrives, 'poll' reads it every DEFAULT_DELAY_SEC.
+    RECEIVE_MODE_EVENT = 'event'
+    RECEIVE_MODE_POLL = 'poll'
+
+    # 'sync' runs commands in the RTM loop, 'thread' runs commands by the worker threads.
+    COMMAND_EXECUTOR_SYNC = 'sync'
+    COMMAND_EXECUTOR_THREAD = 'thread'
+
+    # the id of DM channel starts with 'D', and the id of private channel (group) starts with 'G'
+    DM_CHANNEL_PREFIX = 'D'
+    GROUP_PREFIX = 'G'
 
     EVENT_TYPES_HANDLERS = {
         'message': 'handle_rtm_message',
+        # keeping the users and channels directories up to date
+        'user_change': 'handle_rtm_user_change',
+        'team_join': 'handle_rtm_user_change',
+        'channel_created': 'handle_rtm_channel_created',
+        'channel_rename': 'handle_rtm_channel_rename',
+        'channel_archive': 'handle_rtm_channel_archive',
+        'channel_unarchive': 'handle_rtm_channel_archive',
+        'channel_deleted': 'handle_rtm_channel_deleted',
+        'member_joined_channel': 'handle_rtm_member_channel',
+        'member_left_channel': 'handle_rtm_member_channel',
+        'im_created': 'handle_rtm_im_created',
+        # the private channels
+        'group_joined': 'handle_rtm_channel_created',
+        'group_rename': 'handle_rtm_channel_rename',
+        'group_left': 'handle_rtm_channel_deleted',
     }
 
     COMMANDS_TYPE_CLASS = 'class_cmd'
     COMMANDS_TYPE_METHOD = 'method_cmd'
 
-    # The sequential of handlers will effect the checking sequence
-    COMMANDS_HANDLERS = {
-        r'(^|.*\s+)(help)(\s+|$)': {
+    # The sequential of handlers will effect the checking sequence.
+    # The optional 'keywords' is the prefilter, the message must contain one of keywords to match the command.
+    # The optional 'timeout' is the seconds of command timeout when commands are run by the worker threads.
+    COMMANDS_HANDLERS = OrderedDict([
+        (r'(^|.*\s+)(help)(\s+|$)', {
             'cmd_type': 'method_cmd',
             'method_cmd': 'show_usage',
+            'keywords': ['help'],
             'usage': 'help\tShow usage information.'
-        },
-        r'(^|.*\s+)(hello|hi|greeting|konnichi wa|konnichiwa|こんにちは)(\s+|$)': {
+        }),
+        (r'(^|.*\s+)(hello|hi|greeting|konnichi wa|konnichiwa|こんにちは)(\s+|$)', {
             'cmd_type': 'class_cmd',
             'class_cmd': 'bot_cmd.greeting.Greeting',
+            'keywords': ['hello', 'hi', 'greeting', 'konnichi', 'こんにちは'],
             'usage': 'hello|hi|greeting\tGreeting :)'
-        }
-    }
+        })
+    ])
 
-    def __init__(self):
+    def __init__(self, config=None, slack_client=None, command_dispatcher=None, command_classes=None,
+                 command_executor=None):
+        """
+        :param config: a dict of config, or loading it from config.json.
+        :param slack_client: the SlackClient object, or creating it by api token.
+        :param command_dispatcher: the shared CommandDispatcher, or compiling it from COMMANDS_HANDLERS.
+        :param command_classes: the shared dict of resolved command classes, ref: CommandRegistry.
+        :param command_executor: the shared CommandExecutor, or creating it by config.
+        """
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.config_file = self.load_config()
+        self.config_file = config if config is not None else self.load_config()
+        LogUtil.configure(log_format=self.config_file.get(self.KEY_LOG_FORMAT),
+                          log_queue=self.config_file.get(self.KEY_LOG_QUEUE))
+        # sampling the per-message INFO logs
+        self.log_sampler = LogSampler(self.config_file.get(self.KEY_LOG_SAMPLE_RATE, 1.0))
         self.commands_usage = self.load_commands_usage()
+        self.command_dispatcher = command_dispatcher or CommandDispatcher(self.COMMANDS_HANDLERS)
+        # {event type: bound handler method}
+        self.event_handlers = dict((evt_type, getattr(self, handler_name))
+                                   for evt_type, handler_name in self.EVENT_TYPES_HANDLERS.items())
 
         self.bot_name = self.config_file.get(self.KEY_BOT_NAME).lower()
         self.api_token = self.config_file.get(self.KEY_API_TOKEN)
         self.bot_id = None
+        self.bot_id_tag = None
+        # the DM channels which are detected by channel name or created by im_created event
+        self.dm_channel_ids = set()
+        self.users_directory = Directory()
+        self.channels_directory = Directory()
+        self.receive_mode = self.config_file.get(self.KEY_RECEIVE_MODE, self.RECEIVE_MODE_EVENT)
+        self.idle_timeout = self.config_file.get(self.KEY_IDLE_TIMEOUT_SEC, self.DEFAULT_IDLE_TIMEOUT_SEC)
+        self.page_size = self.config_file.get(self.KEY_PAGE_SIZE, Util.DEFAULT_PAGE_SIZE)
+        self.dispatch_latency = LatencyStats('receive-to-dispatch')
+        self.metrics = self.create_metrics()
         # init the slack_client
-        self.slack_client = SlackClient(self.api_token)
+        self.slack_client = slack_client or SlackClient(self.api_token)
+        self.command_registry = CommandRegistry(self.slack_client, self.load_command_class_names(),
+                                                command_classes=command_classes)
+        self.command_executor = command_executor or self.create_command_executor()
+        self.command_profiler = self.create_command_profiler()
+        self.web_api_transport = self.create_web_api_transport()
+        self.outbound_queue = self.create_outbound_queue()
+        self.process_shards = self.create_process_shards()
+        self.message_dedup, self.edit_debouncer = self.create_message_dedup()
+        self.admission_control = self.create_admission_control()
+        self.workspace_snapshot = self.create_workspace_snapshot()
+        self.snapshot_interval = self.config_file.get(self.KEY_SNAPSHOT_INTERVAL_SEC,
+                                                      self.DEFAULT_SNAPSHOT_INTERVAL_SEC)
+        self.snapshot_saved_at = 0
+        # the thread of directory job in background, ex: reconciling the directories, or saving the snapshot
+        self.reconcile_thread = None
+        # the directory events which arrive while the directories are loaded in background, they are replayed onto
+        # the loaded directories, ref: begin_directory_reload(), and swap_directories()
+        self.directory_lock = threading.Lock()
+        self.directory_deltas = None
+        self.directory_generation = 0
+        # the state of connection, ref: connect(), and disconnect()
+        self.receiver = None
+        self.is_session_started = False
+        self.from_snapshot = None
+        self.last_housekeeping = time.time()
+        self.reconnect_backoff = Backoff(
+            base_sec=self.config_file.get(self.KEY_RECONNECT_BASE_SEC, self.DEFAULT_RECONNECT_BASE_SEC),
+            max_sec=self.config_file.get(self.KEY_RECONNECT_MAX_SEC, self.DEFAULT_RECONNECT_MAX_SEC))
 
     def load_config(self):
         """
@@ -76,6 +233,173 @@ class AquaBot(object):
                 usage_list.append(usage_fmt.format(cmd_usage=command_usage))
         return '\n'.join(usage_list)
 
+    def load_command_class_names(self):
+        return [command_handler_obj.get(self.COMMANDS_TYPE_CLASS)
+                for command_handler_obj in self.COMMANDS_HANDLERS.values()
+                if command_handler_obj.get('cmd_type') == self.COMMANDS_TYPE_CLASS and
+                command_handler_obj.get(self.COMMANDS_TYPE_CLASS)]
+
+    def create_metrics(self):
+        """
+        Enabling the process-wide Metrics, and starting the local metrics endpoint if there is metrics port.
+        :return: Metrics object.
+        """
+        metrics = Metrics.get_instance()
+        if self.config_file.get(self.KEY_METRICS):
+            metrics.enabled = True
+            metrics_port = self.config_file.get(self.KEY_METRICS_PORT)
+            if metrics_port and metrics.http_server is None:
+                metrics.start_http_server(metrics_port)
+        return metrics
+
+    def create_command_executor(self):
+        """
+        :return: CommandExecutor object, or None if commands are run in the RTM loop.
+        """
+        executor_type = self.config_file.get(self.KEY_COMMAND_EXECUTOR, self.COMMAND_EXECUTOR_SYNC)
+        if executor_type == self.COMMAND_EXECUTOR_THREAD:
+            return CommandExecutor(workers=self.config_file.get(self.KEY_COMMAND_WORKERS),
+                                   timeout=self.config_file.get(self.KEY_COMMAND_TIMEOUT_SEC))
+        return None
+
+    def create_command_profiler(self):
+        """
+        Configuring the process-wide CommandProfiler, it can be toggled at runtime by SIGUSR1 or the flag file.
+        :return: CommandProfiler object.
+        """
+        command_profiler = CommandProfiler.get_instance().configure(
+            mode=self.config_file.get(self.KEY_COMMAND_PROFILER_MODE),
+            sample_rate=self.config_file.get(self.KEY_COMMAND_PROFILER_SAMPLE_RATE),
+            slow_threshold_sec=self.config_file.get(self.KEY_COMMAND_PROFILER_SLOW_SEC),
+            report_path=self.config_file.get(self.KEY_COMMAND_PROFILER_REPORT),
+            flag_path=self.config_file.get(self.KEY_COMMAND_PROFILER_FLAG_FILE))
+        command_profiler.install_signal_handler()
+        if self.config_file.get(self.KEY_COMMAND_PROFILER):
+            command_profiler.set_enabled(True)
+        return command_profiler
+
+    def create_web_api_transport(self):
+        """
+        Creating and registering the WebApiTransport of slack_client, then Util.api_call() will use the pooled
+        connections.
+        :return: WebApiTransport object, or None if using slack_client.api_call.
+        """
+        if not self.config_file.get(self.KEY_WEB_API_TRANSPORT):
+            return None
+        transport = WebApiTransport(self.api_token,
+                                    base_url=self.config_file.get(self.KEY_WEB_API_BASE_URL),
+                                    pool_size=self.config_file.get(self.KEY_WEB_API_POOL_SIZE),
+                                    timeout=self.config_file.get(self.KEY_WEB_API_TIMEOUT_SEC))
+        WebApiTransport.register(self.slack_client, transport)
+        return transport
+
+    def create_outbound_queue(self):
+        """
+        Creating and registering the OutboundQueue of slack_client, then Util.send() will not block.
+        The queue sends by WebApiTransport, which returns the Retry-After of rate limited response. If the Web API
+        transport is off, the queue has its own transport, since slackclient api_call() drops the response headers.
+        A custom slack_client (ex: the stand-in of benchmark) keeps its own api_call.
+        :return: OutboundQueue object, or None if messages are sent synchronously.
+        """
+        if not self.config_file.get(self.KEY_OUTBOUND_QUEUE):
+            return None
+        api_call = None
+        if self.web_api_transport:
+            api_call = self.web_api_transport.api_call
+        elif isinstance(self.slack_client, SlackClient):
+            # only the sender thread uses it, one connection is enough
+            api_call = WebApiTransport(self.api_token,
+                                       base_url=self.config_file.get(self.KEY_WEB_API_BASE_URL),
+                                       pool_size=1,
+                                       timeout=self.config_file.get(self.KEY_WEB_API_TIMEOUT_SEC)).api_call
+        outbound_queue = OutboundQueue(self.slack_client,
+                                       api_call=api_call,
+                                       rate_per_sec=self.config_file.get(self.KEY_OUTBOUND_RATE_PER_SEC),
+                                       max_retries=self.config_file.get(self.KEY_OUTBOUND_MAX_RETRIES))
+        OutboundQueue.register(self.slack_client, outbound_queue)
+        return outbound_queue
+
+    def create_process_shards(self):
+        """
+        Creating the shard worker processes, which are started after the session is started.
+        The workers load the directories from workspace snapshot, so the snapshot is written to the temp folder if
+        there is no snapshot path.
+        :return: ProcessShards object, or None if the events are handled in this process.
+        """
+        workers = self.config_file.get(self.KEY_PROCESS_SHARDS)
+        if not workers:
+            return None
+        if not self.config_file.get(self.KEY_SNAPSHOT_PATH):
+            snapshot_path = os.path.join(tempfile.gettempdir(), 'aqua-snapshot-{pid}.json.gz'.format(pid=os.getpid()))
+            self.config_file = dict(self.config_file, **{self.KEY_SNAPSHOT_PATH: snapshot_path})
+        return ProcessShards(self.__class__, self.config_file, workers,
+                             reply_handler=self.send_shard_reply,
+                             queue_size=self.config_file.get(self.KEY_PROCESS_SHARD_QUEUE_SIZE))
+
+    def send_shard_reply(self, method, kwargs):
+        """
+        Sending the reply of shard worker, by the OutboundQueue if there is one.
+        :param method: ex: chat.postMessage
+        :param kwargs: the arguments of method.
+        """
+        if method == 'chat.postMessage' and self.outbound_queue is not None:
+            return self.outbound_queue.enqueue(kwargs.get('channel'), kwargs.get('text'))
+        ret = Util.api_call(self.slack_client, method, **kwargs)
+        if not ret.get('ok'):
+            self.logger.error('Sending reply of shard failed!\n{ret}'.format(ret=ret))
+            return False
+        return True
+
+    def create_message_dedup(self):
+        """
+        :return: (MessageDedup object, EditDebouncer object), each of them is None if it is disabled by 0 in config.
+        """
+        message_dedup = None
+        edit_debouncer = None
+        dedup_size = self.config_file.get(self.KEY_MESSAGE_DEDUP_SIZE, MessageDedup.DEFAULT_MAX_SIZE)
+        if dedup_size:
+            message_dedup = MessageDedup(max_size=dedup_size,
+                                         ttl_sec=self.config_file.get(self.KEY_MESSAGE_DEDUP_TTL_SEC))
+        debounce_sec = self.config_file.get(self.KEY_EDIT_DEBOUNCE_SEC, self.DEFAULT_EDIT_DEBOUNCE_SEC)
+        if debounce_sec:
+            edit_debouncer = EditDebouncer(debounce_sec)
+        return message_dedup, edit_debouncer
+
+    def create_admission_control(self):
+        """
+        :return: AdmissionControl object, or None if there is no limit in config.
+        """
+        admission_control = AdmissionControl(
+            user_rate=self.config_file.get(self.KEY_ADMISSION_USER_RATE_PER_SEC),
+            user_burst=self.config_file.get(self.KEY_ADMISSION_USER_BURST),
+            channel_rate=self.config_file.get(self.KEY_ADMISSION_CHANNEL_RATE_PER_SEC),
+            channel_burst=self.config_file.get(self.KEY_ADMISSION_CHANNEL_BURST),
+            max_queue_depth=self.config_file.get(self.KEY_ADMISSION_MAX_QUEUE_DEPTH),
+            queue_depth_func=self.get_queue_depth)
+        return admission_control if admission_control.enabled else None
+
+    def get_queue_depth(self):
+        """
+        :return: the number of pending commands and outgoing messages, including the events queued to shard workers.
+        """
+        depth = 0
+        if self.command_executor is not None:
+            depth += self.command_executor.pending_count()
+        if self.outbound_queue is not None:
+            depth += self.outbound_queue.pending_count()
+        if self.process_shards is not None:
+            depth += self.process_shards.pending_count()
+        return depth
+
+    def create_workspace_snapshot(self):
+        """
+        :return: WorkspaceSnapshot object, or None if there is no snapshot path.
+        """
+        snapshot_path = self.config_file.get(self.KEY_SNAPSHOT_PATH)
+        if not snapshot_path:
+            return None
+        return WorkspaceSnapshot(snapshot_path, max_age_sec=self.config_file.get(self.KEY_SNAPSHOT_MAX_AGE_SEC))
+
     def show_usage(self, **kwargs):
         """
         There are (user_obj, channel_obj, users_list, words_list, origin_message, slack_client) contain in kwargs.
@@ -94,59 +418,116 @@ class AquaBot(object):
         :return:
         """
         evt_type = rtm_result.get('type')
-        for evt in self.EVENT_TYPES_HANDLERS.keys():
-            if evt == evt_type:
-                return self.__getattribute__(self.EVENT_TYPES_HANDLERS[evt])(rtm_result)
-        return False
+        self.metrics.incr('events', evt_type)
+        handler = self.event_handlers.get(evt_type)
+        if handler is None:
+            return False
+        if evt_type == 'message':
+            with self.metrics.timer('handle_rtm', evt_type):
+                return handler(rtm_result)
+        with self.metrics.timer('handle_rtm', evt_type):
+            with self.directory_lock:
+                if self.directory_deltas is not None:
+                    self.directory_deltas.append(rtm_result)
+                ret = handler(rtm_result)
+        if self.process_shards is not None:
+            # the workers keep their directories by the events, ref: process_rtm_message() for the messages.
+            # it is broadcast after applied, so the snapshot which is saved later always has it.
+            self.process_shards.broadcast(rtm_result)
+        return ret
 
     def handle_rtm_message(self, rtm_result):
         """
-
+        Skipping the messages which are not addressed to bot, dropping the redelivered messages, and debouncing the
+        edits, then processing the message.
         :param rtm_result:
         :return:
         """
-        self.logger.info('### RTM income payload: {}'.format(rtm_result))
+        text, _, channel_id = self.get_message_fields(rtm_result)
+        # fast path: skip the message which is not addressed to bot, before any lookup and formatting.
+        # it runs first, so the chatter never evicts the keys of dedup or fills the debouncer.
+        if not text or not self.is_addressed_to_bot(text, channel_id):
+            return True
+        ts = rtm_result.get('ts')
+        if self.message_dedup is not None and ts and self.message_dedup.is_duplicate((channel_id, ts)):
+            self.metrics.incr('messages', 'duplicate')
+            return True
+        if self.edit_debouncer is not None and rtm_result.get('subtype') == 'message_changed':
+            # only the last edit of a burst is processed, ref: flush_edits()
+            edited_ts = (rtm_result.get('message') or {}).get('ts') or ts
+            self.edit_debouncer.add((channel_id, edited_ts), rtm_result)
+            return True
+        return self.process_rtm_message(rtm_result)
 
+    def flush_edits(self, force=False):
+        """
+        Processing the debounced edits which are due.
+        :param force: True to process all pending edits.
+        """
+        if self.edit_debouncer is None or not len(self.edit_debouncer):
+            return
+        for rtm_result in self.edit_debouncer.pop_due(force=force):
+            with self.metrics.timer('handle_rtm', 'message_changed'):
+                self.process_rtm_message(rtm_result)
+
+    @staticmethod
+    def get_message_fields(rtm_result):
+        """
+        :param rtm_result: the message event.
+        :return: (text, user id, channel id), the text and user are of the new message if the message is changed.
+        """
         # if message changed, it will have subtype
         if rtm_result.get('subtype') == 'message_changed':
-            new_msg = rtm_result.get('message')
-            if new_msg:
-                text = new_msg.get('text')
-                # getting user and channel id
-                user_id = new_msg.get('user')
-            else:
-                return True
-        else:
-            # getting message text
-            text = rtm_result.get('text')
-            # getting user and channel id
-            user_id = rtm_result.get('user')
-        channel_id = rtm_result.get('channel')
-
-        if text:
-            message = text.encode('utf-8')
-        else:
-            return True
+            new_msg = rtm_result.get('message') or {}
+            return new_msg.get('text'), new_msg.get('user'), rtm_result.get('channel')
+        return rtm_result.get('text'), rtm_result.get('user'), rtm_result.get('channel')
+
+    def process_rtm_message(self, rtm_result):
+        """
+        Processing the message which is addressed to bot, ref: handle_rtm_message().
+        :param rtm_result:
+        :return:
+        """
+        text, user_id, channel_id = self.get_message_fields(rtm_result)
 
         # Skip if message comes from bot it-self
         if user_id == self.bot_id:
-            self.logger.debug('Message from Bot: {msg}'.format(msg=message))
+            # logging the unicode text, the encoded message can not be mixed with the unicode names on Python 2
+            self.logger.debug('Message from Bot: %s', text)
             return True
 
+        # admitting the message once, before it is parsed here or dispatched to a shard worker
+        if self.admission_control is not None:
+            shed_reason = self.admission_control.admit(user_id, channel_id)
+            if shed_reason is not None:
+                self.metrics.incr('shed', shed_reason)
+                self.logger.debug('Shed message by %s limit, User/ID: %s, Channel/ID: %s', shed_reason,
+                                  user_id, channel_id)
+                return True
+        if self.process_shards is not None:
+            # the messages are handled by shard workers, only the ones which pass the fast path cross the processes
+            return self.process_shards.dispatch(channel_id, rtm_result)
+
+        is_log_sampled = self.log_sampler.sample() and self.logger.isEnabledFor(logging.INFO)
+        if is_log_sampled:
+            self.logger.info('### RTM income payload: %s', rtm_result,
+                             extra={'fields': {'channel': channel_id, 'user': user_id}})
+        message = text.encode('utf-8')
+
         # getting channel and user name
-        user_obj = Util.find_user(self.slack_client, user_id)
-        channel_obj = Util.find_channel(self.slack_client, channel_id)
+        with self.metrics.timer('resolve'):
+            user_obj = Util.find_user(self.slack_client, user_id, self.users_directory)
+            channel_obj = Util.find_channel(self.slack_client, channel_id, self.channels_directory)
         user_name = user_obj.name if user_obj else ''
         channel_name = channel_obj.name if channel_obj else ''
-        self.logger.debug('=> handle_rtm_message'
-                          'User/ID: {u} / {uid}\nChannel/ID: {c} / {cid}\nText: {t}'.format(u=user_name,
-                                                                                            uid=user_id,
-                                                                                            c=channel_name,
-                                                                                            cid=channel_id,
-                                                                                            t=message))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('=> handle_rtm_message'
+                              'User/ID: %s / %s\nChannel/ID: %s / %s\nText: %s',
+                              user_name, user_id, channel_name, channel_id, text)
 
         # parsing the message
-        is_tag_bot, users_list, words_list = self.parse_message_text(text=message)
+        with self.metrics.timer('parse_message_text'):
+            is_tag_bot, users_list, words_list = self.parse_message_text(text=message)
         """
         Checking Direct Message.
         There are two rules:
@@ -154,21 +535,19 @@ class AquaBot(object):
                 ex: Channel name and id is D12345678.
             2. Channel Name == User ID.
                 ex: Channel name is U87654321, channel id is D12345678, user id is U87654321.
+        Or the channel is a known DM channel, ex: loaded from snapshot, the slackclient has no channel state
+        when it is connected by rtm.connect.
         """
-        if channel_name == channel_id or channel_name == user_id:
+        if channel_name == channel_id or channel_name == user_id or channel_id in self.dm_channel_ids:
             # Direct Message is similar as tag bot
             is_tag_bot = True
-            self.logger.info('[DM: {c}/{cid}] From: {u}/{uid}, Msg: {msg}'.format(c=channel_name,
-                                                                                  cid=channel_id,
-                                                                                  u=user_name,
-                                                                                  uid=user_id,
-                                                                                  msg=message))
-        else:
-            self.logger.info('[Channel: {c}/{cid}] From: {u}/{uid}, Msg: {msg}'.format(c=channel_name,
-                                                                                       cid=channel_id,
-                                                                                       u=user_name,
-                                                                                       uid=user_id,
-                                                                                       msg=message))
+            self.dm_channel_ids.add(channel_id)
+            if is_log_sampled:
+                self.logger.info('[DM: %s/%s] From: %s/%s, Msg: %s', channel_name, channel_id, user_name, user_id,
+                                 text, extra={'fields': {'channel': channel_id, 'user': user_id, 'dm': True}})
+        elif is_log_sampled:
+            self.logger.info('[Channel: %s/%s] From: %s/%s, Msg: %s', channel_name, channel_id, user_name, user_id,
+                             text, extra={'fields': {'channel': channel_id, 'user': user_id, 'dm': False}})
 
         # If Bot has been tagged, parsing commands
         if is_tag_bot:
@@ -179,18 +558,135 @@ class AquaBot(object):
                                 origin_message=message)
         return True
 
+    def is_addressed_to_bot(self, text, channel_id):
+        """
+        The cheap check of message, it is addressed to bot if bot is tagged or it comes from a DM channel.
+        The message is always addressed to bot before knowing the bot id.
+        :param text:
+        :param channel_id:
+        :return: False if the message can be skipped.
+        """
+        if self.bot_id_tag is None or self.bot_id_tag in text:
+            return True
+        if channel_id in self.dm_channel_ids:
+            return True
+        return bool(channel_id) and channel_id.startswith(self.DM_CHANNEL_PREFIX)
+
+    def handle_rtm_user_change(self, rtm_result):
+        """
+        Ref:
+            https://api.slack.com/events/user_change
+            https://api.slack.com/events/team_join
+        :param rtm_result:
+        :return:
+        """
+        user = rtm_result.get('user')
+        if isinstance(user, dict) and user.get('id'):
+            # the deleted (deactivated) users are not in directory, same as load_directories()
+            if user.get('deleted'):
+                self.users_directory.remove(user.get('id'))
+            else:
+                self.users_directory.add(SlackUser(user))
+            self.logger.debug('=> %s: User %s', rtm_result.get('type'), user.get('id'))
+        return True
+
+    def handle_rtm_channel_created(self, rtm_result):
+        """
+        Ref:
+            https://api.slack.com/events/channel_created
+            https://api.slack.com/events/group_joined
+        :param rtm_result:
+        :return:
+        """
+        channel = rtm_result.get('channel')
+        if isinstance(channel, dict) and channel.get('id'):
+            channel.setdefault('members', [])
+            self.channels_directory.add(SlackChannel(channel))
+            self.logger.debug('=> %s: Channel %s', rtm_result.get('type'), channel.get('id'))
+        return True
+
+    def handle_rtm_channel_rename(self, rtm_result):
+        """
+        Ref:
+            https://api.slack.com/events/channel_rename
+            https://api.slack.com/events/group_rename
+        :param rtm_result:
+        :return:
+        """
+        channel = rtm_result.get('channel')
+        if isinstance(channel, dict) and channel.get('id'):
+            self.channels_directory.rename(channel.get('id'), channel.get('name'))
+        return True
+
+    def handle_rtm_channel_archive(self, rtm_result):
+        """
+        Ref:
+            https://api.slack.com/events/channel_archive
+            https://api.slack.com/events/channel_unarchive
+        :param rtm_result:
+        :return:
+        """
+        channel_obj = self.channels_directory.get_by_id(rtm_result.get('channel'))
+        if channel_obj is not None:
+            channel_obj.is_archived = rtm_result.get('type') == 'channel_archive'
+        return True
+
+    def handle_rtm_channel_deleted(self, rtm_result):
+        """
+        Ref:
+            https://api.slack.com/events/channel_deleted
+            https://api.slack.com/events/group_left
+        :param rtm_result:
+        :return:
+        """
+        self.channels_directory.remove(rtm_result.get('channel'))
+        return True
+
+    def handle_rtm_member_channel(self, rtm_result):
+        """
+        Ref:
+            https://api.slack.com/events/member_joined_channel
+            https://api.slack.com/events/member_left_channel
+        :param rtm_result:
+        :return:
+        """
+        channel_obj = self.channels_directory.get_by_id(rtm_result.get('channel'))
+        user_id = rtm_result.get('user')
+        if channel_obj is None or not user_id:
+            return True
+        members = getattr(channel_obj, 'members', None)
+        if members is None:
+            members = []
+            channel_obj.members = members
+        if rtm_result.get('type') == 'member_joined_channel':
+            if user_id not in members:
+                members.append(user_id)
+        elif user_id in members:
+            members.remove(user_id)
+        return True
+
+    def handle_rtm_im_created(self, rtm_result):
+        """
+        The name of DM channel is the user id, same as slackclient.
+        Ref: https://api.slack.com/events/im_created
+        :param rtm_result:
+        :return:
+        """
+        channel = rtm_result.get('channel')
+        if isinstance(channel, dict) and channel.get('id'):
+            self.dm_channel_ids.add(channel.get('id'))
+            self.channels_directory.add(SlackChannel({'id': channel.get('id'),
+                                                      'name': channel.get('user') or channel.get('id'),
+                                                      'members': []}))
+        return True
+
     def parse_message_text(self, text):
         """
         Parsing message text.
         :param text:
         :return: (Boolean, List, List). 1st is Bot be tagged. 2nd a list of user tag. 3rd a list of words.
         """
-        bot_id_tag = '<@{bot_id}>'.format(bot_id=self.bot_id)
-        users_list, words_list = Util.parse_text_to_users_and_words(text=text)
-        is_tag_bot = False
-        if bot_id_tag in users_list:
-            is_tag_bot = True
-        return is_tag_bot, users_list, words_list
+        return Util.tokenize_text(text=text, bot_id=self.bot_id)
 
     def parse_commands(self, user_obj, channel_obj, users_list, words_list, origin_message):
         """
@@ -208,73 +704,470 @@ class AquaBot(object):
         channel_id = channel_obj.id if channel_obj else ''
         channel_name = channel_obj.name if channel_obj else ''
 
-        self.logger.debug('=> parse_commands\n'
-                          'User/ID: {u} / {uid}\nChannel/ID: {c} / {cid}\nMsg: {t}'.format(u=user_name,
-                                                                                           uid=user_id,
-                                                                                           c=channel_name,
-                                                                                           cid=channel_id,
-                                                                                           t=origin_message))
-
-        # if there is text message
-        # looping all commands handlers
-        for loaded_command_re in self.COMMANDS_HANDLERS.keys():
-            # if match then do command
-            re_ret = re.match(loaded_command_re, origin_message)
-            if re_ret:
-                command_handler_obj = self.COMMANDS_HANDLERS.get(loaded_command_re)
-                command_type = command_handler_obj.get('cmd_type')
-
-                if command_type == self.COMMANDS_TYPE_CLASS:
-                    # getting the command information
-                    command_class_name = command_handler_obj.get(self.COMMANDS_TYPE_CLASS)
-                    if command_class_name:
-                        self.logger.info('=> parse_commands: WORD [{w}] to CMD_C [{cmd}]'.format(w=re_ret.groups(),
-                                                                                                 cmd=command_class_name))
-                        # getting cmd class and running
-                        cmd_clz = Util.load_cmd_class(command_class_name)
-                        # command interface:
-                        #     user_obj, channel_obj, users_list, words_list, origin_message, slack_client
-                        cmd_obj = cmd_clz(user_obj=user_obj,
-                                          channel_obj=channel_obj,
-                                          users_list=users_list,
-                                          words_list=words_list,
-                                          origin_message=origin_message,
-                                          slack_client=self.slack_client)
-                        return cmd_obj.run()
-                elif command_type == self.COMMANDS_TYPE_METHOD:
-                    # if there is no command class, check the build-in command
-                    command_method_name = command_handler_obj.get(self.COMMANDS_TYPE_METHOD)
-                    self.logger.info('=> parse_commands: WORD [{w}] to CMD_M [{cmd}]'.format(w=re_ret.groups(),
-                                                                                             cmd=command_method_name))
-                    return self.__getattribute__(command_method_name)(user_obj=user_obj,
-                                                                      channel_obj=channel_obj,
-                                                                      users_list=users_list,
-                                                                      words_list=words_list,
-                                                                      origin_message=origin_message,
-                                                                      slack_client=self.slack_client)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('=> parse_commands\n'
+                              'User/ID: %s / %s\nChannel/ID: %s / %s\nMsg: %s',
+                              user_name, user_id, channel_name, channel_id,
+                              origin_message.decode('utf-8') if isinstance(origin_message, bytes) else origin_message)
+
+        # matching all commands handlers in one pass, if match then do command
+        with self.metrics.timer('command_match'):
+            command_handler_obj, groups = self.command_dispatcher.match(origin_message)
+        if command_handler_obj:
+            command_type = command_handler_obj.get('cmd_type')
+
+            if command_type == self.COMMANDS_TYPE_CLASS:
+                # getting the command information
+                command_class_name = command_handler_obj.get(self.COMMANDS_TYPE_CLASS)
+                if command_class_name:
+                    self.logger.info('=> parse_commands: WORD [%s] to CMD_C [%s]', groups, command_class_name)
+                    # running the cached cmd class with the context of this message
+                    context = CmdContext(user_obj=user_obj,
+                                         channel_obj=channel_obj,
+                                         users_list=users_list,
+                                         words_list=words_list,
+                                         origin_message=origin_message,
+                                         slack_client=self.slack_client)
+                    return self.execute_command(channel_id, command_class_name, command_handler_obj,
+                                                lambda: self.command_registry.run(command_class_name, context))
+            elif command_type == self.COMMANDS_TYPE_METHOD:
+                # if there is no command class, check the build-in command
+                command_method_name = command_handler_obj.get(self.COMMANDS_TYPE_METHOD)
+                self.logger.info('=> parse_commands: WORD [%s] to CMD_M [%s]', groups, command_method_name)
+                command_method = self.__getattribute__(command_method_name)
+                return self.execute_command(channel_id, command_method_name, command_handler_obj,
+                                            lambda: command_method(user_obj=user_obj,
+                                                                   channel_obj=channel_obj,
+                                                                   users_list=users_list,
+                                                                   words_list=words_list,
+                                                                   origin_message=origin_message,
+                                                                   slack_client=self.slack_client))
 
         return True
 
-    def run(self):
-        self.logger.info('### AQUA Start ###')
+    def execute_command(self, channel_id, command_name, command_handler_obj, command_func):
+        """
+        Running the command in the RTM loop, or submitting it to the worker threads.
+        :param channel_id:
+        :param command_name:
+        :param command_handler_obj:
+        :param command_func: the callable without arguments.
+        :return: the result of command, or CommandFuture object if there is command executor.
+        """
+        self.metrics.incr('commands', command_name)
 
-        # https://api.slack.com/methods/rtm.connect
-        if self.slack_client.rtm_connect():
+        def run_command():
+            with self.metrics.timer('command_run', command_name):
+                return self.command_profiler.run(command_name, command_func)
+
+        if self.command_executor is None:
+            return run_command()
+        return self.command_executor.submit(channel_id, command_name, run_command,
+                                            timeout=command_handler_obj.get('timeout'))
+
+    def load_directories(self, generation=None):
+        """
+        Loading the users and channels of team into the indexed directories.
+        It is only needed when (re)connecting, the directories are updated by RTM events after that.
+        :param generation: the generation of begin_directory_reload() if it is loaded in background.
+        :raise SlackApiError: if any page can not be loaded, the current directories are kept.
+        """
+        # building the directories page by page, and skipping the deleted users
+        users_directory = Directory(Util.iter_slack_users(self.slack_client,
+                                                          page_size=self.page_size,
+                                                          predicate=lambda user: not user.get('deleted')))
+        channels_directory = Directory(Util.iter_slack_channels(self.slack_client, page_size=self.page_size))
+        # the DM channels and private channels (groups) are not listed by channels.list but by the login data of
+        # rtm.start, the name of DM channel is the user id, same as handle_rtm_im_created()
+        login_data = getattr(self.slack_client.server, 'login_data', None) or {}
+        for im in login_data.get('ims', []):
+            if im.get('id'):
+                self.dm_channel_ids.add(im.get('id'))
+                channels_directory.add(SlackChannel({'id': im.get('id'),
+                                                     'name': im.get('user') or im.get('id'),
+                                                     'members': []}))
+        for group in login_data.get('groups', []):
+            if group.get('id'):
+                group.setdefault('members', [])
+                channels_directory.add(SlackChannel(group))
+        if 'ims' not in login_data and 'groups' not in login_data:
+            # the login data of rtm.connect has no state, keeping the DM and private channels of current directory
+            for channel_obj in self.channels_directory:
+                if channel_obj.id not in channels_directory and (channel_obj.id in self.dm_channel_ids or
+                                                                 channel_obj.id.startswith(self.GROUP_PREFIX)):
+                    channels_directory.add(channel_obj)
+        # replacing the directories after all pages are loaded, so the RTM loop never sees the partial directories
+        if self.swap_directories(users_directory, channels_directory, generation=generation):
+            self.logger.info('Loaded {u} users, {c} channels.'.format(u=len(users_directory),
+                                                                      c=len(channels_directory)))
+
+    def begin_directory_reload(self):
+        """
+        Recording the directory events from now on, which are replayed onto the directories being loaded in
+        background, so the events are not lost when the loaded directories replace the current ones.
+        :return: the generation of this reload, only the directories of the latest reload replace the current ones.
+        """
+        with self.directory_lock:
+            self.directory_generation += 1
+            if self.directory_deltas is None:
+                self.directory_deltas = []
+            return self.directory_generation
+
+    def end_directory_reload(self, generation):
+        """
+        Stopping recording the directory events, if the latest reload failed.
+        :param generation:
+        """
+        with self.directory_lock:
+            if generation == self.directory_generation:
+                self.directory_deltas = None
+
+    def swap_directories(self, users_directory, channels_directory, dm_channel_ids=None, generation=None):
+        """
+        Replacing the directories, and replaying the directory events which arrived while they were loaded.
+        :param users_directory:
+        :param channels_directory:
+        :param dm_channel_ids: the ids of DM channels, or None to keep the current ones.
+        :param generation: the generation of begin_directory_reload(), or None if they are not loaded in background.
+        :return: True if replaced, False if a newer reload has begun.
+        """
+        with self.directory_lock:
+            if generation is not None and generation != self.directory_generation:
+                return False
+            self.users_directory = users_directory
+            self.channels_directory = channels_directory
+            if dm_channel_ids is not None:
+                self.dm_channel_ids = dm_channel_ids
+            deltas, self.directory_deltas = self.directory_deltas or [], None
+            # the events are idempotent, replaying the one which the loaded directories already have is harmless
+            for rtm_result in deltas:
+                self.event_handlers[rtm_result.get('type')](rtm_result)
+        if deltas:
+            self.logger.info('Replayed {n} directory events.'.format(n=len(deltas)))
+        return True
+
+    def load_snapshot(self, generation=None):
+        """
+        Loading the directories, DM channel ids and Bot id from the workspace snapshot.
+        :param generation: the generation of begin_directory_reload() if it is loaded in background.
+        :return: True if the snapshot is loaded.
+        """
+        if self.workspace_snapshot is None:
+            return False
+        snapshot = self.workspace_snapshot.load(self.bot_name)
+        if snapshot is None or not snapshot.get('bot_id'):
+            return False
+        self.set_bot_id(snapshot.get('bot_id'))
+        if self.swap_directories(snapshot.get('users_directory'), snapshot.get('channels_directory'),
+                                 dm_channel_ids=snapshot.get('dm_channel_ids'), generation=generation):
+            self.logger.info('Loaded snapshot, {u} users, {c} channels, saved {age:.0f} sec ago.'.format(
+                u=len(snapshot.get('users_directory')), c=len(snapshot.get('channels_directory')),
+                age=time.time() - snapshot.get('saved_at')))
+        return True
+
+    def start_snapshot_reload(self, generation=None):
+        """
+        Reloading the directories from the workspace snapshot in background, ex: the shard worker after the
+        connection process has reconciled the directories. The events are handled by the current directories
+        until the snapshot is loaded.
+        :param generation: the generation of begin_directory_reload() if the events have been recorded.
+        """
+        if generation is None:
+            generation = self.begin_directory_reload()
+        thread = threading.Thread(target=self.reload_snapshot, args=(generation,), name='aqua-snapshot-reload')
+        thread.daemon = True
+        thread.start()
+
+    def reload_snapshot(self, generation):
+        try:
+            if not self.load_snapshot(generation=generation):
+                self.logger.warning('Reloading snapshot failed, the current directories are kept.')
+                self.end_directory_reload(generation)
+        except Exception as e:
+            self.logger.error('Reloading snapshot failed, {}'.format(e))
+            self.end_directory_reload(generation)
+
+    def save_snapshot(self):
+        """
+        Writing the directories, DM channel ids and Bot id into the workspace snapshot.
+        :return: True if saved.
+        """
+        if self.workspace_snapshot is None or self.bot_id is None:
+            return False
+        if not self.workspace_snapshot.save(self.bot_name, self.bot_id, self.users_directory,
+                                            self.channels_directory, set(self.dm_channel_ids)):
+            return False
+        self.snapshot_saved_at = time.time()
+        return True
+
+    def reconcile_directories(self):
+        """
+        Reloading the directories from Web API in background, then refreshing the snapshot.
+        The RTM loop keeps serving from the snapshot directories until the new directories are loaded, and the
+        directory events meanwhile are replayed onto the new directories.
+        """
+        generation = self.begin_directory_reload()
+        try:
+            self.load_directories(generation=generation)
+            if self.process_shards is not None:
+                # the workers record the events from now on, and replay them onto the snapshot which is saved next
+                self.process_shards.broadcast(ProcessShards.SNAPSHOT_STARTED)
+            is_saved = self.save_snapshot()
+            if self.process_shards is not None:
+                self.process_shards.broadcast(ProcessShards.RELOAD_SNAPSHOT if is_saved
+                                              else ProcessShards.SNAPSHOT_ABORTED)
+        except Exception as e:
+            self.logger.error('Reconciling directories failed, {}'.format(e))
+            self.end_directory_reload(generation)
+
+    def start_reconcile(self):
+        self.start_background(self.reconcile_directories, 'aqua-reconcile')
+
+    def start_background(self, target, name):
+        """
+        Running the directory job in background, one job at a time.
+        :param target: the job, ex: reconcile_directories, or save_snapshot.
+        :param name: the thread name.
+        :return: True if started, False if another job is running.
+        """
+        if self.reconcile_thread is not None and self.reconcile_thread.is_alive():
+            return False
+        self.reconcile_thread = threading.Thread(target=target, name=name)
+        self.reconcile_thread.daemon = True
+        self.reconcile_thread.start()
+        return True
+
+    def set_bot_id(self, bot_id):
+        self.bot_id = bot_id
+        self.bot_id_tag = '<@{bot_id}>'.format(bot_id=self.bot_id)
+
+    def rtm_connect(self):
+        """
+        Connecting to RTM.
+        If the Bot id is known (ex: loaded from snapshot), calling the lightweight rtm.connect which returns no
+        workspace state, else calling rtm.start.
+        If there is WebApiTransport, calling Web API by it (ex: to a local stand-in), else by slackclient.
+        :return: True if connected.
+        """
+        if self.bot_id is None and self.web_api_transport is None:
+            return self.slack_client.rtm_connect()
+        method = 'rtm.start' if self.bot_id is None else 'rtm.connect'
+        try:
+            login_data = Util.api_call(self.slack_client, method)
+            if not login_data.get('ok'):
+                self.logger.error('{method} failed, {err}.'.format(method=method, err=login_data.get('error')))
+                return False
+            server = self.slack_client.server
+            server.ws_url = login_data.get('url')
+            if method == 'rtm.start':
+                server.parse_slack_login_data(login_data)
+            else:
+                server.login_data = login_data
+                server.username = login_data.get('self', {}).get('name')
+                server.domain = login_data.get('team', {}).get('domain')
+            server.connect_slack_websocket(server.ws_url)
+            return True
+        except Exception as e:
+            self.logger.error('Connection failed, {}'.format(e))
+            return False
+
+    def start_session(self, from_snapshot=False):
+        """
+        Loading the directories and the Bot id after connected.
+        :param from_snapshot: True if the directories are loaded from snapshot, then reconciling them in background.
+        """
+        if from_snapshot:
+            self.start_reconcile()
+        else:
+            self.load_directories()
             # getting Bot id by name
-            self.bot_id = Util.find_user(self.slack_client, self.bot_name).id
-            self.logger.info('Name: {botname}\nID: {botid}'.format(botname=self.bot_name, botid=self.bot_id))
-
-            while True:
-                """
-                first message should be: [{u'type': u'hello'}]
-                """
-                rtm_ret_list = self.slack_client.rtm_read()
-                if rtm_ret_list:
-                    for rtm_ret in rtm_ret_list:
-                        self.handle_rtm(rtm_ret)
-                time.sleep(self.DEFAULT_DELAY_SEC)
+            self.set_bot_id(Util.find_user(self.slack_client, self.bot_name, self.users_directory).id)
+            self.save_snapshot()
+        self.logger.info('Name: {botname}\nID: {botid}'.format(botname=self.bot_name, botid=self.bot_id))
+
+    def dispatch_rtm_events(self, rtm_ret_list, received_at):
+        """
+        Dispatching the RTM events, and recording the receive-to-dispatch latency.
+        :param rtm_ret_list: a list of RTM events.
+        :param received_at: the time of events be read from websocket.
+        :return:
+        """
+        for rtm_ret in rtm_ret_list:
+            latency = time.time() - received_at
+            self.dispatch_latency.add(latency)
+            self.metrics.observe('receive_to_dispatch', latency)
+            self.handle_rtm(rtm_ret)
+
+    def housekeeping(self):
+        """
+        Periodic jobs, running at least once per idle timeout.
+        """
+        self.logger.info('### {}'.format(self.dispatch_latency.format_summary()))
+        self.dispatch_latency.reset()
+        if self.web_api_transport:
+            self.logger.info('### Web API latency:\n{}'.format(self.web_api_transport.format_stats()))
+        if self.metrics.enabled:
+            self.logger.info('### Metrics:\n{}'.format(self.metrics.format_dump()))
+        if self.process_shards is not None:
+            self.process_shards.check_workers()
+        if self.admission_control is not None:
+            self.logger.info('### Admission control: {}'.format(self.admission_control.format_stats()))
+        if self.receiver is not None and self.receiver.dropped_counts:
+            self.logger.info('### Dropped events: {}'.format(self.receiver.dropped_counts))
+        if self.command_profiler.enabled:
+            self.command_profiler.write_report()
+        # keeping the snapshot close to the directories, which are updated by RTM events.
+        # it is written in background, and skipped if the reconcile is running, which saves it too.
+        if self.workspace_snapshot and time.time() - self.snapshot_saved_at >= self.snapshot_interval:
+            self.start_background(self.save_snapshot, 'aqua-snapshot')
+
+    def connect(self):
+        """
+        Connecting to RTM, then starting the session at the first time, or reconciling the directories in
+        background when reconnecting.
+        The directories, command registry and executor are kept when reconnecting, only the websocket is renewed.
+        :return: True if connected.
+        """
+        if not self.is_session_started and self.from_snapshot is None:
+            self.from_snapshot = self.load_snapshot()
+        # https://api.slack.com/methods/rtm.connect
+        if not self.rtm_connect():
+            return False
+        if not self.is_session_started:
+            try:
+                self.start_session(from_snapshot=self.from_snapshot)
+            except (SlackApiError, IOError, OSError) as e:
+                # retrying by the reconnect backoff, rather than starting with the partial directories,
+                # the IOError is the transport error out of the Web API retries, ex: requests.ConnectionError
+                self.logger.error('Starting session failed, {}'.format(e))
+                self.close_websocket()
+                return False
+            self.is_session_started = True
+            if self.process_shards is not None:
+                self.process_shards.start()
         else:
+            # the events are missed while disconnected, reconciling the warm directories in background
+            self.metrics.incr('connection', 'reconnect')
+            self.logger.info('Reconnected.')
+            self.start_reconcile()
+        self.reconnect_backoff.reset()
+        self.receiver = self.create_receiver()
+        self.logger.info('Receive mode: {mode}'.format(mode=self.receive_mode))
+        return True
+
+    def disconnect(self, reason):
+        """
+        Closing the broken or stale websocket.
+        :param reason: the RtmConnectionError.
+        """
+        self.logger.warning('Disconnected, {}'.format(reason))
+        self.metrics.incr('connection', 'disconnect')
+        self.receiver = None
+        self.close_websocket()
+
+    def next_reconnect_delay(self):
+        """
+        :return: the jittered backoff seconds before reconnecting.
+        """
+        # 0 is retrying forever
+        max_attempts = self.config_file.get(self.KEY_RECONNECT_MAX_ATTEMPTS, 0)
+        if max_attempts and self.reconnect_backoff.attempts >= max_attempts:
             raise Exception('Connection failed.')
+        delay = self.reconnect_backoff.next_delay()
+        self.logger.info('Reconnecting in {:.1f} sec.'.format(delay))
+        return delay
+
+    def create_receiver(self):
+        """
+        :return: RtmReceiver object, which drops the unhandled event types before decoding if ingress filter is on.
+        """
+        is_ingress_filter = self.config_file.get(self.KEY_INGRESS_FILTER, True)
+        return RtmReceiver(self.slack_client,
+                           ping_interval=self.config_file.get(self.KEY_PING_INTERVAL_SEC,
+                                                              self.DEFAULT_PING_INTERVAL_SEC),
+                           ping_timeout=self.config_file.get(self.KEY_PING_TIMEOUT_SEC, self.DEFAULT_PING_TIMEOUT_SEC),
+                           event_types=self.event_handlers.keys() if is_ingress_filter else None,
+                           metrics=self.metrics,
+                           max_frames=self.config_file.get(self.KEY_RECEIVE_MAX_FRAMES))
+
+    def next_timeout(self):
+        """
+        :return: the seconds before the next tick() is due.
+        """
+        timeout = max(0, self.idle_timeout - (time.time() - self.last_housekeeping))
+        check_timeout = self.receiver.next_check_timeout() if self.receiver else None
+        if check_timeout is not None:
+            timeout = min(timeout, check_timeout)
+        edit_timeout = self.edit_debouncer.next_due_timeout() if self.edit_debouncer else None
+        if edit_timeout is not None:
+            timeout = min(timeout, edit_timeout)
+        return timeout
+
+    def receive_events(self):
+        """
+        Reading the arrived RTM events and dispatching each frame as it is read, it is called when the websocket is
+        readable.
+        """
+        frames = self.receiver.read_events()
+        while True:
+            with self.metrics.timer('receive'):
+                frame = next(frames, None)
+            if frame is None:
+                break
+            received_at, rtm_ret_list = frame
+            self.dispatch_rtm_events(rtm_ret_list, received_at)
+
+    def tick(self):
+        """
+        Processing the due edits, checking the liveness of connection, applying the toggle of command profiler,
+        and running the housekeeping once per idle timeout.
+        """
+        self.flush_edits()
+        self.receiver.check_alive()
+        self.command_profiler.poll()
+        if time.time() - self.last_housekeeping >= self.idle_timeout:
+            self.housekeeping()
+            self.last_housekeeping = time.time()
+
+    def receive_loop(self):
+        """
+        first message should be: [{u'type': u'hello'}]
+        It returns by raising RtmConnectionError when the websocket is closed, broken, or stale.
+        """
+        while True:
+            if self.receive_mode == self.RECEIVE_MODE_POLL:
+                with self.metrics.timer('receive'):
+                    rtm_ret_list = self.receiver.read_frame()
+                if rtm_ret_list:
+                    self.dispatch_rtm_events(rtm_ret_list, self.receiver.last_received_at)
+                time.sleep(self.DEFAULT_DELAY_SEC)
+            elif self.receiver.wait_readable(self.next_timeout()):
+                self.receive_events()
+            self.tick()
+
+    def close_websocket(self):
+        websocket = self.slack_client.server.websocket
+        if websocket is None:
+            return
+        try:
+            websocket.close()
+        except Exception as e:
+            self.logger.debug('Closing websocket failed, {}'.format(e))
+        self.slack_client.server.websocket = None
+
+    def run(self):
+        """
+        Connecting and receiving RTM events, and reconnecting with jittered exponential backoff if the connection
+        fails or drops.
+        """
+        self.logger.info('### AQUA Start ###')
+        while True:
+            if self.connect():
+                try:
+                    self.receive_loop()
+                except RtmConnectionError as e:
+                    self.disconnect(e)
+            time.sleep(self.next_reconnect_delay())
 
 
 if __name__ == "__main__":
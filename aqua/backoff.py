@@ -0,0 +1,27 @@
+# -*- encoding: utf-8 -*-
+
+import random
+
+
+class Backoff(object):
+    """
+    The jittered exponential backoff.
+    The delay of n-th attempt is a random value between half and full of min(max_sec, base_sec * 2^n),
+    so the reconnecting bots do not hit the server at the same moment.
+    """
+
+    def __init__(self, base_sec=1, max_sec=60):
+        self.base_sec = float(base_sec)
+        self.max_sec = float(max_sec)
+        self.attempts = 0
+
+    def next_delay(self):
+        """
+        :return: the seconds to wait before next attempt.
+        """
+        ceiling = min(self.max_sec, self.base_sec * (2 ** min(self.attempts, 32)))
+        self.attempts += 1
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def reset(self):
+        self.attempts = 0
@@ -0,0 +1,107 @@
+# -*- encoding: utf-8 -*-
+
+import sys
+import time
+import random
+
+
+class BenchUtil(object):
+
+    @staticmethod
+    def deep_sizeof(obj, seen=None):
+        """
+        Return the memory size of object, including the referenced objects.
+        :param obj:
+        :param seen: the ids of counted objects.
+        :return: bytes.
+        """
+        if seen is None:
+            seen = set()
+        if id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+        size = sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            size += sum(BenchUtil.deep_sizeof(k, seen) + BenchUtil.deep_sizeof(v, seen) for k, v in obj.items())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            size += sum(BenchUtil.deep_sizeof(item, seen) for item in obj)
+        else:
+            if hasattr(obj, '__dict__'):
+                size += BenchUtil.deep_sizeof(obj.__dict__, seen)
+            for clz in type(obj).__mro__:
+                for slot in clz.__dict__.get('__slots__', ()):
+                    if hasattr(obj, slot):
+                        size += BenchUtil.deep_sizeof(getattr(obj, slot), seen)
+        return size
+
+    @staticmethod
+    def make_user_payload(index):
+        """
+        :return: a users.list member payload.
+        """
+        user_id = 'U{:010d}'.format(index)
+        name = 'user{}'.format(index)
+        image_url = 'https://avatars.slack-edge.com/2017-01-01/{uid}_{size}.png'
+        profile = {
+            'avatar_hash': 'ge3b51ca72de',
+            'status_emoji': ':mountain_railway:',
+            'status_text': 'riding a train',
+            'first_name': 'First{}'.format(index),
+            'last_name': 'Last{}'.format(index),
+            'real_name': 'Real Name {}'.format(index),
+            'display_name': name,
+            'email': '{}@example.com'.format(name),
+            'skype': '',
+            'phone': '+1 (123) 456 7890',
+            'team': 'T0000000001'
+        }
+        for size in (24, 32, 48, 72, 192, 512, 1024):
+            profile['image_{}'.format(size)] = image_url.format(uid=user_id, size=size)
+        return {
+            'id': user_id,
+            'team_id': 'T0000000001',
+            'name': name,
+            'deleted': index % 50 == 0,
+            'color': '9f69e7',
+            'real_name': profile['real_name'],
+            'tz': 'Asia/Taipei',
+            'tz_label': 'China Standard Time',
+            'tz_offset': 28800,
+            'profile': profile,
+            'is_admin': False,
+            'is_owner': False,
+            'is_primary_owner': False,
+            'is_restricted': False,
+            'is_ultra_restricted': False,
+            'is_bot': index % 100 == 0,
+            'updated': 1490054400,
+            'has_2fa': False
+        }
+
+    @staticmethod
+    def make_channel_payload(index, members_count=20):
+        """
+        :return: a channels.list channel payload.
+        """
+        return {
+            'id': 'C{:010d}'.format(index),
+            'name': 'channel-{}'.format(index),
+            'is_channel': True,
+            'created': 1360782804,
+            'creator': 'U0000000001',
+            'is_archived': False,
+            'is_general': index == 0,
+            'members': ['U{:010d}'.format(random.randint(0, 50000)) for _ in range(members_count)],
+            'topic': {'value': 'Topic {}'.format(index), 'creator': 'U0000000001', 'last_set': 1369677212},
+            'purpose': {'value': 'Purpose {}'.format(index), 'creator': 'U0000000001', 'last_set': 1360782804},
+            'is_member': True
+        }
+
+    @staticmethod
+    def timeit(func, *args, **kwargs):
+        """
+        :return: (result, elapsed seconds).
+        """
+        start = time.time()
+        result = func(*args, **kwargs)
+        return result, time.time() - start
@@ -0,0 +1,101 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import json
+import logging
+from collections import deque
+
+from slackclient._user import User
+from slackclient._channel import Channel
+from slackclient._util import SearchDict, SearchList
+
+from bench.bench_util import BenchUtil
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class FakeServer(object):
+    """
+    The in-process stand-in of slackclient Server, it only has the users and channels state.
+    """
+
+    def __init__(self):
+        self.users = SearchDict()
+        self.channels = SearchList()
+        self.websocket = None
+        self.connected = False
+
+
+class FakeSlackClient(object):
+    """
+    The in-process stand-in of SlackClient, for benchmark.
+        - rtm_read(): returning the queued RTM events, batch by batch.
+        - api_call(): serving users.list and channels.list (with cursor pagination), and recording chat.postMessage.
+        - server.users / server.channels: same search objects as slackclient, including the DM channels.
+    """
+    BOT_ID = 'U0BOT00001'
+    BOT_NAME = 'aqua'
+
+    def __init__(self, users_count=1000, channels_count=100, dm_count=50):
+        self.server = FakeServer()
+        self.rtm_batches = deque()
+        self.posted_messages = []
+        self.api_calls_count = {}
+
+        self.user_payloads = [BenchUtil.make_user_payload(index) for index in range(1, users_count + 1)]
+        self.user_payloads.append({'id': self.BOT_ID, 'name': self.BOT_NAME, 'real_name': 'Aqua', 'is_bot': True,
+                                   'deleted': False, 'tz': 'Asia/Tokyo', 'profile': {}})
+        self.channel_payloads = [BenchUtil.make_channel_payload(index) for index in range(channels_count)]
+        # same as the decoded Web API responses, the strings are unicode
+        self.user_payloads = json.loads(json.dumps(self.user_payloads))
+        self.channel_payloads = json.loads(json.dumps(self.channel_payloads))
+        for payload in self.user_payloads:
+            self.server.users[payload['id']] = User(self.server, payload['name'], payload['id'],
+                                                    payload['real_name'], payload['tz'])
+        for payload in self.channel_payloads:
+            self.server.channels.append(Channel(self.server, payload['name'], payload['id'], payload['members']))
+        # the name of DM channel is the user id, same as slackclient
+        self.dm_channel_ids = []
+        for index in range(min(dm_count, users_count)):
+            dm_channel_id = 'D{:010d}'.format(index)
+            self.server.channels.append(Channel(self.server, self.user_payloads[index]['id'], dm_channel_id, []))
+            self.dm_channel_ids.append(dm_channel_id)
+
+    def rtm_connect(self):
+        self.server.connected = True
+        return True
+
+    def feed(self, rtm_events, batch_size=1):
+        """
+        Queueing the RTM events, which will be returned by rtm_read().
+        :param rtm_events: a list of events.
+        :param batch_size: the number of events returned by one rtm_read().
+        :return:
+        """
+        for index in range(0, len(rtm_events), batch_size):
+            self.rtm_batches.append(rtm_events[index:index + batch_size])
+
+    def rtm_read(self):
+        return self.rtm_batches.popleft() if self.rtm_batches else []
+
+    def api_call(self, method, timeout=None, **kwargs):
+        self.api_calls_count[method] = self.api_calls_count.get(method, 0) + 1
+        if method == 'users.list':
+            return self.paginate('members', self.user_payloads, kwargs)
+        elif method == 'channels.list':
+            return self.paginate('channels', self.channel_payloads, kwargs)
+        elif method == 'chat.postMessage':
+            self.posted_messages.append((kwargs.get('channel'), kwargs.get('text')))
+            return {'ok': True, 'channel': kwargs.get('channel'), 'ts': '1500000000.000001'}
+        return {'ok': False, 'error': 'unknown_method'}
+
+    @staticmethod
+    def paginate(items_key, items, kwargs):
+        limit = int(kwargs.get('limit') or len(items) or 1)
+        start = int(kwargs.get('cursor') or 0)
+        next_start = start + limit
+        return {
+            'ok': True,
+            items_key: items[start:next_start],
+            'response_metadata': {'next_cursor': str(next_start) if next_start < len(items) else ''}
+        }
@@ -0,0 +1,47 @@
+# -*- encoding: utf-8 -*-
+"""
+Comparing the memory of Dict2Obj and SlackUser/SlackChannel records.
+
+Usage (under aqua folder):
+    python -m bench.memory_records [users count]
+"""
+import os
+import sys
+import logging
+
+from dict2obj import Dict2Obj
+from slack_user import SlackUser
+from slack_channel import SlackChannel
+from bench.bench_util import BenchUtil
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+DEFAULT_USERS_COUNT = 50000
+DEFAULT_CHANNELS_COUNT = 2000
+
+
+def measure(name, clz, payloads):
+    records, elapsed = BenchUtil.timeit(lambda: [clz(payload) for payload in payloads])
+    size = BenchUtil.deep_sizeof(records)
+    logger.info('{name:<24} {count:>7} records  {total:>10.1f} KB  {per:>8.1f} B/record  build {sec:.3f}s'.format(
+        name=name, count=len(records), total=size / 1024.0, per=float(size) / len(records), sec=elapsed))
+    return size
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    users_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_USERS_COUNT
+
+    user_payloads = [BenchUtil.make_user_payload(index) for index in range(users_count)]
+    dict2obj_size = measure('Dict2Obj (users)', Dict2Obj, user_payloads)
+    record_size = measure('SlackUser (users)', SlackUser, user_payloads)
+    logger.info('users: SlackUser uses {:.1f}% memory of Dict2Obj.\n'.format(100.0 * record_size / dict2obj_size))
+
+    channel_payloads = [BenchUtil.make_channel_payload(index) for index in range(DEFAULT_CHANNELS_COUNT)]
+    dict2obj_size = measure('Dict2Obj (channels)', Dict2Obj, channel_payloads)
+    record_size = measure('SlackChannel (channels)', SlackChannel, channel_payloads)
+    logger.info('channels: SlackChannel uses {:.1f}% memory of Dict2Obj.'.format(100.0 * record_size / dict2obj_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# -*- encoding: utf-8 -*-
+"""
+Replaying the recorded or synthetic RTM events through AquaBot with FakeSlackClient,
+and reporting events/sec, p50/p99 dispatch latency, and memory.
+
+Usage (under aqua folder):
+    python -m bench.rtm_replay [--events 20000] [--users 5000] [--channels 200]
+    python -m bench.rtm_replay --record events.jsonl
+
+The recorded file has one RTM event (JSON) per line.
+"""
+import os
+import json
+import time
+import random
+import logging
+import argparse
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from aqua_bot import AquaBot
+from latency_stats import LatencyStats
+from bench.fake_slack_client import FakeSlackClient
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+CHATTER_WORDS = ['the', 'deploy', 'is', 'failing', 'again', 'please', 'check', 'build', 'log', 'merged', 'review',
+                 'LGTM', 'ship', 'it', 'tomorrow', 'standup', 'rollback', ':tada:', 'thanks!', 'lunch?']
+BOT_COMMANDS = ['help', 'hello', 'hi', 'konnichiwa', 'こんにちは', 'what is the status']
+
+# (event kind, weight)
+EVENT_MIX = [
+    ('chatter', 80),
+    ('mention', 5),
+    ('dm', 3),
+    ('edit', 5),
+    ('typing', 5),
+    ('presence', 2),
+]
+
+
+def make_events(client, events_count, seed=9527):
+    """
+    :return: a list of synthetic RTM events, with channel chatter, DMs, message_changed edits, and bot mentions.
+    """
+    random.seed(seed)
+    kinds = [kind for kind, weight in EVENT_MIX for _ in range(weight)]
+    # the deleted users can not post messages
+    users = [payload['id'] for payload in client.user_payloads
+             if payload['id'] != client.BOT_ID and not payload.get('deleted')]
+    dm_indexes = [index for index in range(len(client.dm_channel_ids))
+                  if not client.user_payloads[index].get('deleted')]
+    channels = [payload['id'] for payload in client.channel_payloads]
+    bot_tag = '<@{}>'.format(client.BOT_ID)
+    events = []
+    for index in range(events_count):
+        kind = random.choice(kinds)
+        ts = '{:.6f}'.format(1500000000 + index / 1000.0)
+        user_id = random.choice(users)
+        chatter = ' '.join(random.choice(CHATTER_WORDS) for _ in range(random.randint(3, 40)))
+        if kind == 'chatter':
+            events.append({'type': 'message', 'channel': random.choice(channels), 'user': user_id,
+                           'text': chatter, 'ts': ts})
+        elif kind == 'mention':
+            events.append({'type': 'message', 'channel': random.choice(channels), 'user': user_id,
+                           'text': '{} {}'.format(bot_tag, random.choice(BOT_COMMANDS)), 'ts': ts})
+        elif kind == 'dm':
+            dm_index = random.choice(dm_indexes)
+            events.append({'type': 'message', 'channel': client.dm_channel_ids[dm_index],
+                           'user': client.user_payloads[dm_index]['id'],
+                           'text': random.choice(BOT_COMMANDS), 'ts': ts})
+        elif kind == 'edit':
+            text = '{} {}'.format(bot_tag, random.choice(BOT_COMMANDS)) if random.random() < 0.2 else chatter
+            events.append({'type': 'message', 'subtype': 'message_changed', 'channel': random.choice(channels),
+                           'message': {'type': 'message', 'user': user_id, 'text': text, 'ts': ts},
+                           'ts': ts})
+        elif kind == 'typing':
+            events.append({'type': 'user_typing', 'channel': random.choice(channels), 'user': user_id})
+        else:
+            events.append({'type': 'presence_change', 'user': user_id, 'presence': 'active'})
+    # same as the decoded RTM frames, the strings are unicode
+    return json.loads(json.dumps(events))
+
+
+def load_events(record_file):
+    with open(record_file, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def get_maxrss_kb():
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def create_bot(client, config=None):
+    bot_config = {AquaBot.KEY_BOT_NAME: client.BOT_NAME, AquaBot.KEY_API_TOKEN: 'xoxb-fake'}
+    bot_config.update(config or {})
+    bot = AquaBot(config=bot_config, slack_client=client)
+    client.rtm_connect()
+    bot.start_session()
+    return bot
+
+
+def replay(bot, client, events, batch_size):
+    """
+    :return: (elapsed seconds, LatencyStats of dispatch)
+    """
+    dispatch_stats = LatencyStats('dispatch', max_samples=len(events))
+    client.feed(events, batch_size=batch_size)
+    started = time.time()
+    while True:
+        rtm_ret_list = client.rtm_read()
+        if not rtm_ret_list:
+            break
+        for rtm_ret in rtm_ret_list:
+            dispatch_started = time.time()
+            bot.handle_rtm(rtm_ret)
+            dispatch_stats.add(time.time() - dispatch_started)
+    # processing the debounced edits
+    bot.flush_edits(force=True)
+    return time.time() - started, dispatch_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replaying RTM events through AquaBot.')
+    parser.add_argument('--events', type=int, default=20000, help='the number of synthetic events.')
+    parser.add_argument('--users', type=int, default=5000, help='the number of users in workspace.')
+    parser.add_argument('--channels', type=int, default=200, help='the number of channels in workspace.')
+    parser.add_argument('--batch-size', type=int, default=1, help='the number of events of one rtm_read().')
+    parser.add_argument('--record', help='replaying the recorded events file (JSON lines).')
+    parser.add_argument('--log-level', default='WARNING', help='the log level of bot.')
+    parser.add_argument('--metrics', action='store_true', help='enabling and dumping the per-stage metrics.')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    logger.setLevel(logging.INFO)
+
+    if tracemalloc:
+        tracemalloc.start()
+    client = FakeSlackClient(users_count=args.users, channels_count=args.channels)
+    bot = create_bot(client, {AquaBot.KEY_METRICS: args.metrics})
+    events = load_events(args.record) if args.record else make_events(client, args.events)
+    startup_kb = tracemalloc.get_traced_memory()[0] / 1024.0 if tracemalloc else 0
+
+    elapsed, dispatch_stats = replay(bot, client, events, args.batch_size)
+    summary = dispatch_stats.summary()
+
+    logger.info('events: {n}, elapsed: {sec:.3f}s, {eps:.0f} events/sec'.format(
+        n=len(events), sec=elapsed, eps=len(events) / elapsed if elapsed else 0))
+    logger.info('dispatch latency: p50={p50:.1f}us p99={p99:.1f}us max={max:.1f}us'.format(
+        p50=summary['p50'] * 1e6, p99=summary['p99'] * 1e6, max=summary['max'] * 1e6))
+    logger.info('posted messages: {n}, api calls: {calls}'.format(n=len(client.posted_messages),
+                                                                 calls=client.api_calls_count))
+    if tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        logger.info('memory: after startup {s:.0f} KB, current {c:.0f} KB, peak {p:.0f} KB'.format(
+            s=startup_kb, c=current / 1024.0, p=peak / 1024.0))
+    logger.info('memory: max RSS {:.0f} KB'.format(get_maxrss_kb()))
+    if args.metrics:
+        logger.info('metrics:\n{}'.format(bot.metrics.format_dump()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+# -*- encoding: utf-8 -*-
+"""
+The local Slack stand-in server, for end-to-end load testing without Slack workspace and network.
+
+It serves:
+    - Web API: rtm.connect, rtm.start, users.list, channels.list (cursor pagination), and chat.postMessage,
+      with injectable latency and rate limited (HTTP 429) responses.
+    - RTM websocket: pushing 'hello', then the recorded or synthetic events at the target rate,
+      and replying 'pong' for the 'ping' of client.
+      The connections can be dropped, or stop replying 'pong', to test the reconnecting of bot.
+
+Usage (under aqua folder):
+    python -m bench.slack_standin --port 8765 --events 100000 --rate 500 --api-latency-ms 50 --rate-limit-every 20
+
+Then running the bot with config.json:
+    {
+      "bot-name": "aqua",
+      "api-token": "xoxb-standin",
+      "web-api-transport": true,
+      "web-api-base-url": "http://127.0.0.1:8765/api/",
+      "outbound-queue": true
+    }
+"""
+import os
+import json
+import time
+import base64
+import socket
+import struct
+import hashlib
+import logging
+import argparse
+import threading
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+
+from bench.fake_slack_client import FakeSlackClient
+from bench.rtm_replay import make_events, load_events
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+OPCODE_TEXT = 0x1
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+
+class StandinStats(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+class WebSocketConnection(object):
+    """
+    The server side of websocket connection, ref: RFC 6455.
+    """
+
+    def __init__(self, sock, rfile):
+        self.sock = sock
+        self.rfile = rfile
+        self.send_lock = threading.Lock()
+        self.closed = False
+
+    @staticmethod
+    def accept_key(key):
+        return base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+
+    @staticmethod
+    def encode_frame(payload, opcode=OPCODE_TEXT):
+        """
+        The frame from server is not masked.
+        """
+        header = bytearray([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header.append(length)
+        elif length < 65536:
+            header.append(126)
+            header.extend(struct.pack('!H', length))
+        else:
+            header.append(127)
+            header.extend(struct.pack('!Q', length))
+        return bytes(header) + payload
+
+    def read_exact(self, size):
+        data = self.rfile.read(size)
+        if len(data) < size:
+            raise EOFError('websocket closed.')
+        return data
+
+    def read_frame(self):
+        """
+        :return: (opcode, payload bytes), the frame from client is masked.
+        """
+        b1, b2 = bytearray(self.read_exact(2))
+        opcode = b1 & 0x0f
+        length = b2 & 0x7f
+        if length == 126:
+            length = struct.unpack('!H', self.read_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self.read_exact(8))[0]
+        mask = bytearray(self.read_exact(4)) if b2 & 0x80 else None
+        payload = bytearray(self.read_exact(length))
+        if mask:
+            for index in range(length):
+                payload[index] ^= mask[index % 4]
+        return opcode, bytes(payload)
+
+    def send(self, payload, opcode=OPCODE_TEXT):
+        if isinstance(payload, type(u'')):
+            payload = payload.encode('utf-8')
+        with self.send_lock:
+            self.sock.sendall(self.encode_frame(payload, opcode))
+
+    def send_json(self, obj):
+        self.send(json.dumps(obj))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.send(b'', OPCODE_CLOSE)
+            except socket.error:
+                pass
+
+    def drop(self):
+        """
+        Closing the TCP connection without websocket closing handshake, same as a network failure.
+        """
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # writing the headers and body at once, it avoids the delayed ACK of small writes on keep-alive connection
+    wbufsize = -1
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt % args)
+
+    @property
+    def standin(self):
+        return self.server.standin
+
+    def send_json(self, obj, status=200, headers=None):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        params = dict((key, values[-1]) for key, values in parse_qs(body).items())
+        method = self.path.split('?', 1)[0].rsplit('/', 1)[-1]
+        status, response, headers = self.standin.handle_api(method, params)
+        self.send_json(response, status=status, headers=headers)
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/ws' or self.headers.get('Upgrade', '').lower() != 'websocket':
+            self.send_json({'ok': False, 'error': 'not_found'}, status=404)
+            return
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', WebSocketConnection.accept_key(self.headers.get('Sec-WebSocket-Key')))
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+        self.standin.serve_websocket(WebSocketConnection(self.connection, self.rfile))
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SlackStandin(object):
+    """
+    The local Slack stand-in.
+    """
+    DEFAULT_RETRY_AFTER_SEC = 1
+
+    def __init__(self, host='127.0.0.1', port=0, workspace=None, events=None, rate=0, api_latency_sec=0,
+                 rate_limit_every=0, retry_after_sec=None, loop_events=False):
+        """
+        :param host:
+        :param port: 0 is any free port.
+        :param workspace: FakeSlackClient object, which provides the users and channels payloads.
+        :param events: a list of RTM events to push.
+        :param rate: events per second, 0 is as fast as possible.
+        :param api_latency_sec: the latency of every Web API call.
+        :param rate_limit_every: responding 429 for every N-th chat.postMessage, 0 is disabled.
+        :param retry_after_sec: the Retry-After of 429 response.
+        :param loop_events: pushing the events again after all events are pushed.
+        """
+        self.workspace = workspace or FakeSlackClient()
+        self.events = events if events is not None else []
+        self.rate = rate
+        self.api_latency_sec = api_latency_sec
+        self.rate_limit_every = rate_limit_every
+        self.retry_after_sec = retry_after_sec or self.DEFAULT_RETRY_AFTER_SEC
+        self.loop_events = loop_events
+        # True to stop replying 'pong', then the connections look stale to client
+        self.mute_pong = False
+        self.connections = set()
+        self.connections_lock = threading.Lock()
+        self.stats = StandinStats()
+        self.post_message_count = 0
+        self.post_message_lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), StandinHandler)
+        self.httpd.standin = self
+        self.host, self.port = self.httpd.server_address[:2]
+        self.thread = None
+
+    @property
+    def api_url(self):
+        return 'http://{host}:{port}/api/'.format(host=self.host, port=self.port)
+
+    @property
+    def ws_url(self):
+        return 'ws://{host}:{port}/ws'.format(host=self.host, port=self.port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='aqua-standin')
+        self.thread.daemon = True
+        self.thread.start()
+        logger.info('Slack stand-in: {api} , {ws}'.format(api=self.api_url, ws=self.ws_url))
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def login_data(self, with_state):
+        bot = self.workspace.user_payloads[-1]
+        data = {
+            'ok': True,
+            'url': self.ws_url,
+            'self': {'id': bot['id'], 'name': bot['name']},
+            'team': {'id': 'T0000000001', 'name': 'Stand-in', 'domain': 'standin'}
+        }
+        if with_state:
+            data['users'] = self.workspace.user_payloads
+            data['channels'] = self.workspace.channel_payloads
+            data['groups'] = []
+            data['ims'] = [{'id': channel.id, 'user': channel.name}
+                           for channel in self.workspace.server.channels
+                           if channel.id in self.workspace.dm_channel_ids]
+        return data
+
+    def handle_api(self, method, params):
+        """
+        :return: (HTTP status, response dict, headers)
+        """
+        self.stats.incr('api.{}'.format(method))
+        if self.api_latency_sec:
+            time.sleep(self.api_latency_sec)
+
+        if method == 'rtm.connect':
+            return 200, self.login_data(with_state=False), None
+        elif method == 'rtm.start':
+            return 200, self.login_data(with_state=True), None
+        elif method == 'chat.postMessage':
+            with self.post_message_lock:
+                self.post_message_count += 1
+                is_rate_limited = self.rate_limit_every and self.post_message_count % self.rate_limit_every == 0
+            if is_rate_limited:
+                self.stats.incr('api.chat.postMessage.429')
+                return 429, {'ok': False, 'error': 'ratelimited'}, {'Retry-After': str(self.retry_after_sec)}
+            return 200, {'ok': True, 'channel': params.get('channel'), 'ts': '{:.6f}'.format(time.time())}, None
+        elif method in ('users.list', 'channels.list'):
+            return 200, self.workspace.api_call(method, **params), None
+        return 200, {'ok': False, 'error': 'unknown_method'}, None
+
+    def drop_connections(self):
+        """
+        Dropping all websocket connections.
+        """
+        with self.connections_lock:
+            connections = list(self.connections)
+        for connection in connections:
+            connection.drop()
+        self.stats.incr('ws.dropped', len(connections))
+
+    def serve_websocket(self, connection):
+        self.stats.incr('ws.connections')
+        with self.connections_lock:
+            self.connections.add(connection)
+        reader = threading.Thread(target=self.read_websocket, args=(connection,), name='aqua-standin-ws-reader')
+        reader.daemon = True
+        reader.start()
+        try:
+            connection.send_json({'type': 'hello'})
+            self.push_events(connection)
+            # keeping the connection until client closes it
+            reader.join()
+        except (socket.error, EOFError) as e:
+            logger.info('Websocket closed, {}'.format(e))
+        finally:
+            connection.closed = True
+            with self.connections_lock:
+                self.connections.discard(connection)
+
+    def push_events(self, connection):
+        interval = 1.0 / self.rate if self.rate else 0
+        next_time = time.time()
+        while not connection.closed:
+            for event in self.events:
+                if connection.closed:
+                    return
+                if interval:
+                    next_time += interval
+                    delay = next_time - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                connection.send_json(event)
+                self.stats.incr('ws.events')
+            if not self.loop_events:
+                return
+
+    def read_websocket(self, connection):
+        try:
+            while not connection.closed:
+                opcode, payload = connection.read_frame()
+                if opcode == OPCODE_CLOSE:
+                    break
+                elif opcode == OPCODE_PING:
+                    connection.send(payload, OPCODE_PONG)
+                elif opcode == OPCODE_TEXT:
+                    message = json.loads(payload.decode('utf-8'))
+                    self.stats.incr('ws.received.{}'.format(message.get('type')))
+                    if message.get('type') == 'ping' and not self.mute_pong:
+                        connection.send_json({'type': 'pong', 'reply_to': message.get('id')})
+        except (socket.error, EOFError, ValueError) as e:
+            logger.debug('Websocket reader stopped, {}'.format(e))
+        finally:
+            connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='The local Slack stand-in server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--users', type=int, default=5000, help='the number of users in workspace.')
+    parser.add_argument('--channels', type=int, default=200, help='the number of channels in workspace.')
+    parser.add_argument('--events', type=int, default=10000, help='the number of synthetic events.')
+    parser.add_argument('--record', help='pushing the recorded events file (JSON lines).')
+    parser.add_argument('--rate', type=float, default=100, help='events per second, 0 is as fast as possible.')
+    parser.add_argument('--loop', action='store_true', help='pushing the events repeatedly.')
+    parser.add_argument('--api-latency-ms', type=float, default=0, help='the latency of every Web API call.')
+    parser.add_argument('--rate-limit-every', type=int, default=0,
+                        help='responding 429 for every N-th chat.postMessage.')
+    parser.add_argument('--retry-after', type=int, default=1, help='the Retry-After seconds of 429 response.')
+    parser.add_argument('--drop-every-sec', type=float, default=0,
+                        help='dropping the websocket connections every N seconds, 0 is never.')
+    parser.add_argument('--stats-interval', type=float, default=5, help='the seconds between stats logs.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    workspace = FakeSlackClient(users_count=args.users, channels_count=args.channels)
+    events = load_events(args.record) if args.record else make_events(workspace, args.events)
+    standin = SlackStandin(host=args.host, port=args.port, workspace=workspace, events=events, rate=args.rate,
+                           api_latency_sec=args.api_latency_ms / 1000.0, rate_limit_every=args.rate_limit_every,
+                           retry_after_sec=args.retry_after, loop_events=args.loop).start()
+    last_dropped = time.time()
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            if args.drop_every_sec and time.time() - last_dropped >= args.drop_every_sec:
+                standin.drop_connections()
+                last_dropped = time.time()
+            logger.info('stats: {}'.format(json.dumps(standin.stats.snapshot(), sort_keys=True)))
+    except KeyboardInterrupt:
+        standin.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- encoding: utf-8 -*-
+"""
+Micro-benchmark of parsing message text into user tags and words.
+
+Usage (under aqua folder):
+    python -m bench.tokenizer [messages count]
+"""
+import os
+import re
+import sys
+import random
+import timeit
+import logging
+
+from util import Util
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+DEFAULT_MESSAGES_COUNT = 2000
+BOT_ID = 'U0BOT00001'
+WORDS = ['the', 'deploy', 'is', 'failing', 'again', 'please', 'check', 'build', 'log', 'help', 'hello', ':tada:',
+         'thanks!', 'merged', 'review', 'LGTM', 'ship', 'it', 'tomorrow', 'standup', '`make test`', 'rollback',
+         '<https://example.com/pull/9527|#9527>', '<#C0123456789|general>', 'こんにちは', 'konnichiwa']
+
+
+def legacy_parse(text, bot_id):
+    """
+    The previous implementation, splitting text and matching the uncompiled pattern twice per token.
+    """
+    user_tag_pattern = r'^<@U[\w]{8}>$'
+    text_items = text.split()
+    users_list = [item for item in text_items if re.match(user_tag_pattern, item)]
+    words_list = [item for item in text_items if not re.match(user_tag_pattern, item)]
+    return '<@{bot_id}>'.format(bot_id=bot_id) in users_list, users_list, words_list
+
+
+def make_corpus(messages_count):
+    """
+    :return: a list of long messages with words, user tags (8~11 chars, U and W prefixed), links, and emoji.
+    """
+    random.seed(9527)
+    corpus = []
+    for _ in range(messages_count):
+        tokens = [random.choice(WORDS) for _ in range(random.randint(20, 80))]
+        for _ in range(random.randint(0, 4)):
+            user_id = random.choice(['U{:08d}', 'U{:010d}', 'W{:010d}']).format(random.randint(0, 99999999))
+            tokens.insert(random.randint(0, len(tokens)), '<@{}>'.format(user_id))
+        if random.random() < 0.1:
+            tokens.insert(0, '<@{}>'.format(BOT_ID))
+        corpus.append(' '.join(tokens))
+    return corpus
+
+
+def bench(name, parse_func, corpus, repeat=5):
+    seconds = min(timeit.repeat(lambda: [parse_func(text, BOT_ID) for text in corpus], number=1, repeat=repeat))
+    logger.info('{name:<12} {per:>8.2f} us/message'.format(name=name, per=seconds * 1e6 / len(corpus)))
+    return seconds
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    messages_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MESSAGES_COUNT
+    corpus = make_corpus(messages_count)
+    logger.info('{} messages, {:.1f} tokens/message'.format(len(corpus),
+                                                            sum(len(t.split()) for t in corpus) / float(len(corpus))))
+    legacy_sec = bench('legacy', legacy_parse, corpus)
+    tokenizer_sec = bench('tokenizer', Util.tokenize_text, corpus)
+    logger.info('tokenizer is {:.2f}x of legacy.'.format(legacy_sec / tokenizer_sec))
+
+    tagged = sum(1 for text in corpus if Util.tokenize_text(text, BOT_ID)[0])
+    logger.info('bot tagged messages: {}'.format(tagged))
+
+
+if __name__ == '__main__':
+    main()
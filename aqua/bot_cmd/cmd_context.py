@@ -0,0 +1,32 @@
+# -*- encoding: utf-8 -*-
+from util import Util
+
+
+class CmdContext(object):
+    """
+    The per-invocation context of bot command.
+    """
+
+    def __init__(self, user_obj, channel_obj, users_list, words_list, origin_message, slack_client):
+        self.slack_client = slack_client
+        self.user_obj = user_obj
+        self.channel_obj = channel_obj
+        self.users_list = users_list
+        self.words_list = words_list
+        self.origin_message = origin_message
+
+    def as_kwargs(self):
+        """
+        :return: the dict of command interface, (user_obj, channel_obj, users_list, words_list, origin_message, slack_client).
+        """
+        return {
+            'user_obj': self.user_obj,
+            'channel_obj': self.channel_obj,
+            'users_list': self.users_list,
+            'words_list': self.words_list,
+            'origin_message': self.origin_message,
+            'slack_client': self.slack_client
+        }
+
+    def send(self, send_message):
+        return Util.send(send_message=send_message, channel_obj=self.channel_obj, slack_client=self.slack_client)
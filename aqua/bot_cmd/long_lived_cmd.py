@@ -0,0 +1,21 @@
+# -*- encoding: utf-8 -*-
+
+
+class LongLivedCmd(object):
+    """
+    There is only one instance of long-lived command for the bot lifetime.
+    The expensive setup should be done in setup(), which is called once when command be used at the first time,
+    and then run(context) is called for every message with a CmdContext object.
+
+    The instance may be shared by multiple threads, so keeping the per-message state in context, not in self.
+    """
+
+    def __init__(self, slack_client):
+        self.slack_client = slack_client
+        self.setup()
+
+    def setup(self):
+        pass
+
+    def run(self, context):
+        raise NotImplementedError('This is LongLivedCmd.')
@@ -2,7 +2,9 @@
 
 import os
 import json
+import time
 import logging
+import threading
 
 logger = logging.getLogger(os.path.basename(__file__))
 
@@ -10,28 +12,72 @@ logger = logging.getLogger(os.path.basename(__file__))
 class CheckChannels(object):
     """
     checking channels setting.
+
+    The setting is cached process-wide, please use CheckChannels.get_instance().
+    The file will be reloaded only when its mtime changed, and the mtime is checked at most once per
+    RELOAD_CHECK_INTERVAL_SEC.
     """
+    CHANNELS_SETTING_FILE = 'channels_setting.json'
+    RELOAD_CHECK_INTERVAL_SEC = 5
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
 
     def __init__(self):
-        self.CHANNELS_SETTING_FILE = 'channels_setting.json'
-        self.channels_setting = self.load_channels_setting()
-        self.readonly_channels = self.channels_setting.get('readonly', [])
+        self.file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.CHANNELS_SETTING_FILE)
+        self.lock = threading.Lock()
+        self.file_mtime = None
+        self.checked_at = 0
+        self.channels_setting = {}
+        # the names and ids of read-only channels
+        self.readonly_channels = frozenset()
+        self.reload_if_changed(force=True)
+
+    def get_file_mtime(self):
+        try:
+            return os.stat(self.file_path).st_mtime
+        except OSError:
+            return None
+
+    def reload_if_changed(self, force=False):
+        """
+        Reloading channels_setting.json if the file mtime changed.
+        :param force: checking the mtime without the interval limitation.
+        :return:
+        """
+        now = time.time()
+        if not force and now - self.checked_at < self.RELOAD_CHECK_INTERVAL_SEC:
+            return
+        with self.lock:
+            self.checked_at = now
+            file_mtime = self.get_file_mtime()
+            if force or file_mtime != self.file_mtime:
+                self.file_mtime = file_mtime
+                self.channels_setting = self.load_channels_setting()
+                self.readonly_channels = frozenset(self.channels_setting.get('readonly', []))
 
     def load_channels_setting(self):
         """
         Loading configuration from channels_setting.json.
         :return: a dict of channels_setting.
         """
-        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), self.CHANNELS_SETTING_FILE)
-        if os.path.isfile(file_path):
+        if os.path.isfile(self.file_path):
             try:
-                with open(file_path, 'r') as f:
+                with open(self.file_path, 'r') as f:
                     return json.load(f)
             except Exception as e:
                 logger.error(e)
                 return {}
         else:
-            logger.warn('There is no channel setting file, {}.'.format(file_path))
+            logger.warning('There is no channel setting file, {}.'.format(self.file_path))
             return {}
 
     def is_readonly(self, original_channel_obj):
@@ -42,11 +88,11 @@ class CheckChannels(object):
         """
         is_readonly = False
         if original_channel_obj:
-            for ro_channel_name_id in self.readonly_channels:
-                if original_channel_obj.id == ro_channel_name_id or original_channel_obj.name == ro_channel_name_id:
-                    is_readonly = True
-                    logger.info('Channel [{c}/{cid}] is Read-only.'.format(
-                        c=original_channel_obj.name,
-                        cid=original_channel_obj.id))
-                    break
+            self.reload_if_changed()
+            readonly_channels = self.readonly_channels
+            if original_channel_obj.id in readonly_channels or original_channel_obj.name in readonly_channels:
+                is_readonly = True
+                logger.info('Channel [{c}/{cid}] is Read-only.'.format(
+                    c=original_channel_obj.name,
+                    cid=original_channel_obj.id))
         return is_readonly
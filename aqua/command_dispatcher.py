@@ -0,0 +1,88 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import re
+import logging
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class CommandDispatcher(object):
+    """
+    Compiling the commands handlers once, and matching message against all commands in one pass.
+
+    The handlers are compiled into an ordered table, and also combined into one alternation with a named group
+    per command, so the first matched branch is the first matched command in handlers order.
+    If the handler has 'keywords', they are used as the prefilter. The message without any keyword will be skipped
+    without running the command patterns. (The prefilter only works when every handler has keywords.)
+    """
+    COMMAND_GROUP_FMT = '_aqua_cmd_{index}'
+    # the patterns with back-reference can not be combined, the group numbers will be shifted
+    BACK_REFERENCE_PATTERN = re.compile(r'\\[1-9]|\(\?P=')
+
+    def __init__(self, commands_handlers):
+        """
+        :param commands_handlers: an ordered dict of {pattern: command_handler_obj}.
+        """
+        self.handlers = [(pattern, re.compile(pattern), handler_obj)
+                         for pattern, handler_obj in commands_handlers.items()]
+        self.keywords_re = self.compile_keywords()
+        self.combined_re, self.combined_groups = self.compile_combined()
+
+    def compile_keywords(self):
+        """
+        :return: the compiled keywords prefilter, or None if there is any handler without keywords.
+        """
+        keywords = set()
+        for _, _, handler_obj in self.handlers:
+            handler_keywords = handler_obj.get('keywords')
+            if not handler_keywords:
+                return None
+            keywords.update(handler_keywords)
+        return re.compile('|'.join(re.escape(keyword) for keyword in keywords))
+
+    def compile_combined(self):
+        """
+        :return: (compiled pattern, dict of {group name: (handler index, first group index)}),
+            or (None, None) if the patterns can not be combined.
+        """
+        parts = []
+        combined_groups = {}
+        group_index = 1
+        for index, (pattern, compiled_re, _) in enumerate(self.handlers):
+            if self.BACK_REFERENCE_PATTERN.search(pattern):
+                logger.info('Command pattern has back-reference, using sequential matching. {}'.format(pattern))
+                return None, None
+            group_name = self.COMMAND_GROUP_FMT.format(index=index)
+            parts.append('(?P<{name}>{pattern})'.format(name=group_name, pattern=pattern))
+            combined_groups[group_name] = (index, group_index)
+            group_index += 1 + compiled_re.groups
+        try:
+            return re.compile('|'.join(parts)), combined_groups
+        except (re.error, AssertionError, OverflowError) as e:
+            # ex: too many groups, or conflicting group names and flags
+            logger.info('Can not combine command patterns, using sequential matching. {}'.format(e))
+            return None, None
+
+    def match(self, message):
+        """
+        Finding the first matched command of message.
+        :param message:
+        :return: (command_handler_obj, groups of command pattern), or (None, None) if there is no matched command.
+        """
+        if self.keywords_re and not self.keywords_re.search(message):
+            return None, None
+
+        if self.combined_re:
+            re_ret = self.combined_re.match(message)
+            if re_ret:
+                index, group_index = self.combined_groups[re_ret.lastgroup]
+                _, compiled_re, handler_obj = self.handlers[index]
+                return handler_obj, re_ret.groups()[group_index:group_index + compiled_re.groups]
+            return None, None
+
+        for _, compiled_re, handler_obj in self.handlers:
+            re_ret = compiled_re.match(message)
+            if re_ret:
+                return handler_obj, re_ret.groups()
+        return None, None
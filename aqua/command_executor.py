@@ -0,0 +1,160 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import time
+import logging
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class CommandTimeoutError(Exception):
+    pass
+
+
+class CommandQueueFullError(Exception):
+    pass
+
+
+class CommandFuture(object):
+    """
+    The result of command which is running by CommandExecutor.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.event = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def set_result(self, result):
+        if not self.event.is_set():
+            self._result = result
+            self.event.set()
+
+    def set_exception(self, exception):
+        if not self.event.is_set():
+            self._exception = exception
+            self.event.set()
+
+    def done(self):
+        return self.event.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waiting and return the result of command.
+        :param timeout: seconds.
+        :return: the result of command.
+        """
+        if not self.event.wait(timeout):
+            raise CommandTimeoutError('Waiting command {} timeout.'.format(self.name))
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class CommandExecutor(object):
+    """
+    Running the commands by a pool of worker threads, so the slow command does not block the RTM loop.
+
+    The commands of the same channel are always run by the same worker, which keeps the per-channel ordering,
+    and the concurrency is bounded by the number of workers.
+    The future of command which runs over its timeout will be failed with CommandTimeoutError.
+    (The python thread can not be killed, so the worker is still busy until the command returns.)
+    """
+    DEFAULT_WORKERS = 4
+    DEFAULT_TIMEOUT_SEC = 30
+    DEFAULT_MAX_QUEUE_SIZE = 100
+
+    def __init__(self, workers=None, timeout=None, max_queue_size=None):
+        self.workers = workers or self.DEFAULT_WORKERS
+        self.timeout = timeout or self.DEFAULT_TIMEOUT_SEC
+        self.queues = [queue.Queue(max_queue_size or self.DEFAULT_MAX_QUEUE_SIZE) for _ in range(self.workers)]
+        # the (future, started time, timeout) of running command, by worker index
+        self.running = [None] * self.workers
+        self.is_shutdown = False
+        self.threads = []
+        for index in range(self.workers):
+            self.threads.append(self.start_thread(self.worker_loop, 'aqua-cmd-worker-{}'.format(index), index))
+        self.watchdog_thread = self.start_thread(self.watchdog_loop, 'aqua-cmd-watchdog')
+
+    @staticmethod
+    def start_thread(target, name, *args):
+        thread = threading.Thread(target=target, name=name, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def pending_count(self):
+        """
+        :return: the number of queued commands.
+        """
+        return sum(q.qsize() for q in self.queues)
+
+    def submit(self, channel_id, name, func, timeout=None):
+        """
+        Submitting the command.
+        :param channel_id: the commands of same channel will be run in order.
+        :param name: the command name, for logging.
+        :param func: the callable without arguments.
+        :param timeout: seconds, or using the default timeout.
+        :return: CommandFuture object.
+        """
+        future = CommandFuture(name)
+        index = hash(channel_id) % self.workers
+        try:
+            self.queues[index].put_nowait((future, func, timeout or self.timeout))
+        except queue.Full:
+            logger.warning('Command queue of worker {idx} is full, dropping {cmd}.'.format(idx=index, cmd=name))
+            future.set_exception(CommandQueueFullError('Command queue is full.'))
+        return future
+
+    def worker_loop(self, index):
+        while True:
+            item = self.queues[index].get()
+            if item is None:
+                break
+            future, func, timeout = item
+            started = time.time()
+            self.running[index] = (future, started, timeout)
+            try:
+                future.set_result(func())
+            except Exception as e:
+                logger.exception('Command {cmd} failed. {e}'.format(cmd=future.name, e=e))
+                future.set_exception(e)
+            finally:
+                self.running[index] = None
+            elapsed = time.time() - started
+            if elapsed > timeout:
+                logger.warning('Command {cmd} took {sec:.3f}s, over timeout {timeout}s.'.format(
+                    cmd=future.name, sec=elapsed, timeout=timeout))
+
+    def watchdog_loop(self):
+        while not self.is_shutdown:
+            time.sleep(min(1.0, self.timeout))
+            now = time.time()
+            for running in list(self.running):
+                if running is None:
+                    continue
+                future, started, timeout = running
+                if not future.done() and now - started > timeout:
+                    logger.warning('Command {cmd} timeout, {timeout}s.'.format(cmd=future.name, timeout=timeout))
+                    future.set_exception(CommandTimeoutError('Command {} timeout.'.format(future.name)))
+
+    def shutdown(self, wait=True):
+        """
+        Stopping the workers after the queued commands are done.
+        :param wait: waiting for the workers.
+        :return:
+        """
+        self.is_shutdown = True
+        for q in self.queues:
+            q.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join()
@@ -0,0 +1,384 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import io
+import sys
+import time
+import heapq
+import random
+import signal
+import logging
+import tempfile
+import threading
+import traceback
+
+try:
+    import cProfile
+    import pstats
+except ImportError:
+    cProfile = None
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 has no tracemalloc
+    tracemalloc = None
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+def get_cpu_time():
+    """
+    :return: the CPU seconds of current thread if supported, else of the process.
+    """
+    for name in ('thread_time', 'process_time', 'clock'):
+        func = getattr(time, name, None)
+        if func is not None:
+            return func()
+    return 0.0
+
+
+class CommandProfiler(object):
+    """
+    The opt-in profiler of commands, it can be switched on and off at runtime, without redeploying.
+        - sending SIGUSR1 to the process toggles it.
+        - or creating the flag file (checked at most once per FLAG_CHECK_INTERVAL_SEC), and removing it to stop.
+    The signal handler only requests the toggle, it is applied by poll() in the RTM loop.
+
+    When it is on, the sampled command runs are timed by wall and CPU time, or profiled by cProfile in 'cprofile'
+    mode. Once a run passes slow_threshold_sec, the stack sampler thread samples the stack of the running command,
+    so the report shows where the slow command spends its time.
+    The command which is slower than slow_threshold_sec is an outlier, its next sampled run is also profiled by
+    cProfile, and records the allocations by tracemalloc (Python 3 only).
+    The report of commands and the top slow runs, with their stack samples, profile stats and allocations, is
+    written to the report file by write_report().
+
+    The profiler is process-wide, please use CommandProfiler.get_instance().
+    """
+    MODE_TIMER = 'timer'
+    MODE_CPROFILE = 'cprofile'
+    DEFAULT_SAMPLE_RATE = 1.0
+    DEFAULT_SLOW_THRESHOLD_SEC = 1.0
+    DEFAULT_TOP_N = 10
+    # the package directory may be read-only when it is installed, writing the report into temp directory by default
+    DEFAULT_REPORT_FILE = os.path.join(tempfile.gettempdir(), 'slow_commands_report.txt')
+    FLAG_CHECK_INTERVAL_SEC = 5
+    PROFILE_STATS_LINES = 20
+    ALLOCATION_STATS_LINES = 10
+    # the stack of slow run is sampled every STACK_SAMPLES_PER_THRESHOLD-th of slow_threshold_sec
+    STACK_SAMPLES_PER_THRESHOLD = 10
+    MIN_STACK_SAMPLE_INTERVAL_SEC = 0.005
+    STACK_LIMIT = 20
+    STACKS_IN_REPORT = 3
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.enabled = False
+        self.mode = self.MODE_TIMER
+        self.sample_rate = self.DEFAULT_SAMPLE_RATE
+        self.slow_threshold_sec = self.DEFAULT_SLOW_THRESHOLD_SEC
+        self.top_n = self.DEFAULT_TOP_N
+        self.report_path = self.DEFAULT_REPORT_FILE
+        self.flag_path = None
+        self.flag_checked_at = 0
+        # set by the signal handler, ref: poll()
+        self.toggle_requested = False
+        self.lock = threading.Lock()
+        # {thread ident: {'name', 'started', 'stacks': {stack: samples}}} of the running sampled commands
+        self.active_runs = {}
+        self.sampler_thread = None
+        # tracemalloc and cProfile can only trace one command at once
+        self.trace_lock = threading.Lock()
+        self.reset()
+
+    def configure(self, mode=None, sample_rate=None, slow_threshold_sec=None, top_n=None, report_path=None,
+                  flag_path=None):
+        """
+        :param mode: 'timer' or 'cprofile'.
+        :param sample_rate: the ratio of profiled command runs, 0.0 ~ 1.0.
+        :param slow_threshold_sec: the run slower than it is a slow run.
+        :param top_n: the number of slow runs in report.
+        :param report_path: the path of report file, the DEFAULT_REPORT_FILE in temp directory by default.
+        :param flag_path: the profiler is on if the file exists.
+        :return:
+        """
+        if mode:
+            if mode == self.MODE_CPROFILE and cProfile is None:
+                logger.warning('cProfile is not available, using the timer mode.')
+                mode = self.MODE_TIMER
+            self.mode = mode
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+        if slow_threshold_sec is not None:
+            self.slow_threshold_sec = slow_threshold_sec
+        if top_n:
+            self.top_n = top_n
+        if report_path:
+            self.report_path = report_path
+        if flag_path:
+            self.flag_path = flag_path
+        return self
+
+    def install_signal_handler(self):
+        """
+        Toggling the profiler by SIGUSR1, it only works in the main thread and on the platform which has SIGUSR1.
+        The handler only sets the flag, the signal may arrive while the main thread holds self.lock, so switching
+        and writing the report are done by poll().
+        :return: True if the handler is installed.
+        """
+        if not hasattr(signal, 'SIGUSR1'):
+            return False
+        try:
+            signal.signal(signal.SIGUSR1, self.request_toggle)
+        except ValueError:
+            # not in the main thread
+            return False
+        return True
+
+    def request_toggle(self, signum=None, frame=None):
+        self.toggle_requested = True
+
+    def toggle(self):
+        self.set_enabled(not self.enabled)
+
+    def set_enabled(self, enabled):
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+        logger.info('Command profiler is {}.'.format('on' if enabled else 'off'))
+        if enabled:
+            self.start_sampler()
+        else:
+            self.write_report()
+
+    def poll(self):
+        """
+        Applying the toggle requested by SIGUSR1, and checking the flag file.
+        It is called by the RTM loop, never by the signal handler.
+        """
+        if self.toggle_requested:
+            self.toggle_requested = False
+            self.toggle()
+        self.check_flag_file()
+
+    def check_flag_file(self):
+        """
+        Switching the profiler by the existence of flag file.
+        """
+        if not self.flag_path:
+            return
+        now = time.time()
+        if now - self.flag_checked_at < self.FLAG_CHECK_INTERVAL_SEC:
+            return
+        self.flag_checked_at = now
+        self.set_enabled(os.path.exists(self.flag_path))
+
+    def reset(self):
+        with self.lock:
+            # {command name: {'count', 'wall', 'cpu', 'max_wall'}}
+            self.stats = {}
+            # the heap of (wall, seq, record) of top slow runs
+            self.slow_runs = []
+            self.seq = 0
+            # the commands which will record allocations at next run
+            self.outliers = set()
+
+    def run(self, name, func):
+        """
+        Running the command, and profiling it if the profiler is on and the run is sampled.
+        :param name: the command name.
+        :param func: the callable without arguments.
+        :return: the result of func.
+        """
+        if not self.enabled or (self.sample_rate < 1.0 and random.random() >= self.sample_rate):
+            return func()
+
+        is_outlier = name in self.outliers
+        is_traced = (self.mode == self.MODE_CPROFILE or is_outlier) and self.trace_lock.acquire(False)
+        # the traced run of outlier, which is profiled even in 'timer' mode
+        is_outlier_run = is_traced and is_outlier
+        profiler = None
+        is_tracing_memory = False
+        if is_traced:
+            if cProfile is not None:
+                profiler = cProfile.Profile()
+            if tracemalloc is not None and is_outlier and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                is_tracing_memory = True
+        thread_ident = threading.current_thread().ident
+        active_run = {'name': name, 'started': time.time(), 'stacks': {}}
+        with self.lock:
+            self.active_runs[thread_ident] = active_run
+        wall_started = active_run['started']
+        cpu_started = get_cpu_time()
+        try:
+            if profiler is not None:
+                return profiler.runcall(func)
+            return func()
+        finally:
+            wall = time.time() - wall_started
+            cpu = get_cpu_time() - cpu_started
+            with self.lock:
+                self.active_runs.pop(thread_ident, None)
+                stacks = dict(active_run['stacks'])
+            allocations = None
+            if is_tracing_memory:
+                allocations = self.format_allocations(tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            if is_traced:
+                self.trace_lock.release()
+            self.record(name, wall, cpu, profiler, allocations, stacks, is_outlier_run)
+
+    def start_sampler(self):
+        if self.sampler_thread is not None and self.sampler_thread.is_alive():
+            return
+        self.sampler_thread = threading.Thread(target=self.sample_loop, name='aqua-profiler-sampler')
+        self.sampler_thread.daemon = True
+        self.sampler_thread.start()
+
+    def sample_loop(self):
+        """
+        Sampling the stacks of the running commands which pass slow_threshold_sec, until the profiler is off.
+        """
+        while self.enabled:
+            time.sleep(max(self.MIN_STACK_SAMPLE_INTERVAL_SEC,
+                           float(self.slow_threshold_sec) / self.STACK_SAMPLES_PER_THRESHOLD))
+            self.sample_stacks()
+
+    def sample_stacks(self):
+        now = time.time()
+        with self.lock:
+            slow_runs = [(thread_ident, active_run) for thread_ident, active_run in self.active_runs.items()
+                         if now - active_run['started'] >= self.slow_threshold_sec]
+        if not slow_runs:
+            return
+        frames = sys._current_frames()
+        samples = []
+        for thread_ident, active_run in slow_runs:
+            frame = frames.get(thread_ident)
+            if frame is not None:
+                samples.append((thread_ident, active_run,
+                                ''.join(traceback.format_stack(frame, limit=self.STACK_LIMIT))))
+        del frames
+        with self.lock:
+            for thread_ident, active_run, stack in samples:
+                # skipping the run which has finished while formatting the stack
+                if self.active_runs.get(thread_ident) is active_run:
+                    stacks = active_run['stacks']
+                    stacks[stack] = stacks.get(stack, 0) + 1
+
+    def record(self, name, wall, cpu, profiler, allocations, stacks, is_outlier_run):
+        """
+        :param stacks: {stack: samples} of the running command.
+        :param is_outlier_run: True if it is the traced run of outlier, then the command is not an outlier anymore.
+        """
+        is_slow = wall >= self.slow_threshold_sec
+        with self.lock:
+            stats = self.stats.setdefault(name, {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'max_wall': 0.0})
+            stats['count'] += 1
+            stats['wall'] += wall
+            stats['cpu'] += cpu
+            stats['max_wall'] = max(stats['max_wall'], wall)
+            if is_outlier_run:
+                self.outliers.discard(name)
+            elif is_slow:
+                self.outliers.add(name)
+        if not is_slow and not is_outlier_run:
+            return
+
+        record = {
+            'name': name,
+            'wall': wall,
+            'cpu': cpu,
+            'at': time.time(),
+            'thread': threading.current_thread().name,
+            # [(samples, stack)], the most sampled stacks of the running command
+            'stacks': sorted(((count, stack) for stack, count in stacks.items()),
+                             reverse=True)[:self.STACKS_IN_REPORT],
+            'samples': sum(stacks.values()),
+            'profile': self.format_profile(profiler) if profiler is not None else None,
+            'allocations': allocations,
+        }
+        with self.lock:
+            self.seq += 1
+            item = (wall, self.seq, record)
+            if len(self.slow_runs) < self.top_n:
+                heapq.heappush(self.slow_runs, item)
+            else:
+                heapq.heappushpop(self.slow_runs, item)
+        if is_slow:
+            logger.warning('Slow command {name}, wall {wall:.3f}s, cpu {cpu:.3f}s.'.format(name=name, wall=wall,
+                                                                                            cpu=cpu))
+
+    def format_profile(self, profiler):
+        stream = io.BytesIO() if str is bytes else io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(self.PROFILE_STATS_LINES)
+        return stream.getvalue()
+
+    def format_allocations(self, snapshot, peak_size):
+        """
+        :param snapshot: the tracemalloc snapshot after the command returns.
+        :param peak_size: the peak traced memory while the command runs, including the freed temporary objects.
+        """
+        lines = ['peak={kib:.1f} KiB, the allocations which are still alive:'.format(kib=peak_size / 1024.0)]
+        for stat in snapshot.statistics('lineno')[:self.ALLOCATION_STATS_LINES]:
+            lines.append('{stat}'.format(stat=stat))
+        return '\n'.join(lines)
+
+    def format_report(self):
+        with self.lock:
+            stats = dict((name, dict(value)) for name, value in self.stats.items())
+            slow_runs = sorted(self.slow_runs, reverse=True)
+        lines = ['# Command profile report, {}'.format(time.strftime('%Y-%m-%d %H:%M:%S')),
+                 '# mode: {mode}, sample rate: {rate}, slow threshold: {sec}s'.format(mode=self.mode,
+                                                                                      rate=self.sample_rate,
+                                                                                      sec=self.slow_threshold_sec),
+                 '',
+                 '## Commands (by total wall time)',
+                 '{:<40} {:>8} {:>12} {:>12} {:>12} {:>12}'.format('command', 'count', 'wall total', 'cpu total',
+                                                                  'wall avg', 'wall max')]
+        for name, value in sorted(stats.items(), key=lambda item: item[1]['wall'], reverse=True):
+            lines.append('{:<40} {:>8} {:>11.3f}s {:>11.3f}s {:>11.3f}s {:>11.3f}s'.format(
+                name, value['count'], value['wall'], value['cpu'], value['wall'] / value['count'], value['max_wall']))
+        lines.extend(['', '## Top {} slow runs'.format(len(slow_runs))])
+        for index, (_, _, record) in enumerate(slow_runs, 1):
+            lines.extend(['',
+                          '### {idx}. {name}, wall {wall:.3f}s, cpu {cpu:.3f}s, thread {thread}, at {at}'.format(
+                              idx=index, name=record['name'], wall=record['wall'], cpu=record['cpu'],
+                              thread=record['thread'],
+                              at=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['at']))),
+                          'Call stacks, {n} samples while running:'.format(n=record['samples'])])
+            for count, stack in record['stacks']:
+                lines.extend(['{count} samples:'.format(count=count), stack.rstrip()])
+            if record['profile']:
+                lines.extend(['Profile:', record['profile'].rstrip()])
+            if record['allocations']:
+                lines.extend(['Allocations:', record['allocations']])
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self):
+        """
+        Writing the report file.
+        :return: True if written.
+        """
+        if not self.stats:
+            return False
+        try:
+            with open(self.report_path, 'w') as f:
+                f.write(self.format_report())
+        except (IOError, OSError) as e:
+            logger.warning('Can not write profile report {path}, {e}'.format(path=self.report_path, e=e))
+            return False
+        logger.info('Wrote profile report {path}'.format(path=self.report_path))
+        return True
@@ -0,0 +1,80 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import logging
+import threading
+
+from util import Util
+from bot_cmd.base_cmd import BaseCmd
+from bot_cmd.long_lived_cmd import LongLivedCmd
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class CommandRegistry(object):
+    """
+    Resolving and validating the command classes once, and keeping the instance of long-lived commands.
+        - BaseCmd subclass: a new object is created for every message, then run().
+        - LongLivedCmd subclass: the object is created once, then run(context) for every message.
+    """
+
+    def __init__(self, slack_client, cmd_class_names=None, command_classes=None):
+        """
+        :param slack_client:
+        :param cmd_class_names: the command classes which will be resolved and validated at startup.
+        :param command_classes: the dict of resolved command classes, it can be shared by the registries of
+        different workspaces, which only resolve the classes once.
+        """
+        self.slack_client = slack_client
+        self.command_classes = command_classes if command_classes is not None else {}
+        self.instances = {}
+        self.lock = threading.Lock()
+        for cmd_class_name in cmd_class_names or []:
+            self.resolve(cmd_class_name)
+
+    def resolve(self, cmd_class_name):
+        """
+        Loading and validating the command class, the result will be cached.
+        :param cmd_class_name: ex: bot_cmd.greeting.Greeting
+        :return: bot command class.
+        """
+        cmd_clz = self.command_classes.get(cmd_class_name)
+        if cmd_clz is None:
+            try:
+                cmd_clz = Util.load_cmd_class(cmd_class_name)
+            except (ImportError, AttributeError, ValueError) as e:
+                raise Exception('Loading command class failed, {name}. {e}'.format(name=cmd_class_name, e=e))
+            if not (isinstance(cmd_clz, type) and issubclass(cmd_clz, (BaseCmd, LongLivedCmd))):
+                raise Exception('{name} is not a subclass of BaseCmd or LongLivedCmd.'.format(name=cmd_class_name))
+            self.command_classes[cmd_class_name] = cmd_clz
+            logger.debug('Command class loaded, {}.'.format(cmd_class_name))
+        return cmd_clz
+
+    def get_instance(self, cmd_class_name):
+        """
+        Return the instance of long-lived command, it will be created at the first time.
+        :param cmd_class_name:
+        :return:
+        """
+        instance = self.instances.get(cmd_class_name)
+        if instance is None:
+            with self.lock:
+                instance = self.instances.get(cmd_class_name)
+                if instance is None:
+                    instance = self.resolve(cmd_class_name)(slack_client=self.slack_client)
+                    self.instances[cmd_class_name] = instance
+        return instance
+
+    def run(self, cmd_class_name, context):
+        """
+        Running the command with context.
+        :param cmd_class_name:
+        :param context: CmdContext object.
+        :return: the result of command.
+        """
+        cmd_clz = self.resolve(cmd_class_name)
+        if issubclass(cmd_clz, LongLivedCmd):
+            return self.get_instance(cmd_class_name).run(context)
+        # command interface:
+        #     user_obj, channel_obj, users_list, words_list, origin_message, slack_client
+        return cmd_clz(**context.as_kwargs()).run()
@@ -0,0 +1,133 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class Directory(object):
+    """
+    The directory of users or channels, which are indexed by id and by lowercase name.
+    The object in directory should have 'id' and 'name' attributes, ex: SlackUser and SlackChannel.
+    Ref: Util.load_slack_users(), and Util.load_slack_channels()
+
+    It also remembers the missed search strings for MISS_TTL_SEC, so looking up an unknown id again does not fall
+    back to the linear search of slackclient state, ref: Util.find_user(). They are forgotten once an object is
+    added or renamed.
+    """
+    MISS_TTL_SEC = 60
+    MAX_MISSES = 10000
+
+    def __init__(self, objs=None):
+        self.by_id = {}
+        self.by_name = {}
+        # {search string: expire time}
+        self.misses = {}
+        self.lock = threading.Lock()
+        for obj in objs or []:
+            self.add(obj)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __iter__(self):
+        return iter(list(self.by_id.values()))
+
+    def __contains__(self, obj_id):
+        return obj_id in self.by_id
+
+    @staticmethod
+    def normalize_name(name):
+        """
+        :param name: user or channel name, the channel name can start with '#'.
+        :return: lowercase name without '#'.
+        """
+        if not name:
+            return name
+        return name.lstrip('#').lower()
+
+    def add(self, obj):
+        """
+        Adding or replacing the object by its id.
+        :param obj:
+        :return:
+        """
+        with self.lock:
+            old_obj = self.by_id.get(obj.id)
+            if old_obj is not None:
+                self._remove_name(old_obj)
+            self.by_id[obj.id] = obj
+            name = self.normalize_name(getattr(obj, 'name', None))
+            if name:
+                self.by_name[name] = obj
+            if self.misses:
+                self.misses.clear()
+
+    def remove(self, obj_id):
+        """
+        Removing the object by id.
+        :param obj_id:
+        :return: the removed object, or None.
+        """
+        with self.lock:
+            obj = self.by_id.pop(obj_id, None)
+            if obj is not None:
+                self._remove_name(obj)
+            return obj
+
+    def rename(self, obj_id, name):
+        """
+        Renaming the object, and updating the name index.
+        :param obj_id:
+        :param name: new name.
+        :return: the renamed object, or None if there is no such object.
+        """
+        with self.lock:
+            obj = self.by_id.get(obj_id)
+            if obj is not None:
+                self._remove_name(obj)
+                obj.name = name
+                normalized_name = self.normalize_name(name)
+                if normalized_name:
+                    self.by_name[normalized_name] = obj
+                if self.misses:
+                    self.misses.clear()
+            return obj
+
+    def _remove_name(self, obj):
+        name = self.normalize_name(getattr(obj, 'name', None))
+        if name and self.by_name.get(name) is obj:
+            del self.by_name[name]
+
+    def get_by_id(self, obj_id):
+        return self.by_id.get(obj_id)
+
+    def get_by_name(self, name):
+        return self.by_name.get(self.normalize_name(name))
+
+    def find(self, search_string):
+        """
+        Finding the object by id, then by name.
+        :param search_string: id or name.
+        :return: the object, or None.
+        """
+        obj = self.by_id.get(search_string)
+        if obj is None:
+            obj = self.get_by_name(search_string)
+        return obj
+
+    def is_miss(self, search_string):
+        """
+        :param search_string: id or name.
+        :return: True if it is recently missed in this directory and in the fallback.
+        """
+        expire_at = self.misses.get(search_string)
+        return expire_at is not None and expire_at > time.time()
+
+    def add_miss(self, search_string):
+        if len(self.misses) >= self.MAX_MISSES:
+            self.misses.clear()
+        self.misses[search_string] = time.time() + self.MISS_TTL_SEC
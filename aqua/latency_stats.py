@@ -0,0 +1,89 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import bisect
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class LatencyStats(object):
+    """
+    Collecting latency samples (in seconds), and reporting count/avg/p50/p99/max and the histogram.
+    Only the latest MAX_SAMPLES samples are kept for the percentiles, the histogram counts all samples.
+    """
+    MAX_SAMPLES = 10000
+    # the upper bounds (ms) of histogram buckets, the last bucket is +Inf
+    BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+    def __init__(self, name, max_samples=None):
+        self.name = name
+        self.samples = deque(maxlen=max_samples or self.MAX_SAMPLES)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(self.BUCKETS_MS) + 1)
+        self.lock = threading.Lock()
+
+    def add(self, latency_sec):
+        with self.lock:
+            self.samples.append(latency_sec)
+            self.count += 1
+            self.total += latency_sec
+            if latency_sec > self.max:
+                self.max = latency_sec
+            self.buckets[bisect.bisect_left(self.BUCKETS_MS, latency_sec * 1000)] += 1
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+            self.buckets = [0] * (len(self.BUCKETS_MS) + 1)
+
+    def percentile(self, pct):
+        """
+        Return the pct (0~100) percentile of kept samples, or 0 if there is no sample.
+        :param pct:
+        :return:
+        """
+        with self.lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return 0.0
+        index = int(round((len(ordered) - 1) * pct / 100.0))
+        return ordered[index]
+
+    def histogram(self):
+        """
+        :return: a list of (upper bound ms, count), the last upper bound is '+Inf'.
+        """
+        bounds = list(self.BUCKETS_MS) + ['+Inf']
+        return list(zip(bounds, list(self.buckets)))
+
+    def summary(self):
+        """
+        :return: a dict of count, avg, p50, p99, max, and histogram. Latency values are in seconds.
+        """
+        count = self.count
+        return {
+            'count': count,
+            'avg': self.total / count if count else 0.0,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'histogram': self.histogram()
+        }
+
+    def format_summary(self):
+        summary = self.summary()
+        return '{name}: count={count} avg={avg:.3f}ms p50={p50:.3f}ms p99={p99:.3f}ms max={max:.3f}ms'.format(
+            name=self.name,
+            count=summary['count'],
+            avg=summary['avg'] * 1000,
+            p50=summary['p50'] * 1000,
+            p99=summary['p99'] * 1000,
+            max=summary['max'] * 1000)
@@ -0,0 +1,135 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import json
+import logging
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class LogSampler(object):
+    """
+    Sampling 1 of every N log lines, for the per-message logs on hot path.
+    """
+
+    def __init__(self, rate=1.0):
+        """
+        :param rate: 0 ~ 1, ex: 0.01 keeps 1 of every 100 lines. 0 drops all lines.
+        """
+        self.every = int(round(1.0 / rate)) if rate and rate > 0 else 0
+        self.count = 0
+
+    def sample(self):
+        if not self.every:
+            return False
+        self.count += 1
+        return self.every == 1 or self.count % self.every == 1
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    The structured log formatter, one JSON object per line.
+    The fields can be added by extra, ex: logger.info('msg %s', arg, extra={'fields': {'channel': channel_id}})
+    """
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            data.update(fields)
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class AsyncQueueHandler(logging.Handler):
+    """
+    The non-blocking handler, the records are put into a bounded queue, and handled by the target handlers in
+    a background thread. The record is dropped if the queue is full, so logging never stalls the caller.
+    """
+    DEFAULT_MAX_QUEUE_SIZE = 10000
+
+    def __init__(self, handlers, max_queue_size=None):
+        logging.Handler.__init__(self)
+        self.handlers = list(handlers)
+        self.queue = queue.Queue(max_queue_size or self.DEFAULT_MAX_QUEUE_SIZE)
+        self.dropped_count = 0
+        self.thread = threading.Thread(target=self.consume_loop, name='aqua-log')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_count += 1
+
+    def consume_loop(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        logging.Handler.close(self)
+
+
+class LogUtil(object):
+    LOG_FORMAT_TEXT = 'text'
+    LOG_FORMAT_JSON = 'json'
+
+    configured = False
+
+    @staticmethod
+    def configure(log_format=None, log_queue=False):
+        """
+        Configuring the root logger once.
+        :param log_format: 'text' or 'json'.
+        :param log_queue: moving the handlers behind AsyncQueueHandler.
+        :return:
+        """
+        if LogUtil.configured:
+            return
+        LogUtil.configured = True
+        root = logging.getLogger()
+        handlers = list(root.handlers) or [logging.StreamHandler()]
+        if log_format == LogUtil.LOG_FORMAT_JSON:
+            for handler in handlers:
+                handler.setFormatter(JsonFormatter())
+        if log_queue:
+            for handler in handlers:
+                root.removeHandler(handler)
+            root.addHandler(AsyncQueueHandler(handlers))
+        logger.debug('Logging configured, format: {f}, queue: {q}'.format(f=log_format, q=log_queue))
+
+    @staticmethod
+    def restart_after_fork():
+        """
+        Restarting the AsyncQueueHandler in the forked process (ex: the shard worker), the child inherits the
+        handler but not its consumer thread, so the records would be queued and never written.
+        """
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if not isinstance(handler, AsyncQueueHandler):
+                continue
+            root.removeHandler(handler)
+            for target in handler.handlers:
+                # the lock may be held by the consumer thread of parent when forking
+                target.createLock()
+            root.addHandler(AsyncQueueHandler(handler.handlers))
@@ -0,0 +1,123 @@
+# -*- encoding: utf-8 -*-
+
+import time
+import heapq
+from collections import deque
+
+
+class MessageDedup(object):
+    """
+    The bounded store of seen messages, keyed by (channel id, ts), which drops the redelivered messages.
+    Ex: Slack may deliver the same message again after reconnecting.
+
+    The oldest keys are evicted when there are more than max_size keys, or they are older than ttl_sec.
+    """
+    DEFAULT_MAX_SIZE = 10000
+    DEFAULT_TTL_SEC = 600
+
+    def __init__(self, max_size=None, ttl_sec=None):
+        self.max_size = max_size or self.DEFAULT_MAX_SIZE
+        self.ttl_sec = ttl_sec or self.DEFAULT_TTL_SEC
+        # {key: seen time}, and the keys in the order of seen time, not by OrderedDict which is slow on Python 2
+        self.seen = {}
+        self.seen_order = deque()
+
+    def __len__(self):
+        return len(self.seen)
+
+    def is_duplicate(self, key):
+        """
+        :param key: ex: (channel id, ts)
+        :return: True if the key has been seen, else recording it and return False.
+        """
+        now = time.time()
+        self.evict(now)
+        if key in self.seen:
+            return True
+        self.seen[key] = now
+        self.seen_order.append(key)
+        if len(self.seen_order) > self.max_size:
+            del self.seen[self.seen_order.popleft()]
+        return False
+
+    def evict(self, now):
+        seen_order = self.seen_order
+        while seen_order and now - self.seen[seen_order[0]] >= self.ttl_sec:
+            del self.seen[seen_order.popleft()]
+
+
+class EditDebouncer(object):
+    """
+    Debouncing the bursts of edits (message_changed) of the same message, only the last edit is handled.
+
+    The edit is due when there is no newer edit of the same message in delay_sec, or it has been pending for
+    max_delay_sec, so the message which keeps changing is still handled.
+    If there are more than max_pending messages, the ones which are due first are popped at once.
+
+    The due times are kept in a heap, a newer edit pushes a new entry and the outdated entry is skipped when it is
+    popped, so pop_due() only looks at the due edits.
+    """
+    DEFAULT_MAX_PENDING = 1000
+    # the max_delay_sec is DEFAULT_MAX_DELAY_FACTOR times delay_sec by default
+    DEFAULT_MAX_DELAY_FACTOR = 5
+
+    def __init__(self, delay_sec, max_delay_sec=None, max_pending=None):
+        self.delay_sec = delay_sec
+        self.max_delay_sec = max_delay_sec or delay_sec * self.DEFAULT_MAX_DELAY_FACTOR
+        self.max_pending = max_pending or self.DEFAULT_MAX_PENDING
+        # {key: [due time, deadline, the last event, sequence of its heap entry]}
+        self.pending = {}
+        # the heap of (due time, sequence, key), the sequence breaks the tie of due time and marks the latest entry
+        self.due_heap = []
+        self.sequence = 0
+        self.superseded_count = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, key, rtm_result):
+        """
+        :param key: ex: (channel id, ts of the edited message)
+        :param rtm_result: the message_changed event, which replaces the pending edit of same key.
+        :return:
+        """
+        now = time.time()
+        self.sequence += 1
+        item = self.pending.get(key)
+        if item is None:
+            item = self.pending[key] = [now + self.delay_sec, now + self.max_delay_sec, rtm_result, self.sequence]
+        else:
+            self.superseded_count += 1
+            item[0] = min(now + self.delay_sec, item[1])
+            item[2] = rtm_result
+            item[3] = self.sequence
+        heapq.heappush(self.due_heap, (item[0], self.sequence, key))
+
+    def is_outdated(self, entry):
+        item = self.pending.get(entry[2])
+        return item is None or item[3] != entry[1]
+
+    def pop_due(self, force=False):
+        """
+        :param force: True to pop all pending edits.
+        :return: a list of due events, in the order of due time.
+        """
+        now = time.time()
+        due_heap = self.due_heap
+        events = []
+        while due_heap and (force or due_heap[0][0] <= now or len(self.pending) > self.max_pending):
+            entry = heapq.heappop(due_heap)
+            if not self.is_outdated(entry):
+                events.append(self.pending.pop(entry[2])[2])
+        return events
+
+    def next_due_timeout(self):
+        """
+        :return: the seconds before the next edit is due, or None if there is no pending edit.
+        """
+        due_heap = self.due_heap
+        while due_heap and self.is_outdated(due_heap[0]):
+            heapq.heappop(due_heap)
+        if not due_heap:
+            return None
+        return max(0, due_heap[0][0] - time.time())
@@ -0,0 +1,184 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import json
+import time
+import logging
+import threading
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from latency_stats import LatencyStats
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class StageTimer(object):
+
+    def __init__(self, metrics, key):
+        self.metrics = metrics
+        self.key = key
+        self.started = 0
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe_key(self.key, time.time() - self.started)
+        return False
+
+
+class NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class Metrics(object):
+    """
+    The counters and latency histograms of the bot pipeline, broken down by label (ex: command name, event type).
+    The key of metric is 'stage' or 'stage:label'.
+
+    It is process-wide, please use Metrics.get_instance(). It is disabled by default, and the timer is a shared
+    no-op object when disabled.
+
+    Stages:
+        - receive: reading the RTM frames.
+        - receive_to_dispatch: from the frames are read to the event is dispatched.
+        - handle_rtm: handling the event, by event type.
+        - resolve: finding user and channel of message.
+        - parse_message_text: tokenizing the message.
+        - command_match: matching the commands.
+        - command_run: running the command, by command name.
+        - send: Util.send().
+    """
+    NULL_TIMER = NullTimer()
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.latency = {}
+        self.started_at = time.time()
+        self.http_server = None
+
+    @staticmethod
+    def make_key(name, label=None):
+        return '{name}:{label}'.format(name=name, label=label) if label else name
+
+    def incr(self, name, label=None, value=1):
+        if not self.enabled:
+            return
+        key = self.make_key(name, label)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, stage, seconds, label=None):
+        if not self.enabled:
+            return
+        self.observe_key(self.make_key(stage, label), seconds)
+
+    def observe_key(self, key, seconds):
+        stats = self.latency.get(key)
+        if stats is None:
+            with self.lock:
+                stats = self.latency.get(key)
+                if stats is None:
+                    stats = self.latency[key] = LatencyStats(key)
+        stats.add(seconds)
+
+    def timer(self, stage, label=None):
+        """
+        Usage:
+            with Metrics.get_instance().timer('command_run', 'bot_cmd.greeting.Greeting'):
+                ...
+        :param stage:
+        :param label:
+        :return: a context manager which records the latency of stage.
+        """
+        if not self.enabled:
+            return self.NULL_TIMER
+        return StageTimer(self, self.make_key(stage, label))
+
+    def snapshot(self):
+        """
+        :return: a dict of uptime, counters, and latency summary (ms) of every stage.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            latency = dict(self.latency)
+        latency_summary = {}
+        for key, stats in latency.items():
+            summary = stats.summary()
+            for field in ('avg', 'p50', 'p99', 'max'):
+                summary[field] = round(summary[field] * 1000, 3)
+            latency_summary[key] = summary
+        return {
+            'uptime_sec': round(time.time() - self.started_at, 1),
+            'counters': counters,
+            'latency_ms': latency_summary
+        }
+
+    def format_dump(self):
+        with self.lock:
+            counters = dict(self.counters)
+            latency = dict(self.latency)
+        lines = ['{key}: {value}'.format(key=key, value=counters[key]) for key in sorted(counters)]
+        lines.extend(latency[key].format_summary() for key in sorted(latency))
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.latency = {}
+            self.started_at = time.time()
+
+    def start_http_server(self, port, host='127.0.0.1'):
+        """
+        Serving the snapshot as JSON at http://host:port/metrics
+        :param port:
+        :param host: only local by default.
+        :return:
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def log_message(self, fmt, *args):
+                logger.debug(fmt % args)
+
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = json.dumps(metrics.snapshot(), sort_keys=True).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.http_server = HTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=self.http_server.serve_forever, name='aqua-metrics')
+        thread.daemon = True
+        thread.start()
+        logger.info('Metrics endpoint: http://{host}:{port}/metrics'.format(host=host,
+                                                                           port=self.http_server.server_address[1]))
@@ -0,0 +1,176 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import select
+import logging
+
+from aqua_bot import AquaBot
+from command_dispatcher import CommandDispatcher
+from command_executor import CommandExecutor
+from rtm_receiver import RtmConnectionError
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class MultiTenantRunner(object):
+    """
+    Serving many workspaces in one process, by one thread.
+
+    Each workspace has its own Bot (SlackClient, directories and websocket), and the RTM websockets of all Bots are
+    multiplexed by one select() loop, instead of one process and one blocking loop per workspace.
+    The compiled command dispatcher, the resolved command classes and the command executor are shared by all Bots.
+
+    The blocking Web API calls (ex: connecting, and the commands when command-executor is 'sync') still block the
+    loop, please use 'thread' command executor and the outbound queue for busy workspaces.
+    """
+    WORKSPACES_FILE = 'workspaces.json'
+    # the max seconds of select(), so the reconnecting of Bots are checked in time
+    MAX_SELECT_TIMEOUT_SEC = 1
+
+    def __init__(self, configs, bot_class=AquaBot):
+        """
+        :param configs: a list of Bot config dict, one for each workspace.
+        :param bot_class: ex: AquaBot.
+        """
+        self.bot_class = bot_class
+        command_dispatcher = CommandDispatcher(bot_class.COMMANDS_HANDLERS)
+        command_classes = {}
+        command_executor = self.create_command_executor(configs)
+        self.bots = []
+        for config in configs:
+            # the multiplexing loop only supports the event receive mode, and the events are handled in process
+            config = dict(config, **{bot_class.KEY_RECEIVE_MODE: bot_class.RECEIVE_MODE_EVENT,
+                                     bot_class.KEY_PROCESS_SHARDS: 0})
+            self.bots.append(bot_class(config=config,
+                                       command_dispatcher=command_dispatcher,
+                                       command_classes=command_classes,
+                                       command_executor=command_executor))
+        # {Bot: the time to reconnect}
+        self.reconnect_at = dict((bot, 0) for bot in self.bots)
+
+    def create_command_executor(self, configs):
+        """
+        :return: one CommandExecutor for all workspaces which run the commands by worker threads, or None.
+        """
+        thread_configs = [config for config in configs
+                          if config.get(self.bot_class.KEY_COMMAND_EXECUTOR) == self.bot_class.COMMAND_EXECUTOR_THREAD]
+        if not thread_configs:
+            return None
+        return CommandExecutor(workers=max(config.get(self.bot_class.KEY_COMMAND_WORKERS) or 0
+                                           for config in thread_configs) or None,
+                               timeout=max(config.get(self.bot_class.KEY_COMMAND_TIMEOUT_SEC) or 0
+                                           for config in thread_configs) or None)
+
+    @classmethod
+    def load_configs(cls, file_path=None):
+        """
+        Loading the list of Bot config from workspaces.json.
+        :param file_path:
+        :return: a list of config dict.
+        """
+        file_path = file_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), cls.WORKSPACES_FILE)
+        with open(file_path, 'r') as f:
+            configs = json.load(f)
+        if not isinstance(configs, list):
+            raise Exception('{} should be a list of Bot config.'.format(file_path))
+        return configs
+
+    def connect_due_bots(self):
+        now = time.time()
+        for bot, reconnect_at in list(self.reconnect_at.items()):
+            if reconnect_at > now:
+                continue
+            try:
+                is_connected = bot.connect()
+            except Exception as e:
+                logger.exception('Starting {name} failed. {e}'.format(name=bot.bot_name, e=e))
+                is_connected = False
+            if is_connected:
+                del self.reconnect_at[bot]
+            else:
+                self.schedule_reconnect(bot)
+
+    def schedule_reconnect(self, bot):
+        """
+        Reconnecting the Bot after its backoff, or stopping it if it runs out of attempts.
+        The other workspaces keep running.
+        """
+        try:
+            self.reconnect_at[bot] = time.time() + bot.next_reconnect_delay()
+        except Exception as e:
+            logger.error('Stop {name}, {e}'.format(name=bot.bot_name, e=e))
+            self.reconnect_at.pop(bot, None)
+            self.bots.remove(bot)
+
+    def disconnect(self, bot, reason):
+        bot.disconnect(reason)
+        self.schedule_reconnect(bot)
+
+    def next_timeout(self, connected_bots):
+        timeouts = [self.MAX_SELECT_TIMEOUT_SEC]
+        timeouts.extend(bot.next_timeout() for bot in connected_bots)
+        if self.reconnect_at:
+            timeouts.append(max(0, min(self.reconnect_at.values()) - time.time()))
+        return min(timeouts)
+
+    def wait_readable(self, connected_bots):
+        """
+        :return: the Bots which have incoming data.
+        """
+        bots_by_socket = {}
+        ready_bots = []
+        for bot in connected_bots:
+            sock = bot.receiver.get_socket()
+            # the SSL layer may already hold decrypted data which select() can not see
+            pending = getattr(sock, 'pending', None)
+            if pending and pending() > 0:
+                ready_bots.append(bot)
+            else:
+                bots_by_socket[sock] = bot
+        timeout = 0 if ready_bots else self.next_timeout(connected_bots)
+        try:
+            readable, _, _ = select.select(list(bots_by_socket.keys()), [], [], timeout)
+        except (select.error, ValueError):
+            # one of sockets is broken, finding it by select() them one by one
+            readable = []
+            for sock, bot in bots_by_socket.items():
+                try:
+                    readable.extend(select.select([sock], [], [], 0)[0])
+                except (select.error, ValueError) as e:
+                    self.disconnect(bot, RtmConnectionError('Websocket is broken, {}'.format(e)))
+        ready_bots.extend(bots_by_socket[sock] for sock in readable)
+        return ready_bots
+
+    def run_once(self):
+        self.connect_due_bots()
+        connected_bots = [bot for bot in self.bots if bot.receiver is not None]
+        if not connected_bots:
+            time.sleep(self.next_timeout(connected_bots))
+            return
+        for bot in self.wait_readable(connected_bots):
+            if bot.receiver is None:
+                continue
+            try:
+                bot.receive_events()
+            except RtmConnectionError as e:
+                self.disconnect(bot, e)
+        for bot in connected_bots:
+            if bot.receiver is None:
+                continue
+            try:
+                bot.tick()
+            except RtmConnectionError as e:
+                self.disconnect(bot, e)
+
+    def run(self):
+        logger.info('### AQUA Start, {n} workspaces ###'.format(n=len(self.bots)))
+        while True:
+            self.run_once()
+
+
+if __name__ == "__main__":
+    runner = MultiTenantRunner(MultiTenantRunner.load_configs(sys.argv[1] if len(sys.argv) > 1 else None))
+    runner.run()
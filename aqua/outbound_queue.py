@@ -0,0 +1,228 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import time
+import logging
+import threading
+import weakref
+from collections import OrderedDict, deque
+
+from token_bucket import TokenBucket
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class OutboundQueue(object):
+    """
+    The asynchronous queue of outgoing chat.postMessage.
+
+    - The messages are sent by a background thread, so the callers do not block.
+    - Each channel has a token bucket, Slack allows about 1 message per second per channel.
+    - The pending messages of the same channel are coalesced into one message, up to COALESCE_MAX_CHARS.
+    - Retrying with exponential backoff, and honoring the Retry-After of rate limited (HTTP 429) response.
+      The api_call should return it as retry_after, ex: WebApiTransport.api_call(). slackclient api_call() drops
+      the response headers, then it waits DEFAULT_RETRY_AFTER_SEC.
+    - The state of idle channels is removed every PRUNE_INTERVAL_SEC.
+
+    Please register the queue of slack_client, then Util.send() will enqueue the messages.
+    """
+    DEFAULT_RATE_PER_SEC = 1.0
+    DEFAULT_BURST = 1
+    DEFAULT_MAX_RETRIES = 3
+    DEFAULT_BACKOFF_SEC = 1.0
+    DEFAULT_RETRY_AFTER_SEC = 1.0
+    COALESCE_MAX_CHARS = 3000
+    COALESCE_SEPARATOR = '\n'
+    ERROR_RATE_LIMITED = 'ratelimited'
+    PRUNE_INTERVAL_SEC = 60
+
+    _registry = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def register(cls, slack_client, outbound_queue):
+        cls._registry[slack_client] = outbound_queue
+
+    @classmethod
+    def unregister(cls, slack_client):
+        cls._registry.pop(slack_client, None)
+
+    @classmethod
+    def get(cls, slack_client):
+        """
+        :param slack_client:
+        :return: the registered OutboundQueue of slack_client, or None.
+        """
+        return cls._registry.get(slack_client)
+
+    def __init__(self, slack_client, api_call=None, rate_per_sec=None, burst=None, max_retries=None,
+                 backoff_sec=None):
+        """
+        :param slack_client:
+        :param api_call: the function to call Web API, default is slack_client.api_call. It should return the
+            retry_after of rate limited response, ex: WebApiTransport.api_call.
+        :param rate_per_sec: the messages per second of each channel.
+        :param burst: the messages can be sent at once of each channel.
+        :param max_retries:
+        :param backoff_sec: the first backoff, it is doubled for every retry.
+        """
+        self.slack_client = slack_client
+        self.api_call = api_call or slack_client.api_call
+        self.rate_per_sec = rate_per_sec or self.DEFAULT_RATE_PER_SEC
+        self.burst = burst or self.DEFAULT_BURST
+        self.max_retries = self.DEFAULT_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_sec = backoff_sec or self.DEFAULT_BACKOFF_SEC
+
+        self.condition = threading.Condition()
+        # {channel id: deque of messages}, the order of channels is round robin
+        self.pending = OrderedDict()
+        # the per-channel state, ref: prune_idle_channels()
+        self.buckets = {}
+        self.retries = {}
+        self.not_before = {}
+        self.pruned_at = time.time()
+        # the whole method is blocked by rate limited response
+        self.blocked_until = 0
+        self.sent_count = 0
+        self.dropped_count = 0
+        self.is_shutdown = False
+
+        self.thread = threading.Thread(target=self.sender_loop, name='aqua-outbound')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def pending_count(self):
+        with self.condition:
+            return sum(len(messages) for messages in self.pending.values())
+
+    def enqueue(self, channel_id, send_message):
+        """
+        Queueing the message, it returns immediately.
+        :param channel_id:
+        :param send_message:
+        :return: True
+        """
+        with self.condition:
+            self.pending.setdefault(channel_id, deque()).append(send_message)
+            self.condition.notify()
+        return True
+
+    def next_ready_channel(self):
+        """
+        :return: (channel id, None) if there is a channel can send now, or (None, seconds to wait).
+        """
+        now = time.time()
+        if now < self.blocked_until:
+            return None, self.blocked_until - now
+        min_wait = None
+        for channel_id in self.pending:
+            wait = max(0, self.not_before.get(channel_id, 0) - now)
+            if not wait:
+                bucket = self.buckets.get(channel_id)
+                if bucket is None:
+                    bucket = self.buckets[channel_id] = TokenBucket(self.rate_per_sec, self.burst)
+                wait = bucket.wait_time()
+            if not wait:
+                return channel_id, None
+            min_wait = wait if min_wait is None else min(min_wait, wait)
+        return None, min_wait
+
+    def pop_batch(self, channel_id):
+        """
+        Popping and coalescing the pending messages of channel.
+        :param channel_id:
+        :return: the message to send.
+        """
+        messages = self.pending.pop(channel_id)
+        batch = [messages.popleft()]
+        batch_len = len(batch[0])
+        while messages and batch_len + len(self.COALESCE_SEPARATOR) + len(messages[0]) <= self.COALESCE_MAX_CHARS:
+            batch_len += len(self.COALESCE_SEPARATOR) + len(messages[0])
+            batch.append(messages.popleft())
+        if messages:
+            # moving the channel to the end, for round robin
+            self.pending[channel_id] = messages
+        self.buckets[channel_id].consume()
+        return self.COALESCE_SEPARATOR.join(batch)
+
+    def prune_idle_channels(self):
+        """
+        Removing the state of channels which have no pending message, no backoff, and a full token bucket,
+        so the state does not grow with every channel the Bot has ever replied to.
+        It is called with self.condition held.
+        """
+        now = time.time()
+        for channel_id, bucket in list(self.buckets.items()):
+            if channel_id not in self.pending and self.not_before.get(channel_id, 0) <= now and bucket.is_full():
+                del self.buckets[channel_id]
+        for channel_id, not_before in list(self.not_before.items()):
+            if channel_id not in self.pending and not_before <= now:
+                del self.not_before[channel_id]
+        for channel_id in list(self.retries.keys()):
+            if channel_id not in self.pending:
+                del self.retries[channel_id]
+        self.pruned_at = now
+
+    def sender_loop(self):
+        while True:
+            with self.condition:
+                if self.is_shutdown and not self.pending:
+                    return
+                if time.time() - self.pruned_at >= self.PRUNE_INTERVAL_SEC:
+                    self.prune_idle_channels()
+                channel_id, wait = self.next_ready_channel()
+                if channel_id is None:
+                    self.condition.wait(wait)
+                    continue
+                send_message = self.pop_batch(channel_id)
+            self.post(channel_id, send_message)
+
+    def post(self, channel_id, send_message):
+        try:
+            ret = self.api_call('chat.postMessage', channel=channel_id, text=send_message, as_user=True)
+        except Exception as e:
+            ret = {'ok': False, 'error': str(e)}
+
+        with self.condition:
+            if ret.get('ok'):
+                self.retries.pop(channel_id, None)
+                self.not_before.pop(channel_id, None)
+                self.sent_count += 1
+                return
+
+            retries = self.retries.get(channel_id, 0) + 1
+            if retries > self.max_retries:
+                logger.error('Sending message failed after {n} retries, dropped!\n{ret}'.format(n=self.max_retries,
+                                                                                                 ret=ret))
+                self.retries.pop(channel_id, None)
+                self.not_before.pop(channel_id, None)
+                self.dropped_count += 1
+                return
+
+            self.retries[channel_id] = retries
+            if ret.get('error') == self.ERROR_RATE_LIMITED:
+                retry_after = float(ret.get('retry_after') or self.DEFAULT_RETRY_AFTER_SEC)
+                self.blocked_until = time.time() + retry_after
+                logger.warning('Rate limited, retry after {sec}s.'.format(sec=retry_after))
+            else:
+                backoff = self.backoff_sec * (2 ** (retries - 1))
+                self.not_before[channel_id] = time.time() + backoff
+                logger.warning('Sending message failed, retry after {sec}s.\n{ret}'.format(sec=backoff, ret=ret))
+            # putting it back to the head of channel
+            messages = self.pending.get(channel_id)
+            if messages is None:
+                messages = self.pending[channel_id] = deque()
+            messages.appendleft(send_message)
+            self.condition.notify()
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stopping the sender after the pending messages are sent.
+        :param wait: waiting for the sender thread.
+        :param timeout: seconds.
+        :return:
+        """
+        with self.condition:
+            self.is_shutdown = True
+            self.condition.notify()
+        if wait:
+            self.thread.join(timeout)
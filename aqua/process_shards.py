@@ -0,0 +1,247 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+from slackclient import SlackClient
+
+from web_api_transport import WebApiTransport
+from log_util import LogUtil
+from util import Util
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class ShardSlackClient(object):
+    """
+    The slack_client of shard worker process.
+    The replies (chat.postMessage) are put into the reply queue and sent by the connection process,
+    the other Web API calls are made by the worker itself.
+    """
+    REPLY_METHODS = ('chat.postMessage',)
+
+    def __init__(self, token, reply_queue, web_api_transport=None):
+        self.slack_client = SlackClient(token)
+        # the worker never connects to RTM, the server only keeps the empty state for Util.find_* fallback
+        self.server = self.slack_client.server
+        self.reply_queue = reply_queue
+        self.web_api_transport = web_api_transport
+
+    def api_call(self, method, **kwargs):
+        if method in self.REPLY_METHODS:
+            self.reply_queue.put((method, kwargs))
+            return {'ok': True}
+        if self.web_api_transport is not None:
+            return self.web_api_transport.api_call(method, **kwargs)
+        return self.slack_client.api_call(method, **kwargs)
+
+
+def run_shard_worker(bot_class, index, config, event_queue, reply_queue):
+    """
+    The main function of shard worker process.
+    The worker creates its own Bot, loads the directories from the workspace snapshot (or by Web API if the
+    snapshot can not be loaded), then handles the queued events one by one, so the events of the same channel are
+    handled in order.
+    The snapshot is reloaded in background after the connection process has reconciled the directories, and the
+    directory events since the snapshot started are replayed onto it.
+    """
+    # the connection process handles Ctrl+C and stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    LogUtil.restart_after_fork()
+    transport = None
+    if config.get(bot_class.KEY_WEB_API_TRANSPORT):
+        transport = WebApiTransport(config.get(bot_class.KEY_API_TOKEN),
+                                    base_url=config.get(bot_class.KEY_WEB_API_BASE_URL),
+                                    pool_size=config.get(bot_class.KEY_WEB_API_POOL_SIZE),
+                                    timeout=config.get(bot_class.KEY_WEB_API_TIMEOUT_SEC))
+    # the replies are sent by the connection process, and only the connection process serves the metrics
+    worker_config = dict(config)
+    worker_config.update({
+        bot_class.KEY_WEB_API_TRANSPORT: False,
+        bot_class.KEY_OUTBOUND_QUEUE: False,
+        bot_class.KEY_METRICS_PORT: 0,
+        bot_class.KEY_PROCESS_SHARDS: 0,
+        # the messages are de-duplicated, debounced and admitted by the connection process
+        bot_class.KEY_MESSAGE_DEDUP_SIZE: 0,
+        bot_class.KEY_EDIT_DEBOUNCE_SEC: 0,
+        bot_class.KEY_ADMISSION_USER_RATE_PER_SEC: 0,
+        bot_class.KEY_ADMISSION_CHANNEL_RATE_PER_SEC: 0,
+        bot_class.KEY_ADMISSION_MAX_QUEUE_DEPTH: 0,
+    })
+    slack_client = ShardSlackClient(config.get(bot_class.KEY_API_TOKEN), reply_queue, web_api_transport=transport)
+    bot = bot_class(config=worker_config, slack_client=slack_client)
+    load_worker_directories(bot, index)
+    logger.info('Shard {idx} started, pid {pid}.'.format(idx=index, pid=os.getpid()))
+
+    generation = None
+    while True:
+        item = event_queue.get()
+        if item is None:
+            break
+        if item == ProcessShards.SNAPSHOT_STARTED:
+            generation = bot.begin_directory_reload()
+            continue
+        if item == ProcessShards.SNAPSHOT_ABORTED:
+            if generation is not None:
+                bot.end_directory_reload(generation)
+                generation = None
+            continue
+        if item == ProcessShards.RELOAD_SNAPSHOT:
+            bot.start_snapshot_reload(generation)
+            generation = None
+            continue
+        try:
+            bot.handle_rtm(item)
+        except Exception as e:
+            logger.exception('Shard {idx} failed to handle event. {e}'.format(idx=index, e=e))
+        # the worker has no RTM loop, applying the toggle of command profiler after each event
+        bot.command_profiler.poll()
+
+
+def load_worker_directories(bot, index):
+    """
+    Loading the directories and Bot id of shard worker from the workspace snapshot, falling back to the Web API if
+    the snapshot is missing or broken. It retries with the reconnect backoff instead of exiting, otherwise the
+    restarted worker fails again and again.
+    The worker never saves the snapshot, which is owned by the connection process.
+    """
+    while True:
+        try:
+            if bot.load_snapshot():
+                return
+            logger.warning('Shard {idx} can not load the workspace snapshot, loading by Web API.'.format(idx=index))
+            bot.load_directories()
+            bot.set_bot_id(Util.find_user(bot.slack_client, bot.bot_name, bot.users_directory).id)
+            bot.reconnect_backoff.reset()
+            return
+        except Exception as e:
+            delay = bot.reconnect_backoff.next_delay()
+            logger.error('Shard {idx} can not load the directories, {e}, retry after {sec:.1f}s.'.format(
+                idx=index, e=e, sec=delay))
+            time.sleep(delay)
+
+
+class ProcessShards(object):
+    """
+    The worker processes of event handling, so the CPU-heavy commands are not capped by one core (GIL).
+
+    The connection process reads RTM events, and:
+        - the message events are sharded by channel id, the events of same channel are handled by the same worker
+          in order.
+        - the other events (ex: user_change) are broadcast to all workers, to keep their directories up to date.
+    The workers load the directories from the workspace snapshot which is written by the connection process,
+    and send the replies back by the reply queue, which are sent by a thread of connection process.
+    """
+    DEFAULT_QUEUE_SIZE = 1000
+    # the workers record the directory events after the snapshot is started, and replay them after reloading it
+    SNAPSHOT_STARTED = 'snapshot-started'
+    SNAPSHOT_ABORTED = 'snapshot-aborted'
+    RELOAD_SNAPSHOT = 'reload-snapshot'
+
+    def __init__(self, bot_class, config, workers, reply_handler, queue_size=None):
+        """
+        :param bot_class: the Bot class which is created by workers, ex: AquaBot.
+        :param config: the config dict of Bot.
+        :param workers: the number of worker processes.
+        :param reply_handler: the callable(method, kwargs) which sends the reply in connection process.
+        :param queue_size: the max queued events of each worker.
+        """
+        self.bot_class = bot_class
+        self.config = config
+        self.workers = workers
+        self.reply_handler = reply_handler
+        self.queues = [multiprocessing.Queue(queue_size or self.DEFAULT_QUEUE_SIZE) for _ in range(workers)]
+        self.reply_queue = multiprocessing.Queue()
+        self.processes = [None] * workers
+        self.reply_thread = None
+        self.dropped_count = 0
+
+    def start(self):
+        for index in range(self.workers):
+            self.start_worker(index)
+        self.reply_thread = threading.Thread(target=self.reply_loop, name='aqua-shard-reply')
+        self.reply_thread.daemon = True
+        self.reply_thread.start()
+        logger.info('Started {n} shard workers.'.format(n=self.workers))
+        return self
+
+    def start_worker(self, index):
+        process = multiprocessing.Process(target=run_shard_worker,
+                                          name='aqua-shard-{}'.format(index),
+                                          args=(self.bot_class, index, self.config, self.queues[index],
+                                                self.reply_queue))
+        process.daemon = True
+        process.start()
+        self.processes[index] = process
+
+    def check_workers(self):
+        """
+        Restarting the dead workers, the queued events of dead worker are kept.
+        """
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                logger.warning('Shard {idx} exited with {code}, restarting.'.format(idx=index, code=process.exitcode))
+                self.start_worker(index)
+
+    def put(self, index, item):
+        try:
+            self.queues[index].put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped_count += 1
+            logger.warning('Queue of shard {idx} is full, dropping event.'.format(idx=index))
+            return False
+
+    def dispatch(self, channel_id, rtm_result):
+        """
+        :param channel_id: the events of same channel are handled by the same worker.
+        :param rtm_result: the RTM event.
+        :return: True if the event is queued.
+        """
+        return self.put(hash(channel_id) % self.workers, rtm_result)
+
+    def pending_count(self):
+        """
+        :return: the number of events queued to workers, 0 if the platform can not tell (ex: macOS).
+        """
+        try:
+            return sum(q.qsize() for q in self.queues)
+        except NotImplementedError:
+            return 0
+
+    def broadcast(self, item):
+        for index in range(self.workers):
+            self.put(index, item)
+
+    def reply_loop(self):
+        while True:
+            item = self.reply_queue.get()
+            if item is None:
+                break
+            method, kwargs = item
+            try:
+                self.reply_handler(method, kwargs)
+            except Exception as e:
+                logger.exception('Sending reply of shard failed. {e}'.format(e=e))
+
+    def shutdown(self, wait=True):
+        """
+        Stopping the workers after the queued events are handled.
+        :param wait: waiting for the workers.
+        :return:
+        """
+        for q in self.queues:
+            q.put(None)
+        if wait:
+            for process in self.processes:
+                if process is not None:
+                    process.join()
+        self.reply_queue.put(None)
@@ -0,0 +1,176 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import re
+import json
+import time
+import errno
+import select
+import socket
+import logging
+from websocket import WebSocketException
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class RtmConnectionError(Exception):
+    """
+    The RTM websocket is closed, broken, or stale (no pong).
+    """
+    pass
+
+
+class RtmReceiver(object):
+    """
+    Event-driven reader of the RTM websocket.
+
+    slackclient sets the websocket to non-blocking and rtm_read() returns at most one frame per call,
+    so the receiver blocks on the socket by select() and reads the arrived frames once it wakes up, at most
+    max_frames of them per wakeup. The rest stay in the socket, which is still readable on the next select().
+
+    It also tracks the liveness of connection. If nothing is received for ping_interval seconds, it sends a ping,
+    and the connection is stale if nothing is received in ping_timeout seconds after the ping.
+    Ref: https://api.slack.com/rtm#ping_and_pong
+
+    If the handled event types are given, the frames of other types (ex: user_typing, presence_change) are dropped
+    before JSON decoding. The frame is only dropped when none of "type" values in it is handled, so the nested
+    "type" (ex: the message of message_changed) never causes a handled event to be dropped.
+    """
+    TYPE_PATTERN = re.compile(r'"type"\s*:\s*"([^"]+)"')
+    # the events which update the state of slackclient by process_changes()
+    STATE_EVENT_TYPES = frozenset(['channel_created', 'group_joined', 'im_created', 'team_join'])
+    DEFAULT_MAX_FRAMES = 100
+
+    def __init__(self, slack_client, ping_interval=None, ping_timeout=None, event_types=None, metrics=None,
+                 max_frames=None):
+        """
+        :param slack_client:
+        :param ping_interval: seconds, None or 0 to disable ping.
+        :param ping_timeout: seconds.
+        :param event_types: the handled event types, None to decode all frames.
+        :param metrics: the Metrics object to count the dropped events.
+        :param max_frames: the max frames of each read_events().
+        """
+        self.slack_client = slack_client
+        self.max_frames = max_frames or self.DEFAULT_MAX_FRAMES
+        self.kept_types = frozenset(event_types) | self.STATE_EVENT_TYPES if event_types is not None else None
+        self.metrics = metrics
+        # {event type: count}
+        self.dropped_counts = {}
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout or ping_interval
+        self.last_received_at = time.time()
+        self.ping_sent_at = None
+        self.ping_id = 0
+
+    def get_socket(self):
+        websocket = self.slack_client.server.websocket
+        return websocket.sock if websocket else None
+
+    def wait_readable(self, timeout):
+        """
+        Blocking until there is incoming data on websocket, or timeout.
+        :param timeout: seconds.
+        :return: True if there is data to read.
+        """
+        sock = self.get_socket()
+        if sock is None:
+            return False
+        # the SSL layer may already hold decrypted data which select() can not see
+        pending = getattr(sock, 'pending', None)
+        if pending and pending() > 0:
+            return True
+        try:
+            readable, _, _ = select.select([sock], [], [], timeout)
+        except (select.error, ValueError) as e:
+            # interrupted by a signal (ex: SIGUSR1 of command profiler) on Python 2, it is not an error of socket
+            if isinstance(e, select.error) and e.args and e.args[0] == errno.EINTR:
+                return False
+            raise RtmConnectionError('Websocket is broken, {}'.format(e))
+        return bool(readable)
+
+    def read_frame(self):
+        """
+        Reading one frame, same as slack_client.rtm_read() but dropping the unhandled events before decoding.
+        The time of frame be read is kept in last_received_at.
+        :return: a list of RTM events, it is empty if all events are dropped, or None if there is no data.
+        """
+        try:
+            raw_data = self.slack_client.server.websocket_safe_read()
+        except socket.error as e:
+            # slackclient only handles the SSL error, the plain (ws://) socket raises EAGAIN if there is no data
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return None
+            raise RtmConnectionError('Websocket is broken, {}'.format(e))
+        except WebSocketException as e:
+            raise RtmConnectionError('Websocket is closed, {}'.format(e))
+        if not raw_data:
+            return None
+        self.last_received_at = time.time()
+        rtm_ret_list = []
+        for line in raw_data.split('\n'):
+            if self.kept_types is not None:
+                event_types = self.TYPE_PATTERN.findall(line)
+                if event_types and self.kept_types.isdisjoint(event_types):
+                    self.drop(event_types[0])
+                    continue
+            rtm_ret = json.loads(line)
+            self.slack_client.process_changes(rtm_ret)
+            rtm_ret_list.append(rtm_ret)
+        return rtm_ret_list
+
+    def drop(self, event_type):
+        self.dropped_counts[event_type] = self.dropped_counts.get(event_type, 0) + 1
+        if self.metrics is not None:
+            self.metrics.incr('dropped_events', event_type)
+
+    def read_events(self):
+        """
+        Reading the arrived frames one by one, at most max_frames, so one busy connection can not starve the others
+        (ex: MultiTenantRunner) or delay the tick of Bot.
+        :return: a generator of (received time, RTM events) of each frame. The next frame is read after the caller
+            has dispatched the current one, so the events are not buffered while the others are handled.
+        """
+        for _ in range(self.max_frames):
+            rtm_ret_list = self.read_frame()
+            if rtm_ret_list is None:
+                return
+            if rtm_ret_list:
+                yield self.last_received_at, rtm_ret_list
+
+    def ping(self):
+        websocket = self.slack_client.server.websocket
+        if websocket is None:
+            return
+        self.ping_id += 1
+        try:
+            # not by server.ping(), it reconnects by rtm.start on failure, which is handled by the Bot instead
+            websocket.send(json.dumps({'id': self.ping_id, 'type': 'ping'}))
+        except (socket.error, WebSocketException) as e:
+            raise RtmConnectionError('Can not send ping, {}'.format(e))
+        self.ping_sent_at = time.time()
+
+    def check_alive(self):
+        """
+        Sending ping if the connection is idle, and raising RtmConnectionError if there is no reply of ping.
+        """
+        if not self.ping_interval:
+            return
+        now = time.time()
+        if self.ping_sent_at is not None:
+            if self.last_received_at >= self.ping_sent_at:
+                self.ping_sent_at = None
+            elif now - self.ping_sent_at >= self.ping_timeout:
+                raise RtmConnectionError('Websocket is stale, no reply in {} sec.'.format(self.ping_timeout))
+        if self.ping_sent_at is None and now - self.last_received_at >= self.ping_interval:
+            self.ping()
+
+    def next_check_timeout(self):
+        """
+        :return: the seconds before the next check_alive() should be called, or None if ping is disabled.
+        """
+        if not self.ping_interval:
+            return None
+        if self.ping_sent_at is not None:
+            return max(0, self.ping_sent_at + self.ping_timeout - time.time())
+        return max(0, self.last_received_at + self.ping_interval - time.time())
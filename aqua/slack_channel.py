@@ -1,9 +1,9 @@
 # -*- encoding: utf-8 -*-
 
-from dict2obj import Dict2Obj
+from slack_record import SlackRecord
 
 
-class SlackChannel(Dict2Obj):
+class SlackChannel(SlackRecord):
     """
     A channel object contains information about a team channel.
 
@@ -39,9 +39,13 @@ class SlackChannel(Dict2Obj):
         "unread_count": 0,
         "unread_count_display": 0
     }
+    Only the HOT_FIELDS are kept as attributes, the other fields are decoded on demand.
     Ref:
         https://api.slack.com/types/channel
         https://api.slack.com/methods/channels.list
     """
+    HOT_FIELDS = ('id', 'name', 'members', 'is_archived')
+    __slots__ = HOT_FIELDS
+
     def __init__(self, dict_obj):
         super(SlackChannel, self).__init__(dict_obj)
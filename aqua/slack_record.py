@@ -0,0 +1,68 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import zlib
+
+from dict2obj import Dict2Obj
+
+
+class SlackRecord(object):
+    """
+    The compact record of Slack API payload.
+
+    Only the HOT_FIELDS are kept as slots. The rest of payload is kept as a zlib compressed JSON string,
+    and it is decoded on demand when the attribute is accessed, ex: user_obj.profile.email
+    The subclass should declare HOT_FIELDS, and the same names in __slots__.
+    """
+    __slots__ = ('_extra',)
+    HOT_FIELDS = ()
+    # the fastest level, the payload is compressed once but may be created for thousands of users
+    EXTRA_COMPRESS_LEVEL = 1
+
+    def __init__(self, dict_obj):
+        extra = {}
+        for key, value in dict_obj.items():
+            if key in self.HOT_FIELDS:
+                setattr(self, key, value)
+            else:
+                extra[key] = value
+        for key in self.HOT_FIELDS:
+            if key not in dict_obj:
+                setattr(self, key, None)
+        if extra:
+            extra_json = json.dumps(extra, separators=(',', ':'))
+            self._extra = zlib.compress(extra_json.encode('utf-8'), self.EXTRA_COMPRESS_LEVEL)
+        else:
+            self._extra = None
+
+    def __getattr__(self, name):
+        # only be called when the attribute is not a slot
+        if name.startswith('_'):
+            raise AttributeError(name)
+        extra = self.get_extra()
+        if name not in extra:
+            raise AttributeError(name)
+        value = extra[name]
+        if isinstance(value, dict):
+            return Dict2Obj(value)
+        elif isinstance(value, list):
+            return [Dict2Obj(item) if isinstance(item, dict) else item for item in value]
+        return value
+
+    def __reduce__(self):
+        return self.__class__, (self.to_dict(),)
+
+    def get_extra(self):
+        """
+        :return: a dict of the payload which is not in HOT_FIELDS.
+        """
+        return json.loads(zlib.decompress(self._extra).decode('utf-8')) if self._extra else {}
+
+    def to_dict(self):
+        """
+        :return: a dict of the whole payload.
+        """
+        dict_obj = self.get_extra()
+        for key in self.HOT_FIELDS:
+            dict_obj[key] = getattr(self, key)
+        return dict_obj
@@ -1,9 +1,9 @@
 # -*- encoding: utf-8 -*-
 
-from dict2obj import Dict2Obj
+from slack_record import SlackRecord
 
 
-class SlackUser(Dict2Obj):
+class SlackUser(SlackRecord):
     """
     A user object contains information about a team member.
 
@@ -38,9 +38,13 @@ class SlackUser(Dict2Obj):
         "has_2fa": false,
         "two_factor_type": "sms"
     }
+    Only the HOT_FIELDS are kept as attributes, the other fields are decoded on demand.
     Ref:
         https://api.slack.com/types/user
         https://api.slack.com/methods/users.list
     """
+    HOT_FIELDS = ('id', 'name', 'real_name', 'tz', 'is_bot', 'deleted')
+    __slots__ = HOT_FIELDS
+
     def __init__(self, dict_obj):
         super(SlackUser, self).__init__(dict_obj)
@@ -0,0 +1,14 @@
+# -*- encoding: utf-8 -*-
+"""
+The unit tests.
+
+Usage (under aqua folder):
+    python -m unittest discover -s tests -t .
+"""
+import os
+import sys
+
+# the modules of aqua are imported by top-level names, ex: `from util import Util`
+AQUA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if AQUA_DIR not in sys.path:
+    sys.path.insert(0, AQUA_DIR)
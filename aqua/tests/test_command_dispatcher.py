@@ -0,0 +1,87 @@
+# -*- encoding: utf-8 -*-
+
+import unittest
+from collections import OrderedDict
+
+from command_dispatcher import CommandDispatcher
+
+
+class CommandDispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        # the handlers have different numbers of groups, so the group offsets of later handlers are shifted
+        self.help_handler = {'name': 'help'}
+        self.add_handler = {'name': 'add'}
+        self.echo_handler = {'name': 'echo'}
+        self.commands_handlers = OrderedDict([
+            (r'(^|.*\s+)(help)(\s+|$)', self.help_handler),
+            (r'add\s+(\d+)\s+(\d+)', self.add_handler),
+            (r'echo\s+(?P<text>.+)', self.echo_handler),
+        ])
+        self.dispatcher = CommandDispatcher(self.commands_handlers)
+
+    def test_combined(self):
+        self.assertIsNotNone(self.dispatcher.combined_re)
+        self.assertEqual({
+            '_aqua_cmd_0': (0, 1),
+            '_aqua_cmd_1': (1, 5),
+            '_aqua_cmd_2': (2, 8),
+        }, self.dispatcher.combined_groups)
+
+    def test_match_maps_lastgroup_to_handler_and_groups(self):
+        self.assertEqual((self.help_handler, ('please ', 'help', '')), self.dispatcher.match('please help'))
+        self.assertEqual((self.add_handler, ('1', '2')), self.dispatcher.match('add 1 2'))
+        self.assertEqual((self.echo_handler, ('hello world',)), self.dispatcher.match('echo hello world'))
+
+    def test_match_first_handler_in_order(self):
+        # both 'help' and 'echo' patterns match, the first handler wins
+        self.assertEqual((self.help_handler, ('', 'help', ' ')), self.dispatcher.match('help echo me'))
+
+    def test_no_match(self):
+        self.assertEqual((None, None), self.dispatcher.match('add one two'))
+
+    def test_same_as_sequential_matching(self):
+        sequential = CommandDispatcher(self.commands_handlers)
+        sequential.combined_re, sequential.combined_groups = None, None
+        for message in ['help', 'add 3 4', 'echo x', 'add 3 4 help', 'nothing', 'echo help']:
+            self.assertEqual(sequential.match(message), self.dispatcher.match(message))
+
+    def test_back_reference_uses_sequential_matching(self):
+        back_reference_handler = {'name': 'twice'}
+        dispatcher = CommandDispatcher(OrderedDict([
+            (r'add\s+(\d+)\s+(\d+)', self.add_handler),
+            (r'(\w+) \1', back_reference_handler),
+        ]))
+        self.assertIsNone(dispatcher.combined_re)
+        self.assertEqual((back_reference_handler, ('bye',)), dispatcher.match('bye bye'))
+        self.assertEqual((self.add_handler, ('5', '6')), dispatcher.match('add 5 6'))
+
+    def test_conflicting_group_names_use_sequential_matching(self):
+        other_echo_handler = {'name': 'say'}
+        dispatcher = CommandDispatcher(OrderedDict([
+            (r'echo\s+(?P<text>.+)', self.echo_handler),
+            (r'say\s+(?P<text>.+)', other_echo_handler),
+        ]))
+        self.assertIsNone(dispatcher.combined_re)
+        self.assertEqual((other_echo_handler, ('hi',)), dispatcher.match('say hi'))
+
+    def test_keywords_prefilter(self):
+        dispatcher = CommandDispatcher(OrderedDict([
+            (r'add\s+(\d+)\s+(\d+)', dict(self.add_handler, keywords=['add'])),
+            (r'echo\s+(?P<text>.+)', dict(self.echo_handler, keywords=['echo'])),
+        ]))
+        self.assertIsNotNone(dispatcher.keywords_re)
+        self.assertEqual((None, None), dispatcher.match('hello world'))
+        self.assertEqual('echo', dispatcher.match('echo hi')[0]['name'])
+
+    def test_keywords_prefilter_disabled_without_keywords(self):
+        dispatcher = CommandDispatcher(OrderedDict([
+            (r'add\s+(\d+)\s+(\d+)', dict(self.add_handler, keywords=['add'])),
+            (r'echo\s+(?P<text>.+)', self.echo_handler),
+        ]))
+        self.assertIsNone(dispatcher.keywords_re)
+        self.assertEqual(self.echo_handler, dispatcher.match('echo hi')[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# -*- encoding: utf-8 -*-
+
+import unittest
+
+import message_dedup
+from message_dedup import MessageDedup, EditDebouncer
+
+
+class FakeTime(object):
+    """
+    The clock of message_dedup module, which only moves by the tests.
+    """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeTimeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeTime()
+        self.real_time = message_dedup.time
+        message_dedup.time = self.clock
+
+    def tearDown(self):
+        message_dedup.time = self.real_time
+
+
+class MessageDedupTest(FakeTimeTestCase):
+
+    def test_duplicate(self):
+        dedup = MessageDedup()
+        self.assertFalse(dedup.is_duplicate(('C1', '1.0')))
+        self.assertTrue(dedup.is_duplicate(('C1', '1.0')))
+        self.assertFalse(dedup.is_duplicate(('C2', '1.0')))
+        self.assertEqual(2, len(dedup))
+
+    def test_size_eviction(self):
+        dedup = MessageDedup(max_size=3)
+        for ts in ['1', '2', '3', '4']:
+            self.assertFalse(dedup.is_duplicate(('C1', ts)))
+        self.assertEqual(3, len(dedup))
+        # the oldest key is evicted
+        self.assertTrue(dedup.is_duplicate(('C1', '4')))
+        self.assertFalse(dedup.is_duplicate(('C1', '1')))
+
+    def test_ttl_eviction(self):
+        dedup = MessageDedup(ttl_sec=10)
+        dedup.is_duplicate(('C1', '1'))
+        self.clock.now += 5
+        dedup.is_duplicate(('C1', '2'))
+        self.clock.now += 4.9
+        self.assertTrue(dedup.is_duplicate(('C1', '1')))
+        self.clock.now += 0.1
+        # '1' has been seen for 10 seconds, '2' for 5 seconds
+        self.assertFalse(dedup.is_duplicate(('C1', '1')))
+        self.assertTrue(dedup.is_duplicate(('C1', '2')))
+        self.assertEqual(2, len(dedup))
+
+
+class EditDebouncerTest(FakeTimeTestCase):
+
+    def test_pop_due_after_delay(self):
+        debouncer = EditDebouncer(delay_sec=1)
+        debouncer.add('k1', 'e1')
+        self.clock.now += 0.5
+        self.assertEqual([], debouncer.pop_due())
+        self.assertEqual(0.5, debouncer.next_due_timeout())
+        self.clock.now += 0.5
+        self.assertEqual(['e1'], debouncer.pop_due())
+        self.assertEqual(0, len(debouncer))
+        self.assertIsNone(debouncer.next_due_timeout())
+
+    def test_newer_edit_replaces_pending(self):
+        debouncer = EditDebouncer(delay_sec=1)
+        debouncer.add('k1', 'e1')
+        self.clock.now += 0.8
+        debouncer.add('k1', 'e2')
+        self.clock.now += 0.2
+        # the outdated heap entry of e1 is due, but skipped
+        self.assertEqual([], debouncer.pop_due())
+        self.assertAlmostEqual(0.8, debouncer.next_due_timeout())
+        self.clock.now += 0.8
+        self.assertEqual(['e2'], debouncer.pop_due())
+        self.assertEqual(1, debouncer.superseded_count)
+        self.assertEqual([], debouncer.due_heap)
+
+    def test_max_delay(self):
+        debouncer = EditDebouncer(delay_sec=1, max_delay_sec=3)
+        for event in ['e1', 'e2', 'e3', 'e4']:
+            debouncer.add('k1', event)
+            self.assertEqual([], debouncer.pop_due())
+            self.clock.now += 0.9
+        # the message keeps changing, but it has been pending for max_delay_sec
+        self.clock.now = 1003.0
+        self.assertEqual(['e4'], debouncer.pop_due())
+
+    def test_pop_due_in_order_of_due_time(self):
+        debouncer = EditDebouncer(delay_sec=1)
+        debouncer.add('k1', 'e1')
+        self.clock.now = 1000.1
+        debouncer.add('k2', 'e2')
+        self.clock.now = 1000.2
+        debouncer.add('k3', 'e3')
+        self.clock.now = 1000.3
+        debouncer.add('k1', 'e1-2')
+        self.clock.now = 1001.25
+        self.assertEqual(['e2', 'e3'], debouncer.pop_due())
+        self.assertEqual(['e1-2'], debouncer.pop_due(force=True))
+
+    def test_force(self):
+        debouncer = EditDebouncer(delay_sec=1)
+        debouncer.add('k1', 'e1')
+        debouncer.add('k2', 'e2')
+        self.assertEqual(['e1', 'e2'], debouncer.pop_due(force=True))
+        self.assertEqual(0, len(debouncer))
+
+    def test_max_pending(self):
+        debouncer = EditDebouncer(delay_sec=1, max_pending=2)
+        debouncer.add('k1', 'e1')
+        self.clock.now += 0.1
+        debouncer.add('k2', 'e2')
+        debouncer.add('k1', 'e1-2')
+        self.assertEqual([], debouncer.pop_due())
+        self.clock.now += 0.1
+        debouncer.add('k3', 'e3')
+        # the edit which is due first is popped, the outdated entry of k1 does not count
+        self.assertEqual(['e2'], debouncer.pop_due())
+        self.assertEqual(2, len(debouncer))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+# -*- encoding: utf-8 -*-
+
+import time
+import unittest
+
+from outbound_queue import OutboundQueue
+from token_bucket import TokenBucket
+
+
+class FakeApi(object):
+
+    def __init__(self):
+        self.responses = []
+        self.calls = []
+
+    def api_call(self, method, **kwargs):
+        self.calls.append((method, kwargs))
+        if self.responses:
+            return self.responses.pop(0)
+        return {'ok': True}
+
+
+class OutboundQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = FakeApi()
+        self.queue = OutboundQueue(self.api, rate_per_sec=1, burst=1, max_retries=2, backoff_sec=10)
+        # stopping the sender thread, the tests call the steps of sender_loop() directly
+        self.queue.shutdown(wait=True)
+        self.queue.is_shutdown = False
+
+    def send_next(self):
+        channel_id, wait = self.queue.next_ready_channel()
+        self.assertIsNotNone(channel_id, 'no ready channel, wait {}'.format(wait))
+        send_message = self.queue.pop_batch(channel_id)
+        self.queue.post(channel_id, send_message)
+        return channel_id, send_message
+
+    def test_coalescing(self):
+        for message in ['a', 'b', 'c']:
+            self.queue.enqueue('C1', message)
+        self.assertEqual(3, self.queue.pending_count())
+        self.assertEqual(('C1', 'a\nb\nc'), self.send_next())
+        self.assertEqual(0, self.queue.pending_count())
+        self.assertEqual([('chat.postMessage', {'channel': 'C1', 'text': 'a\nb\nc', 'as_user': True})],
+                         self.api.calls)
+
+    def test_coalescing_max_chars_and_round_robin(self):
+        half = 'x' * (OutboundQueue.COALESCE_MAX_CHARS // 2)
+        self.queue.enqueue('C1', half)
+        self.queue.enqueue('C1', half)
+        self.queue.enqueue('C2', 'hi')
+        self.assertEqual(('C1', half), self.send_next())
+        # the rest of C1 is moved after C2
+        self.assertEqual(['C2', 'C1'], list(self.queue.pending.keys()))
+
+    def test_rate_limit_per_channel(self):
+        self.queue.enqueue('C1', 'a')
+        self.send_next()
+        self.queue.enqueue('C1', 'b')
+        self.queue.enqueue('C2', 'c')
+        # C1 has used its token, C2 can still send
+        self.assertEqual(('C2', 'c'), self.send_next())
+        channel_id, wait = self.queue.next_ready_channel()
+        self.assertIsNone(channel_id)
+        self.assertTrue(0 < wait <= 1)
+
+    def test_backoff_per_channel(self):
+        self.api.responses = [{'ok': False, 'error': 'internal_error'}]
+        self.queue.enqueue('C1', 'a')
+        started = time.time()
+        self.send_next()
+        # the failed message is put back, and only C1 backs off
+        self.assertEqual(['a'], list(self.queue.pending['C1']))
+        self.assertEqual(1, self.queue.retries['C1'])
+        self.assertTrue(self.queue.not_before['C1'] >= started + 10)
+        self.queue.enqueue('C2', 'b')
+        self.assertEqual(('C2', 'b'), self.send_next())
+        channel_id, wait = self.queue.next_ready_channel()
+        self.assertIsNone(channel_id)
+        self.assertTrue(9 < wait <= 10)
+
+    def test_backoff_doubled_and_dropped(self):
+        self.api.responses = [{'ok': False, 'error': 'internal_error'}] * 3
+        self.queue.enqueue('C1', 'a')
+        for retries, backoff in [(1, 10), (2, 20)]:
+            self.queue.buckets['C1'] = TokenBucket(1, 1)
+            self.queue.not_before['C1'] = 0
+            started = time.time()
+            self.send_next()
+            self.assertEqual(retries, self.queue.retries['C1'])
+            self.assertTrue(started + backoff <= self.queue.not_before['C1'] <= time.time() + backoff)
+        self.queue.buckets['C1'] = TokenBucket(1, 1)
+        self.queue.not_before['C1'] = 0
+        self.send_next()
+        # dropped after max_retries
+        self.assertEqual(1, self.queue.dropped_count)
+        self.assertEqual(0, self.queue.pending_count())
+        self.assertNotIn('C1', self.queue.retries)
+        self.assertNotIn('C1', self.queue.not_before)
+
+    def test_success_resets_backoff(self):
+        self.api.responses = [{'ok': False, 'error': 'internal_error'}]
+        self.queue.enqueue('C1', 'a')
+        self.send_next()
+        self.queue.buckets['C1'] = TokenBucket(1, 1)
+        self.queue.not_before['C1'] = 0
+        self.send_next()
+        self.assertEqual(1, self.queue.sent_count)
+        self.assertNotIn('C1', self.queue.retries)
+        self.assertNotIn('C1', self.queue.not_before)
+
+    def test_rate_limited_blocks_all_channels(self):
+        self.api.responses = [{'ok': False, 'error': OutboundQueue.ERROR_RATE_LIMITED, 'retry_after': 30}]
+        self.queue.enqueue('C1', 'a')
+        self.queue.enqueue('C2', 'b')
+        self.send_next()
+        channel_id, wait = self.queue.next_ready_channel()
+        self.assertIsNone(channel_id)
+        self.assertTrue(29 < wait <= 30)
+
+    def test_prune_idle_channels(self):
+        for channel_id in ['C1', 'C2', 'C3']:
+            self.queue.enqueue(channel_id, 'a')
+            self.send_next()
+        now = time.time()
+        # C1 is idle, C2 has a pending message, C3 is backing off
+        self.queue.buckets['C1'] = TokenBucket(1, 1)
+        self.queue.buckets['C2'] = TokenBucket(1, 1)
+        self.queue.buckets['C3'] = TokenBucket(1, 1)
+        self.queue.enqueue('C2', 'b')
+        self.queue.retries['C3'] = 1
+        self.queue.not_before['C3'] = now + 10
+        self.queue.not_before['C4'] = now - 1
+        self.queue.prune_idle_channels()
+        self.assertEqual(['C2', 'C3'], sorted(self.queue.buckets.keys()))
+        self.assertEqual(['C3'], list(self.queue.not_before.keys()))
+        self.assertEqual({}, self.queue.retries)
+        self.assertTrue(self.queue.pruned_at >= now)
+
+    def test_prune_keeps_bucket_not_full(self):
+        self.queue.enqueue('C1', 'a')
+        self.send_next()
+        self.queue.prune_idle_channels()
+        # the token is not refilled yet, removing the bucket would allow a burst
+        self.assertIn('C1', self.queue.buckets)
+
+
+if __name__ == '__main__':
+    unittest.main()
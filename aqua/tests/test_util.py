@@ -0,0 +1,38 @@
+# -*- encoding: utf-8 -*-
+
+import unittest
+
+from util import Util
+
+
+class TokenizeTextTest(unittest.TestCase):
+    BOT_ID = 'UBOT00001'
+
+    def test_bot_tag_users_and_words(self):
+        self.assertEqual((True, ['<@UBOT00001>', '<@U12345678>'], ['hi', 'there']),
+                         Util.tokenize_text('<@UBOT00001> hi <@U12345678> there', bot_id=self.BOT_ID))
+
+    def test_without_bot_tag(self):
+        self.assertEqual((False, ['<@U12345678>'], ['hi']),
+                         Util.tokenize_text('hi <@U12345678>', bot_id=self.BOT_ID))
+        self.assertEqual((False, ['<@UBOT00001>'], []), Util.tokenize_text('<@UBOT00001>'))
+
+    def test_user_tag_ids(self):
+        # the ids can be longer than 8 characters, and start with 'W' (Enterprise Grid)
+        self.assertEqual((False, ['<@W1234567890>', '<@U123456789AB>'], []),
+                         Util.tokenize_text('<@W1234567890> <@U123456789AB>'))
+        # too short, or not followed by space
+        self.assertEqual((False, [], ['<@U1234>', '<@U12345678>,', 'hi']),
+                         Util.tokenize_text('<@U1234> <@U12345678>, hi'))
+
+    def test_words(self):
+        self.assertEqual((False, [], ['a', 'b']), Util.tokenize_text('  a \n b\t'))
+        self.assertEqual((False, [], []), Util.tokenize_text(''))
+
+    def test_parse_text_to_users_and_words(self):
+        self.assertEqual((['<@U12345678>'], ['hi', 'there']),
+                         Util.parse_text_to_users_and_words('hi <@U12345678> there'))
+
+
+if __name__ == '__main__':
+    unittest.main()
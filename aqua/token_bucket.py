@@ -0,0 +1,55 @@
+# -*- encoding: utf-8 -*-
+
+import time
+import threading
+
+
+class TokenBucket(object):
+    """
+    The token bucket, there are at most `capacity` tokens, and refilling `rate` tokens per second.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def consume(self, tokens=1):
+        """
+        :param tokens:
+        :return: True if the tokens are consumed, False if there is no enough tokens.
+        """
+        with self.lock:
+            self._refill(time.time())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens=1):
+        """
+        :param tokens:
+        :return: the seconds until there are enough tokens.
+        """
+        with self.lock:
+            self._refill(time.time())
+            if self.tokens >= tokens:
+                return 0.0
+            if self.rate <= 0:
+                return float('inf')
+            return (tokens - self.tokens) / self.rate
+
+    def is_full(self):
+        """
+        :return: True if the bucket is full, it is the same as a new bucket.
+        """
+        with self.lock:
+            self._refill(time.time())
+            return self.tokens >= self.capacity
@@ -2,88 +2,195 @@
 
 import os
 import re
+import time
 import logging
 
 from slack_user import SlackUser
 from slack_channel import SlackChannel
+from directory import Directory
+from outbound_queue import OutboundQueue
+from web_api_transport import WebApiTransport
+from metrics import Metrics
+from backoff import Backoff
 from channels.check_channels import CheckChannels
 
 logger = logging.getLogger(os.path.basename(__file__))
 
 
+class SlackApiError(Exception):
+    """
+    The Web API call failed, ex: the page of users.list is still rate limited after retries.
+    """
+    pass
+
+
 class Util(object):
 
+    DEFAULT_PAGE_SIZE = 200
+    # the retries of rate limited page (or transport error), and the backoff if there is no Retry-After
+    PAGE_MAX_RETRIES = 5
+    PAGE_BACKOFF_BASE_SEC = 1
+    PAGE_BACKOFF_MAX_SEC = 30
+    ERROR_RATE_LIMITED = 'ratelimited'
+
+    @staticmethod
+    def api_call(slack_client, method, **kwargs):
+        """
+        Calling the Web API by the registered WebApiTransport of slack_client, or by slack_client itself.
+        :param slack_client:
+        :param method: ex: users.list
+        :param kwargs: the arguments of method.
+        :return: the response dict.
+        """
+        transport = WebApiTransport.get(slack_client)
+        if transport is not None:
+            return transport.api_call(method, **kwargs)
+        return slack_client.api_call(method, **kwargs)
+
+    @staticmethod
+    def iter_api_pages(slack_client, method, items_key, page_size=None, **kwargs):
+        """
+        Following the cursor pagination of Web API, and yielding the items as each page arrives.
+        Ref: https://api.slack.com/docs/pagination
+        :param slack_client:
+        :param method: ex: users.list
+        :param items_key: the key of items list in the response, ex: members
+        :param page_size: the limit of each page.
+        :param kwargs: other arguments of method.
+        :return: a generator of items (dict).
+        :raise SlackApiError: if any page fails, or is still rate limited after PAGE_MAX_RETRIES retries,
+            so the caller never takes the partial items as the whole list.
+        """
+        cursor = None
+        while True:
+            params = dict(kwargs, limit=page_size or Util.DEFAULT_PAGE_SIZE)
+            if cursor:
+                params['cursor'] = cursor
+            ret = Util.call_api_page(slack_client, method, **params)
+            for obj in ret.get(items_key) or []:
+                yield obj
+            cursor = (ret.get('response_metadata') or {}).get('next_cursor')
+            if not cursor:
+                return
+
+    @staticmethod
+    def call_api_page(slack_client, method, **kwargs):
+        """
+        Calling the Web API for one page, and retrying the rate limited page after Retry-After (the transport
+        returns it as retry_after) or the backoff.
+        The transport error (ex: requests.ConnectionError, socket.error) is retried by the backoff too.
+        :return: the ok response dict.
+        :raise SlackApiError:
+        """
+        backoff = Backoff(Util.PAGE_BACKOFF_BASE_SEC, Util.PAGE_BACKOFF_MAX_SEC)
+        while True:
+            try:
+                ret = Util.api_call(slack_client, method, **kwargs)
+                if ret.get('ok'):
+                    return ret
+                error = ret.get('error')
+                is_retryable = error == Util.ERROR_RATE_LIMITED
+            except (IOError, OSError) as e:
+                # requests.RequestException and socket.error are IOError
+                ret = {}
+                error = '{clz}: {e}'.format(clz=e.__class__.__name__, e=e)
+                is_retryable = True
+            if not is_retryable or backoff.attempts >= Util.PAGE_MAX_RETRIES:
+                raise SlackApiError('Loading {method} failed, {err}.'.format(method=method, err=error))
+            delay = backoff.next_delay()
+            if ret.get('retry_after'):
+                delay = float(ret.get('retry_after'))
+            logger.warning('Loading {method} failed, {err}, retry after {sec:.1f}s.'.format(method=method, err=error,
+                                                                                            sec=delay))
+            time.sleep(delay)
+
+    @staticmethod
+    def iter_slack_objects(slack_client, method, items_key, obj_clz, page_size=None, predicate=None):
+        """
+        :param predicate: a function to filter the item (dict) before creating object.
+        :return: a generator of obj_clz objects.
+        """
+        for obj in Util.iter_api_pages(slack_client, method, items_key, page_size=page_size):
+            if predicate and not predicate(obj):
+                continue
+            try:
+                yield obj_clz(obj)
+            except Exception as e:
+                logger.warning('Loading object failed, {obj}.\n{e}'.format(obj=obj, e=e))
+
     @staticmethod
-    def load_slack_users(slack_client):
+    def iter_slack_users(slack_client, page_size=None, predicate=None):
+        """
+        https://api.slack.com/methods/users.list
+        :param slack_client:
+        :param page_size:
+        :param predicate: a function to filter the user (dict), ex: skipping deleted users.
+        :return: a generator of user objects.
+        """
+        return Util.iter_slack_objects(slack_client, 'users.list', 'members', SlackUser,
+                                       page_size=page_size, predicate=predicate)
+
+    @staticmethod
+    def iter_slack_channels(slack_client, page_size=None, predicate=None):
+        """
+        https://api.slack.com/methods/channels.list
+        :param slack_client:
+        :param page_size:
+        :param predicate: a function to filter the channel (dict).
+        :return: a generator of limited channel objects.
+        """
+        return Util.iter_slack_objects(slack_client, 'channels.list', 'channels', SlackChannel,
+                                       page_size=page_size, predicate=predicate)
+
+    @staticmethod
+    def load_slack_users(slack_client, page_size=None, predicate=None):
         """
         https://api.slack.com/methods/users.list
         :return: a list of user objects.
         """
-        result_list = []
-        ret = slack_client.api_call('users.list')
-        if ret.get('ok'):
-            origin_list = ret.get('members')
-            for obj in origin_list:
-                try:
-                    result_list.append(SlackUser(obj))
-                except Exception as e:
-                    logger.warn('Loading object failed, {obj}.\n{e}'.format(obj=obj, e=e))
-        else:
-            logger.warn('Loading Slack users list failed.')
-        return result_list
+        return list(Util.iter_slack_users(slack_client, page_size=page_size, predicate=predicate))
 
     @staticmethod
-    def load_slack_channels(slack_client):
+    def load_slack_channels(slack_client, page_size=None, predicate=None):
         """
         https://api.slack.com/methods/channels.list
         :return: a list of limited channel objects.
         """
-        result_list = []
-        ret = slack_client.api_call('channels.list')
-        if ret.get('ok'):
-            origin_list = ret.get('channels')
-            for obj in origin_list:
-                try:
-                    result_list.append(SlackChannel(obj))
-                except Exception as e:
-                    logger.warn('Loading object failed, {obj}.\n{e}'.format(obj=obj, e=e))
-        else:
-            logger.warn('Loading Slack channels list failed.')
-        return result_list
+        return list(Util.iter_slack_channels(slack_client, page_size=page_size, predicate=predicate))
 
     @staticmethod
     def find_by_id(obj_list, obj_id):
         """
         Finding item from list by object id.
         Ref: load_slack_users(), and load_slack_channels()
-        :param obj_list:
+        :param obj_list: a list of objects, or Directory.
         :param obj_id:
         :return:
         """
-        result = [obj for obj in obj_list if obj.id == obj_id]
-        if len(result) > 0:
-            return result[0]
-        else:
-            return None
+        if isinstance(obj_list, Directory):
+            return obj_list.get_by_id(obj_id)
+        return next((obj for obj in obj_list if obj.id == obj_id), None)
 
     @staticmethod
     def find_by_name(obj_list, name):
         """
         Finding item from list by object name.
         Ref: load_slack_users(), and load_slack_channels()
-        :param obj_list:
+        :param obj_list: a list of objects, or Directory. (The name of Directory is case-insensitive.)
         :param name:
         :return:
         """
-        result = [obj for obj in obj_list if obj.name == name]
-        if len(result) > 0:
-            return result[0]
-        else:
-            return None
+        if isinstance(obj_list, Directory):
+            return obj_list.get_by_name(name)
+        return next((obj for obj in obj_list if obj.name == name), None)
 
     @staticmethod
-    def find_user(slack_client, search_string):
+    def find_user(slack_client, search_string, directory=None):
         """
+        Finding user by id or name from the users Directory,
+        and falling back to the slack_client state if it is not in directory, the linear search of slack_client
+        state is skipped if the same search string has just missed.
+
         User object has following attributes:
             - name
             - tz
@@ -96,13 +203,25 @@ class Util(object):
                 SearchDict
         :param slack_client:
         :param search_string:
+        :param directory: the users Directory.
         :return:
         """
-        return slack_client.server.users.find(search_string)
+        if directory is None:
+            return slack_client.server.users.find(search_string)
+        user_obj = directory.find(search_string)
+        if user_obj is None and search_string and not directory.is_miss(search_string):
+            user_obj = slack_client.server.users.find(search_string)
+            if user_obj is None:
+                directory.add_miss(search_string)
+        return user_obj
 
     @staticmethod
-    def find_channel(slack_client, search_string):
+    def find_channel(slack_client, search_string, directory=None):
         """
+        Finding channel by id or name from the channels Directory,
+        and falling back to the slack_client state if it is not in directory. (ex: DM channels)
+        The linear search of slack_client state is skipped if the same search string has just missed.
+
         Channel object has following attributes:
             - name
             - id
@@ -114,9 +233,41 @@ class Util(object):
                 SearchList
         :param slack_client:
         :param search_string:
+        :param directory: the channels Directory.
         :return:
         """
-        return slack_client.server.channels.find(search_string)
+        if directory is None:
+            return slack_client.server.channels.find(search_string)
+        channel_obj = directory.find(search_string)
+        if channel_obj is None and search_string and not directory.is_miss(search_string):
+            channel_obj = slack_client.server.channels.find(search_string)
+            if channel_obj is None:
+                directory.add_miss(search_string)
+        return channel_obj
+
+    # one pass scanner of message, a token is either a whole user tag (ex: <@U12345678>, <@W1234567890>), or a word
+    TOKEN_SCANNER = re.compile(r'(<@[UW]\w{8,}>)(?=\s|$)|(\S+)')
+
+    @staticmethod
+    def tokenize_text(text, bot_id=None):
+        """
+        Parsing the input message text in one pass.
+        :param text: input message
+        :param bot_id: the user id of bot.
+        :return: (Boolean, List, List). 1st is Bot be tagged. 2nd a list of user tag. 3rd a list of words.
+        """
+        bot_id_tag = '<@{bot_id}>'.format(bot_id=bot_id) if bot_id else None
+        is_tag_bot = False
+        users_list = []
+        words_list = []
+        for user_tag, word in Util.TOKEN_SCANNER.findall(text):
+            if user_tag:
+                users_list.append(user_tag)
+                if user_tag == bot_id_tag:
+                    is_tag_bot = True
+            else:
+                words_list.append(word)
+        return is_tag_bot, users_list, words_list
 
     @staticmethod
     def parse_text_to_users_and_words(text):
@@ -127,10 +278,7 @@ class Util(object):
         :param text: input message
         :return: the (list, list), which first is a list of all user tag id in message, second value is a list of every word of text message
         """
-        user_tag_pattern = r'^<@U[\w]{8}>$'
-        text_items = text.split()
-        users_list = [item for item in text_items if re.match(user_tag_pattern, item)]
-        words_list = [item for item in text_items if not re.match(user_tag_pattern, item)]
+        _, users_list, words_list = Util.tokenize_text(text)
         return users_list, words_list
 
     @staticmethod
@@ -149,18 +297,25 @@ class Util(object):
     def send(send_message, channel_obj, slack_client):
         """
         Sending message to Channel on Slack by slack_client.
+        If there is the registered OutboundQueue of slack_client, the message is queued and sent asynchronously.
         :param send_message:
         :param channel_obj:
         :param slack_client:
         :return:
         """
-        channel_checker = CheckChannels()
-        if channel_checker.is_readonly(channel_obj):
-            logger.info('Skip sending message.')
-            return False
+        with Metrics.get_instance().timer('send'):
+            channel_checker = CheckChannels.get_instance()
+            if channel_checker.is_readonly(channel_obj):
+                logger.info('Skip sending message.')
+                return False
+
+            outbound_queue = OutboundQueue.get(slack_client)
+            if outbound_queue is not None:
+                return outbound_queue.enqueue(channel_obj.id, send_message)
 
-        ret = slack_client.api_call("chat.postMessage", channel=channel_obj.id, text=send_message, as_user=True)
-        if not ret.get('ok'):
-            logger.error('Sending message failed!\n{ret}'.format(ret=ret))
-            return False
-        return True
+            ret = Util.api_call(slack_client, "chat.postMessage",
+                                channel=channel_obj.id, text=send_message, as_user=True)
+            if not ret.get('ok'):
+                logger.error('Sending message failed!\n{ret}'.format(ret=ret))
+                return False
+            return True
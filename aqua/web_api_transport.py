@@ -0,0 +1,122 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import json
+import time
+import logging
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from latency_stats import LatencyStats
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+class WebApiTransport(object):
+    """
+    The Web API transport with a persistent connection pool and keep-alive,
+    so the Web API calls do not pay the TCP and TLS handshake every time.
+    It records the latency of each method, and the base url can be changed to a local HTTP stand-in.
+
+    Please register the transport of slack_client, then Util.api_call() will use it.
+    """
+    DEFAULT_BASE_URL = 'https://slack.com/api/'
+    DEFAULT_POOL_SIZE = 10
+    DEFAULT_TIMEOUT_SEC = 10
+    USER_AGENT = 'aqua-slack'
+    ERROR_RATE_LIMITED = 'ratelimited'
+
+    _registry = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def register(cls, slack_client, transport):
+        cls._registry[slack_client] = transport
+
+    @classmethod
+    def unregister(cls, slack_client):
+        cls._registry.pop(slack_client, None)
+
+    @classmethod
+    def get(cls, slack_client):
+        """
+        :param slack_client:
+        :return: the registered WebApiTransport of slack_client, or None.
+        """
+        return cls._registry.get(slack_client)
+
+    def __init__(self, token, base_url=None, pool_size=None, timeout=None, proxies=None):
+        """
+        :param token: the API token.
+        :param base_url: ex: https://slack.com/api/
+        :param pool_size: the max number of kept connections.
+        :param timeout: seconds, the default timeout of request.
+        :param proxies: same as slackclient, ex: {'https': 'https://127.0.0.1:443'}
+        """
+        self.token = token
+        self.base_url = (base_url or self.DEFAULT_BASE_URL).rstrip('/') + '/'
+        self.timeout = timeout or self.DEFAULT_TIMEOUT_SEC
+        pool_size = pool_size or self.DEFAULT_POOL_SIZE
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'User-Agent': self.USER_AGENT, 'Connection': 'keep-alive'})
+        if proxies:
+            self.session.proxies.update(proxies)
+        # {method: LatencyStats}
+        self.stats = {}
+
+    def get_stats(self, method):
+        stats = self.stats.get(method)
+        if stats is None:
+            stats = self.stats.setdefault(method, LatencyStats(method))
+        return stats
+
+    def api_call(self, method, timeout=None, **kwargs):
+        """
+        Calling the Web API, same interface as slackclient api_call().
+        Ref: https://api.slack.com/web
+        :param method: ex: chat.postMessage
+        :param timeout: seconds.
+        :param kwargs: the arguments of method.
+        :return: the response dict. The rate limited (HTTP 429) response is {'ok': False, 'error': 'ratelimited',
+            'retry_after': seconds}.
+        """
+        post_data = {}
+        for key, value in kwargs.items():
+            post_data[key] = value if isinstance(value, string_types) else json.dumps(value)
+        post_data['token'] = self.token
+
+        started = time.time()
+        try:
+            response = self.session.post(self.base_url + method, data=post_data, timeout=timeout or self.timeout)
+        finally:
+            self.get_stats(method).add(time.time() - started)
+
+        if response.status_code == 429:
+            return {'ok': False,
+                    'error': self.ERROR_RATE_LIMITED,
+                    'retry_after': response.headers.get('Retry-After')}
+        try:
+            return response.json()
+        except ValueError:
+            logger.error('Invalid response of {method}, HTTP {code}.'.format(method=method,
+                                                                             code=response.status_code))
+            return {'ok': False, 'error': 'invalid_response', 'status_code': response.status_code}
+
+    def format_stats(self):
+        """
+        :return: the latency summary of each method.
+        """
+        return '\n'.join(self.stats[method].format_summary() for method in sorted(self.stats))
+
+    def close(self):
+        self.session.close()
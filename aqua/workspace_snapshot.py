@@ -0,0 +1,125 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import gzip
+import json
+import time
+import logging
+
+from directory import Directory
+from slack_user import SlackUser
+from slack_channel import SlackChannel
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class WorkspaceSnapshot(object):
+    """
+    The on-disk snapshot of workspace, which keeps the users and channels directories, the DM channel ids and Bot id.
+
+    The Bot can start serving from the snapshot right after connected, and reconcile the directories in background.
+    The snapshot is a gzip compressed JSON file, and it is written to a temp file then renamed, so the reader never
+    sees a partial file.
+    """
+    VERSION = 1
+    # the fastest level, the snapshot is written every housekeeping interval
+    COMPRESS_LEVEL = 1
+    # the users and channels are encoded in batches, so the snapshot which is written in background does not hold
+    # the GIL for seconds by one json.dumps() of whole workspace
+    ENCODE_BATCH_SIZE = 500
+    SEPARATORS = (',', ':')
+
+    def __init__(self, path, max_age_sec=None):
+        """
+        :param path: the path of snapshot file.
+        :param max_age_sec: the snapshot which is older than it will be ignored. None for no limit.
+        """
+        self.path = path
+        self.max_age_sec = max_age_sec
+
+    def load(self, bot_name):
+        """
+        Loading the snapshot.
+        :param bot_name: the snapshot must be written by the same Bot.
+        :return: a dict with 'bot_id', 'users_directory', 'channels_directory', 'dm_channel_ids' and 'saved_at',
+        or None if there is no usable snapshot.
+        """
+        if not os.path.isfile(self.path):
+            return None
+        try:
+            with gzip.open(self.path, 'rb') as f:
+                data = json.loads(f.read().decode('utf-8'))
+        except Exception as e:
+            logger.warning('Can not load snapshot {path}, {err}'.format(path=self.path, err=e))
+            return None
+
+        if data.get('version') != self.VERSION or data.get('bot_name') != bot_name:
+            logger.info('Ignore snapshot {path}, version or bot name mismatched.'.format(path=self.path))
+            return None
+        saved_at = data.get('saved_at', 0)
+        if self.max_age_sec is not None and time.time() - saved_at > self.max_age_sec:
+            logger.info('Ignore snapshot {path}, it is older than {age} sec.'.format(path=self.path,
+                                                                                    age=self.max_age_sec))
+            return None
+        return {
+            'bot_id': data.get('bot_id'),
+            'users_directory': Directory(SlackUser(user) for user in data.get('users', [])),
+            'channels_directory': Directory(SlackChannel(channel) for channel in data.get('channels', [])),
+            'dm_channel_ids': set(data.get('dm_channel_ids', [])),
+            'saved_at': saved_at,
+        }
+
+    def save(self, bot_name, bot_id, users_directory, channels_directory, dm_channel_ids):
+        """
+        Writing the snapshot.
+        :param bot_name:
+        :param bot_id:
+        :param users_directory: Directory of SlackUser.
+        :param channels_directory: Directory of SlackChannel.
+        :param dm_channel_ids: the ids of DM channels.
+        :return: True if saved.
+        """
+        header = {
+            'version': self.VERSION,
+            'saved_at': time.time(),
+            'bot_name': bot_name,
+            'bot_id': bot_id,
+            'dm_channel_ids': sorted(dm_channel_ids),
+        }
+        # the copies of directories, they may be changed by RTM events while writing
+        users = list(users_directory)
+        channels = list(channels_directory)
+        tmp_path = '{path}.tmp'.format(path=self.path)
+        try:
+            with gzip.open(tmp_path, 'wb', self.COMPRESS_LEVEL) as f:
+                # same JSON as dumping the whole dict, {"version":...,"users":[...],"channels":[...]}
+                f.write(json.dumps(header, separators=self.SEPARATORS)[:-1].encode('utf-8'))
+                self.write_array(f, 'users', users)
+                self.write_array(f, 'channels', channels)
+                f.write(b'}')
+            # os.rename can not replace the existing file on Windows
+            if os.name == 'nt' and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmp_path, self.path)
+        except Exception as e:
+            logger.warning('Can not save snapshot {path}, {err}'.format(path=self.path, err=e))
+            return False
+        logger.info('Saved snapshot {path}, {u} users, {c} channels.'.format(path=self.path,
+                                                                             u=len(users),
+                                                                             c=len(channels)))
+        return True
+
+    def write_array(self, f, key, objs):
+        """
+        Writing the ',"key":[...]' of objects, batch by batch.
+        :param f: the file.
+        :param key: ex: users
+        :param objs: the objects which have to_dict().
+        """
+        f.write(',"{key}":['.format(key=key).encode('utf-8'))
+        for start in range(0, len(objs), self.ENCODE_BATCH_SIZE):
+            batch = json.dumps([obj.to_dict() for obj in objs[start:start + self.ENCODE_BATCH_SIZE]],
+                               separators=self.SEPARATORS)
+            # joining the arrays of batches into one array
+            f.write(((',' if start else '') + batch[1:-1]).encode('utf-8'))
+        f.write(b']')